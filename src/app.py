@@ -1,20 +1,39 @@
 # A simple molecular structure editor
+from pathlib import Path
 import sys 
 
-from PyQt5 import QtWidgets,QtGui
+from PyQt5 import QtCore,QtWidgets,QtGui
+from PyQt5.QtCore import Qt
 from canvas.controller import CanvasController
+from canvas.event_trace import EventRecorder
+from canvas.export import VectorExporter
+from canvas.local_server import ScriptServer
 from canvas.mode_button import Mode, ModeButton
 from canvas.model import CanvasModel
+from canvas.paged_model import PagedCanvasModel
 from canvas.view import CanvasView
+from core import Atom
+from journal import Journal, build_mols, capture_document
+from memprofile import MemoryProfiler, instrument
+from paged_store import PagedStore
+from scripting import ScriptSession
+from smiles import depict_smiles, read_smiles_file
+
+AUTOSAVE_DIR = Path.home() / ".alchemy-editor" / "autosave"
 
 
 class ChemApp(QtWidgets.QMainWindow):
 
-    def __init__(self,qapp):
+    # Emitted by the autosave writer thread, Qt delivers it on the GUI thread:
+    autosave_failed = QtCore.pyqtSignal(str)
+
+    def __init__(self,qapp,model=None,memprofile=None,script_socket=None):
         self.qapp = qapp
         super().__init__()
 
-        self.canvas = CanvasController(chem_app=self,view=CanvasView(),model=CanvasModel(),)
+        if model is None:
+            model = CanvasModel()
+        self.canvas = CanvasController(chem_app=self,view=CanvasView(),model=model,)
 
         w_vert = QtWidgets.QWidget()
         l_vert = QtWidgets.QVBoxLayout()
@@ -39,7 +58,63 @@ class ChemApp(QtWidgets.QMainWindow):
         l_vert.addWidget(self.label_messages)
         self.setCentralWidget(w_vert)
 
+        self.recorder = None
+        self.memprofile = memprofile
+        if memprofile is not None:
+            self.profiler = MemoryProfiler()
+            instrument(self.profiler,self.canvas)
+            self.profiler.start()
         self._createMenuBar()
+        self._start_autosave()
+
+        self.script_server = None
+        if script_socket is not None:
+            # Lets other programs edit the document, see scripting.py:
+            model = self.canvas.model
+            exporter = VectorExporter(self.canvas.view.chem_style)
+            session = ScriptSession(model,render=lambda path: exporter.export(model,path))
+            self.script_server = ScriptServer(session,script_socket)
+
+    def _start_autosave(self):
+        self.journal = None
+        if isinstance(self.canvas.model,PagedCanvasModel):
+            # Paged sheets have no journal. Instead, changed pages are
+            # written back to their store every half minute:
+            self._flush_timer = QtCore.QTimer(self)
+            self._flush_timer.timeout.connect(self.canvas.model.flush)
+            self._flush_timer.start(30_000)
+            return
+        # Journals of other running editors are locked and left alone:
+        stale = Journal.claim_stale(AUTOSAVE_DIR)
+        if stale:
+            answer = QtWidgets.QMessageBox.question(self,"Recover document","The editor was not closed properly. Recover the unsaved document?")
+            n_atoms = 0
+            for directory in stale:
+                if answer == QtWidgets.QMessageBox.Yes:
+                    state = Journal.recover(directory)
+                    state.renumber(Atom._next_uid)
+                    self.canvas.model.add_mols(build_mols(state.atoms,state.bonds))
+                    n_atoms += len(state.atoms)
+                Journal.discard(directory)
+            if answer == QtWidgets.QMessageBox.Yes:
+                self.display_message(f"Recovered {n_atoms} atoms")
+        self.autosave_failed.connect(self.display_message)
+        self.journal = Journal(AUTOSAVE_DIR,on_error=self.autosave_failed.emit)
+        self.journal.start(self.canvas.model)
+
+    def closeEvent(self, evt: QtGui.QCloseEvent) -> None:
+        if isinstance(self.canvas.model,PagedCanvasModel):
+            self.canvas.model.flush()
+        if self.recorder is not None:
+            self.recorder.close()
+        if self.script_server is not None:
+            self.script_server.close()
+        if self.journal is not None:
+            self.journal.close(clean=True)
+        if self.memprofile is not None:
+            Path(self.memprofile).write_text(self.profiler.report() + "\n")
+            self.profiler.stop()
+        return super().closeEvent(evt)
 
     def keyPressEvent(self, evt: QtGui.QKeyEvent) -> None:
         # Controller will handle them!
@@ -54,10 +129,77 @@ class ChemApp(QtWidgets.QMainWindow):
         # Creating menus using a QMenu object
         fileMenu = QtWidgets.QMenu("&File", self)
         menuBar.addMenu(fileMenu)
+        fileMenu.addAction("Export as SVG...", lambda: self.export_document("svg"))
+        fileMenu.addAction("Export as PDF...", lambda: self.export_document("pdf"))
+        fileMenu.addAction("Save as paged sheet...", self.save_paged_sheet)
+        fileMenu.addAction("Import SMILES...", self.import_smiles)
         # Creating menus using a title
         editMenu = menuBar.addMenu("&Edit")
+        editMenu.addAction("Copy", self.canvas.copy_selection)
+        editMenu.addAction("Paste", self.canvas.paste)
+        editMenu.addAction("Flip horizontally", lambda: self.canvas.flip_selection(90))
+        editMenu.addAction("Flip vertically", lambda: self.canvas.flip_selection(0))
+        editMenu.addAction("Arrange molecules", self.canvas.arrange_molecules)
+        editMenu.addAction("Select atoms of current element", self.canvas.select_matching_atoms)
+        editMenu.addAction("Highlight atoms of current element", self.canvas.highlight_matching_atoms)
+        editMenu.addAction("Highlight duplicate molecules", self.canvas.highlight_duplicates)
+        editMenu.addAction("Clear highlights", self.canvas.clear_highlights)
+        editMenu.addAction("Select clashes", self.canvas.select_clashes)
+        showClashes = editMenu.addAction("Show clashes")
+        showClashes.setCheckable(True)
+        showClashes.toggled.connect(self.canvas.set_show_clashes)
+        toolsMenu = menuBar.addMenu("&Tools")
+        recordTrace = toolsMenu.addAction("Record input trace")
+        recordTrace.setCheckable(True)
+        recordTrace.toggled.connect(self.record_trace)
         helpMenu = menuBar.addMenu("&Help")
 
+    def export_document(self, fmt:str):
+        path,_ = QtWidgets.QFileDialog.getSaveFileName(self,f"Export as {fmt.upper()}","",f"{fmt.upper()} files (*.{fmt})")
+        if not path:
+            return
+        if not path.lower().endswith("." + fmt):
+            path += "." + fmt
+        VectorExporter(self.canvas.view.chem_style).export(self.canvas.model,path)
+        self.display_message(f"Exported document to {path}")
+
+    def save_paged_sheet(self):
+        # Paged sheets are opened with: python src/app.py --paged <directory>
+        path = QtWidgets.QFileDialog.getExistingDirectory(self,"Save as paged sheet")
+        if not path:
+            return
+        PagedStore.from_document(path,capture_document(self.canvas.model))
+        self.display_message(f"Saved paged sheet to {path}")
+
+    def import_smiles(self):
+        path,_ = QtWidgets.QFileDialog.getOpenFileName(self,"Import SMILES","","SMILES files (*.smi *.smiles *.txt);;All files (*)")
+        if not path:
+            return
+        smiles,_ = read_smiles_file(path)
+        # Large files are depicted by a process pool, which takes a few seconds:
+        QtWidgets.QApplication.setOverrideCursor(Qt.CursorShape.WaitCursor)
+        try:
+            frags = depict_smiles(smiles)
+            self.canvas.model.add_fragments([frag for frag in frags if frag is not None])
+        finally:
+            QtWidgets.QApplication.restoreOverrideCursor()
+        failed = sum(frag is None for frag in frags)
+        msg = f"Imported {len(frags) - failed} structures from {path}"
+        self.display_message(msg + (f", {failed} could not be read" if failed else ""))
+
+    def record_trace(self, start:bool):
+        if start:
+            path,_ = QtWidgets.QFileDialog.getSaveFileName(self,"Record input trace","trace.jsonl","Input traces (*.jsonl)")
+            if not path:
+                self.sender().setChecked(False)
+                return
+            self.recorder = EventRecorder(self.canvas,path)
+            self.display_message(f"Recording input events to {path}")
+        elif self.recorder is not None:
+            self.recorder.close()
+            self.display_message(f"Recorded input events to {self.recorder.path}")
+            self.recorder = None
+
     def display_message(self,msg:str):
         self.label_messages.setText(msg)
 
@@ -70,7 +212,18 @@ class ChemApp(QtWidgets.QMainWindow):
 
 if __name__ == '__main__':
     app = QtWidgets.QApplication(sys.argv)
-    window = ChemApp(qapp=app)
+    model = None
+    if "--paged" in sys.argv:
+        # Opens a document that is too large to be kept in memory:
+        model = PagedCanvasModel(PagedStore(sys.argv[sys.argv.index("--paged") + 1]))
+    memprofile = None
+    if "--memprofile" in sys.argv:
+        # Measures the memory of every operation and writes a report on close:
+        memprofile = sys.argv[sys.argv.index("--memprofile") + 1]
+    script_socket = None
+    if "--script-socket" in sys.argv:
+        script_socket = sys.argv[sys.argv.index("--script-socket") + 1]
+    window = ChemApp(qapp=app,model=model,memprofile=memprofile,script_socket=script_socket)
     window.show()
     app.exec()
 
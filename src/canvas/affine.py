@@ -0,0 +1,88 @@
+
+import math
+
+import numpy as np
+
+from core import Atom
+
+
+def rotation(angle:float) -> np.ndarray:
+    """
+    The 2x2 matrix rotating by angle (in degrees). World y points
+    down, so positive angles turn clockwise on screen.
+
+    >>> np.round(rotation(90) @ [1.,0.],6).tolist()
+    [0.0, 1.0]
+    """
+    c,s = math.cos(math.radians(angle)),math.sin(math.radians(angle))
+    return np.array([[c,-s],[s,c]])
+
+
+def reflection(axis_angle:float) -> np.ndarray:
+    """
+    The 2x2 matrix mirroring at a line through the origin that
+    encloses axis_angle (in degrees) with the x axis.
+
+    >>> np.round(reflection(90) @ [1.,2.],6).tolist()
+    [-1.0, 2.0]
+    """
+    c,s = math.cos(math.radians(2*axis_angle)),math.sin(math.radians(2*axis_angle))
+    return np.array([[c,s],[s,-c]])
+
+
+def scaling(factor:float) -> np.ndarray:
+    return np.array([[factor,0.],[0.,factor]])
+
+
+class SelectionTransform:
+    """
+    Applies affine transforms to a fixed set of atoms about their
+    centroid. The positions of all atoms are gathered into one array
+    when the transform starts and every atom's pos becomes a view of
+    its row until the transform is committed or cancelled. Applying
+    a transform is then a single matrix product written into that
+    array: no matter how many atoms there are, nothing is allocated
+    per atom or per mouse move.
+
+    >>> a = [Atom('C',np.array([0.,0.])),Atom('C',np.array([2.,0.]))]
+    >>> t = SelectionTransform(a)
+    >>> t.apply(rotation(90))
+    >>> np.round([atm.pos for atm in a],6).tolist()
+    [[1.0, -1.0], [1.0, 1.0]]
+    >>> t.cancel()
+    >>> [atm.pos.tolist() for atm in a]
+    [[0.0, 0.0], [2.0, 0.0]]
+    >>> a[0].pos.base is None
+    True
+    """
+
+    def __init__(self, atoms:list[Atom]) -> None:
+        self.atoms = atoms
+        self.base = np.array([atm.pos for atm in atoms],dtype=float).reshape((-1,2))
+        self.center = self.base.mean(axis=0) if len(atoms) else np.zeros(2)
+        self._rel = self.base - self.center
+        self.pos = self.base.copy()
+        for i,atm in enumerate(atoms):
+            atm.pos = self.pos[i]
+
+    def __len__(self) -> int:
+        return len(self.atoms)
+
+    def apply(self, matrix:np.ndarray, offset=(0.,0.)) -> None:
+        """
+        Moves every atom to matrix @ (base - center) + center + offset,
+        always starting over from the positions at the start.
+        """
+        np.matmul(self._rel,matrix.T,out=self.pos)
+        self.pos += self.center
+        self.pos += offset
+
+    def detach(self) -> None:
+        # Every atom gets its own copy of its position again, so that
+        # the atoms do not keep the array of the transform alive:
+        for i,atm in enumerate(self.atoms):
+            atm.pos = self.pos[i].copy()
+
+    def cancel(self) -> None:
+        self.pos[:] = self.base
+        self.detach()
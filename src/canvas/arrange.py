@@ -0,0 +1,43 @@
+
+import numpy as np
+
+
+def group_bounding_boxes(coords:np.ndarray, labels:np.ndarray, n_groups:int) -> tuple[np.ndarray,np.ndarray]:
+    """
+    Returns the lower and upper corners of the bounding box of every
+    group of points, labels holds the group of every point. Groups
+    without points get an empty (inverted) box.
+
+    >>> lo,hi = group_bounding_boxes(np.array([[0.,0.],[5.,1.],[2.,2.]]),np.array([1,0,1]),2)
+    >>> lo.tolist(), hi.tolist()
+    ([[5.0, 1.0], [0.0, 0.0]], [[5.0, 1.0], [2.0, 2.0]])
+    """
+    lo = np.full((n_groups,2),np.inf)
+    hi = np.full((n_groups,2),-np.inf)
+    np.minimum.at(lo,labels,coords)
+    np.maximum.at(hi,labels,coords)
+    return lo,hi
+
+
+def shelf_pack(widths:np.ndarray, heights:np.ndarray, shelf_width:float, gap:float=0.,) -> np.ndarray:
+    """
+    Packs rectangles into shelves (rows) of the given width, tallest
+    first, each shelf as high as its first rectangle (next fit
+    decreasing height). Sorting dominates, so this takes O(n log n).
+    Returns the offset of every rectangle's lower corner.
+
+    >>> shelf_pack(np.array([2.,2.,2.]),np.array([1.,3.,2.]),5.).tolist()
+    [[0.0, 3.0], [0.0, 0.0], [2.0, 0.0]]
+    """
+    order = np.argsort(-heights,kind="stable")
+    offsets = np.zeros((len(widths),2))
+    x = y = shelf_height = 0.
+    for i,w,h in zip(order.tolist(),widths[order].tolist(),heights[order].tolist()):
+        if x > 0 and x + w > shelf_width:
+            # Start a new shelf below the current one:
+            y += shelf_height + gap
+            x = shelf_height = 0.
+        offsets[i] = x,y
+        x += w + gap
+        shelf_height = max(shelf_height,h)
+    return offsets
@@ -0,0 +1,64 @@
+
+from typing import Any
+
+from core import Atom
+
+
+class AtomIndex:
+    """
+    An inverted index from the value of an atom attribute (e.g. its
+    symbol) to all atoms carrying that value.
+
+    The index only holds atoms, not molecules, so merging molecules
+    does not affect it. It has to be told about new atoms and about
+    atoms whose attribute changed, though.
+    """
+
+    def __init__(self, attr:str) -> None:
+        self.attr = attr
+        # Dicts keep insertion order, so lookups are deterministic:
+        self._atoms:dict[Any,dict[int,Atom]] = {}
+        self._value_of:dict[int,Any] = {}
+
+    def __len__(self) -> int:
+        return len(self._value_of)
+
+    def add(self, atoms:list[Atom]) -> None:
+        for atm in atoms:
+            self.update(atm)
+
+    def update(self, atm:Atom) -> None:
+        """
+        (Re-)indexes an atom under the current value of its attribute.
+        """
+        value = getattr(atm,self.attr)
+        key = id(atm)
+        if key in self._value_of:
+            old_value = self._value_of[key]
+            if old_value == value:
+                return
+            self._remove_key(key,old_value)
+        self._atoms.setdefault(value,{})[key] = atm
+        self._value_of[key] = value
+
+    def remove(self, atoms:list[Atom]) -> None:
+        for atm in atoms:
+            key = id(atm)
+            if key in self._value_of:
+                self._remove_key(key,self._value_of[key])
+
+    def _remove_key(self, key:int, value) -> None:
+        del self._value_of[key]
+        bucket = self._atoms[value]
+        del bucket[key]
+        if not bucket:
+            del self._atoms[value]
+
+    def lookup(self, value) -> list[Atom]:
+        return list(self._atoms.get(value,{}).values())
+
+    def count(self, value) -> int:
+        return len(self._atoms.get(value,{}))
+
+    def values(self) -> list:
+        return list(self._atoms)
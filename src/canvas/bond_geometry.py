@@ -0,0 +1,251 @@
+from typing import Optional
+
+import numpy as np
+
+
+def bond_line_offsets(chem_style) -> dict[int,list[float]]:
+    # Every line of a bond is parallel to the bond axis, shifted
+    # orthogonally by one of these offsets:
+    dbs = chem_style.double_bond_spread
+    tbs = chem_style.triple_bond_spread
+    return {1: [0], 2: [dbs,-dbs], 3: [tbs,-tbs,0],}
+
+
+def bond_line_segments(p1:np.ndarray, p2:np.ndarray, orders:np.ndarray, chem_style, ring_centers:Optional[np.ndarray]=None,) -> tuple[np.ndarray,np.ndarray]:
+    """
+    Computes the lines that make up a batch of bonds from p1 to p2
+    (both of shape (n,2)). Returns the segments as an (m,4) array of
+    (x1,y1,x2,y2) rows and, for every segment, the index of its bond.
+
+    ring_centers holds the centroid of the ring of every bond (NaN
+    outside of rings). Double bonds within rings are drawn as a line
+    on the bond axis and a shorter one on the inner side of the ring.
+
+    >>> class Style:
+    ...     double_bond_spread = 3
+    ...     triple_bond_spread = 4
+    >>> p1 = np.array([[0.,0.],[0.,0.]])
+    >>> p2 = np.array([[10.,0.],[0.,10.]])
+    >>> segs, idx = bond_line_segments(p1,p2,np.array([1,2]),Style())
+    >>> segs.tolist()
+    [[0.0, 0.0, 10.0, 0.0], [-3.0, 0.0, -3.0, 10.0], [3.0, 0.0, 3.0, 10.0]]
+    >>> idx.tolist()
+    [0, 1, 1]
+    >>> Style.inner_bond_shortening = 0.1
+    >>> centers = np.array([[np.nan,np.nan],[5.,5.]])
+    >>> segs, idx = bond_line_segments(p1,p2,np.array([2,2]),Style(),centers)
+    >>> segs.tolist()
+    [[0.0, 3.0, 10.0, 3.0], [0.0, -3.0, 10.0, -3.0], [0.0, 0.0, 0.0, 10.0], [6.0, 1.0, 6.0, 9.0]]
+    """
+    eta = 0.0001
+    p1 = np.asarray(p1,dtype=float).reshape((-1,2))
+    p2 = np.asarray(p2,dtype=float).reshape((-1,2))
+    orders = np.asarray(orders).reshape(-1)
+
+    # The bond axis rotated by 90 degrees:
+    v_12 = p2 - p1
+    v_orth = np.stack([-v_12[:,1],v_12[:,0]],axis=1)
+    norm_vo = np.maximum(np.linalg.norm(v_orth,axis=1),eta)
+    v_orth /= norm_vo[:,None]
+
+    if ring_centers is not None:
+        ring_centers = np.asarray(ring_centers,dtype=float).reshape((-1,2))
+        in_ring = (orders == 2) & np.isfinite(ring_centers).all(axis=1)
+    else:
+        in_ring = np.zeros(len(orders),dtype=bool)
+
+    segs, idx = [], []
+    for order,offsets in bond_line_offsets(chem_style).items():
+        bnd_idx = np.flatnonzero((orders == order) & ~in_ring)
+        if not len(bnd_idx):
+            continue
+        for offset in offsets:
+            shift = offset * v_orth[bnd_idx]
+            segs.append(np.concatenate([p1[bnd_idx] + shift,p2[bnd_idx] + shift],axis=1))
+            idx.append(bnd_idx)
+
+    bnd_idx = np.flatnonzero(in_ring)
+    if len(bnd_idx):
+        # The inner line keeps the distance of the two lines of other
+        # double bonds and is shortened at both ends:
+        side = np.sign(((ring_centers[bnd_idx] - p1[bnd_idx]) * v_orth[bnd_idx]).sum(axis=1))
+        shift = (2 * chem_style.double_bond_spread * side)[:,None] * v_orth[bnd_idx]
+        cut = chem_style.inner_bond_shortening * v_12[bnd_idx]
+        segs.append(np.concatenate([p1[bnd_idx],p2[bnd_idx]],axis=1))
+        segs.append(np.concatenate([p1[bnd_idx] + cut + shift,p2[bnd_idx] - cut + shift],axis=1))
+        idx += [bnd_idx,bnd_idx]
+
+    if not segs:
+        return np.zeros((0,4)),np.zeros(0,dtype=int)
+    return np.concatenate(segs),np.concatenate(idx)
+
+
+class BondGeometry:
+    """
+    The render geometry of all bonds of a molecule as flat arrays:
+    bond endpoints p1 and p2, unit normals and the line segments of
+    every bond (contiguous per bond, segments[first[k]:first[k+1]]
+    belong to bond k). Painting reads these arrays as they are.
+
+    The arrays are built once per revision of the molecular graph.
+    After atoms moved, only the bonds of those atoms (and ring double
+    bonds whose ring centre moved with them) are computed again.
+
+    >>> from core import Atom, Bond, Mol
+    >>> class Style:
+    ...     double_bond_spread = 3
+    ...     triple_bond_spread = 4
+    ...     inner_bond_shortening = 0.1
+    >>> a = [Atom('C',np.array([0.,0.])),Atom('C',np.array([10.,0.])),Atom('O',np.array([20.,0.]))]
+    >>> mol = Mol(atoms=a,bonds=[Bond(a[0],a[1],1),Bond(a[1],a[2],2)])
+    >>> geom = mol_bond_geometry(mol,Style())
+    >>> geom.segments.tolist()
+    [[0.0, 0.0, 10.0, 0.0], [10.0, 3.0, 20.0, 3.0], [10.0, -3.0, 20.0, -3.0]]
+    >>> a[2].pos = np.array([10.,10.])
+    >>> mol.moved([a[2]])
+    >>> mol_bond_geometry(mol,Style()).segments.tolist()
+    [[0.0, 0.0, 10.0, 0.0], [7.0, 0.0, 7.0, 10.0], [13.0, 0.0, 13.0, 10.0]]
+    """
+
+    def __init__(self, mol, chem_style,) -> None:
+        self.mol = mol
+        self.build(chem_style)
+
+    @staticmethod
+    def _style_key(chem_style) -> tuple:
+        return (
+            chem_style.double_bond_spread,
+            chem_style.triple_bond_spread,
+            getattr(chem_style,"inner_bond_shortening",0.),
+        )
+
+    def build(self, chem_style) -> None:
+        mol = self.mol
+        self.chem_style = chem_style
+        self.style_key = self._style_key(chem_style)
+        self.revision = mol.revision
+        mol.take_moved()
+
+        self.atom_index = {id(atm): i for i,atm in enumerate(mol.atoms)}
+        self.bond_index = {id(bnd): k for k,bnd in enumerate(mol.bonds)}
+        self.atom_pos = np.array([atm.pos for atm in mol.atoms],dtype=float).reshape((-1,2))
+        self.bond_atoms = np.array(
+            [(self.atom_index[id(bnd.fst)],self.atom_index[id(bnd.snd)]) for bnd in mol.bonds],dtype=int,
+        ).reshape((-1,2))
+        self.orders = np.array([bnd.order for bnd in mol.bonds],dtype=float)
+        n_bonds = len(mol.bonds)
+
+        # Only ring double bonds depend on their ring centre:
+        bond_ring = mol.bond_ring_index()
+        self.bond_ring = np.where(self.orders == 2,bond_ring,-1)
+        self.ring_atoms = [np.array([self.atom_index[id(atm)] for atm in ring],dtype=int) for ring in mol.rings()]
+
+        # The bonds to compute again when an atom moves, as CSR arrays
+        # (the bonds of atom i are dep_bonds[dep_start[i]:dep_start[i+1]]):
+        dep_atom = [self.bond_atoms[:,0],self.bond_atoms[:,1]]
+        dep_bond = [np.arange(n_bonds),np.arange(n_bonds)]
+        for k in np.flatnonzero(self.bond_ring >= 0).tolist():
+            ring = self.ring_atoms[self.bond_ring[k]]
+            dep_atom.append(ring)
+            dep_bond.append(np.full(len(ring),k))
+        dep_atom,dep_bond = np.concatenate(dep_atom),np.concatenate(dep_bond)
+        order = np.argsort(dep_atom,kind="stable")
+        self.dep_bonds = dep_bond[order]
+        self.dep_start = np.concatenate([[0],np.cumsum(np.bincount(dep_atom,minlength=len(mol.atoms)))])
+
+        self.p1 = self.atom_pos[self.bond_atoms[:,0]]
+        self.p2 = self.atom_pos[self.bond_atoms[:,1]]
+        self.normals = self._normals(self.p1,self.p2)
+        segs,idx = bond_line_segments(self.p1,self.p2,self.orders,chem_style,self._ring_centers(np.arange(n_bonds)))
+        order = np.argsort(idx,kind="stable")
+        self.segments = segs[order]
+        self.segment_bond = idx[order]
+        self.first = np.concatenate([[0],np.cumsum(np.bincount(idx,minlength=n_bonds))]).astype(int)
+
+    @staticmethod
+    def _normals(p1:np.ndarray, p2:np.ndarray) -> np.ndarray:
+        v_12 = p2 - p1
+        v_orth = np.stack([-v_12[:,1],v_12[:,0]],axis=1)
+        return v_orth / np.maximum(np.linalg.norm(v_orth,axis=1),0.0001)[:,None]
+
+    def _ring_centers(self, bnd_idx:np.ndarray) -> np.ndarray:
+        centers = np.full((len(bnd_idx),2),np.nan)
+        rings = self.bond_ring[bnd_idx]
+        for r in np.unique(rings[rings >= 0]).tolist():
+            centers[rings == r] = self.atom_pos[self.ring_atoms[r]].mean(axis=0)
+        return centers
+
+    def _segment_rows(self, bnd_idx:np.ndarray) -> np.ndarray:
+        # The rows of the segments of the given bonds, in that order:
+        counts = self.first[bnd_idx + 1] - self.first[bnd_idx]
+        starts = self.first[bnd_idx] - (np.cumsum(counts) - counts)
+        return np.repeat(starts,counts) + np.arange(counts.sum())
+
+    def update(self, atoms) -> None:
+        """
+        Computes the geometry again for all bonds depending on the
+        given atoms, all bonds if atoms is None.
+        """
+        mol = self.mol
+        if atoms is None:
+            atm_idx = np.arange(len(mol.atoms))
+            self.atom_pos = np.array([atm.pos for atm in mol.atoms],dtype=float).reshape((-1,2))
+        else:
+            atm_idx = [self.atom_index.get(id(atm)) for atm in atoms]
+            atm_idx = np.array([i for i in atm_idx if i is not None],dtype=int)
+            if not len(atm_idx):
+                return
+            self.atom_pos[atm_idx] = [mol.atoms[i].pos for i in atm_idx.tolist()]
+
+        counts = self.dep_start[atm_idx + 1] - self.dep_start[atm_idx]
+        starts = self.dep_start[atm_idx] - (np.cumsum(counts) - counts)
+        bnd_idx = np.unique(self.dep_bonds[np.repeat(starts,counts) + np.arange(counts.sum())])
+        if not len(bnd_idx):
+            return
+        p1 = self.p1[bnd_idx] = self.atom_pos[self.bond_atoms[bnd_idx,0]]
+        p2 = self.p2[bnd_idx] = self.atom_pos[self.bond_atoms[bnd_idx,1]]
+        self.normals[bnd_idx] = self._normals(p1,p2)
+        segs,idx = bond_line_segments(p1,p2,self.orders[bnd_idx],self.chem_style,self._ring_centers(bnd_idx))
+        self.segments[self._segment_rows(bnd_idx)] = segs[np.argsort(idx,kind="stable")]
+
+    def bond_segments(self, bnd) -> Optional[np.ndarray]:
+        k = self.bond_index.get(id(bnd))
+        if k is None:
+            return None
+        return self.segments[self.first[k]:self.first[k+1]]
+
+
+def mol_bond_geometry(mol, chem_style, moving=None,) -> BondGeometry:
+    """
+    Returns the up to date bond geometry of a molecule. moving are
+    atoms that are being moved without the molecule knowing (previews
+    of transforms), they are updated on every call.
+    """
+    geom = mol.render_geometry
+    if geom is None or geom.revision != mol.revision or geom.style_key != BondGeometry._style_key(chem_style):
+        geom = mol.render_geometry = BondGeometry(mol,chem_style)
+    else:
+        moved = mol.take_moved()
+        if moved is None or moved:
+            geom.update(moved)
+    if moving:
+        geom.update(moving)
+    return geom
+
+
+def point_segment_distances(p:np.ndarray, p1:np.ndarray, p2:np.ndarray) -> np.ndarray:
+    """
+    Distances of the point p to all segments (p1[i],p2[i]).
+
+    >>> p1,p2 = np.array([[0.,0.],[0.,0.]]),np.array([[100.,0.],[0.,0.]])
+    >>> point_segment_distances(np.array([90.,5.]),p1,p2).round(2).tolist()
+    [5.0, 90.14]
+    """
+    d = p2 - p1
+    rel = p - p1
+    length_sq = (d*d).sum(axis=1)
+    # Degenerate segments are just points:
+    with np.errstate(divide="ignore",invalid="ignore"):
+        t = np.where(length_sq > 0,(rel*d).sum(axis=1) / length_sq,0)
+    closest = rel - np.clip(t,0,1)[:,None] * d
+    return np.sqrt((closest*closest).sum(axis=1))
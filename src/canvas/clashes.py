@@ -0,0 +1,157 @@
+
+from dataclasses import dataclass, field
+
+import numpy as np
+
+
+def _box_cells(lo:np.ndarray, hi:np.ndarray, origin:np.ndarray, cell:float, n_rows:int,):
+    """
+    Returns (cell key, box index) for every grid cell a box covers.
+    """
+    g_lo = np.floor((lo - origin) / cell).astype(np.int64)
+    g_hi = np.floor((hi - origin) / cell).astype(np.int64)
+    n_x = g_hi[:,0] - g_lo[:,0] + 1
+    n_y = g_hi[:,1] - g_lo[:,1] + 1
+    n_cells = n_x * n_y
+    box = np.repeat(np.arange(len(lo)),n_cells)
+    # Position of every entry within the cells of its box:
+    k = np.arange(len(box)) - np.repeat(np.cumsum(n_cells) - n_cells,n_cells)
+    cx = g_lo[box,0] + k % n_x[box]
+    cy = g_lo[box,1] + k // n_x[box]
+    return cx * n_rows + cy, box
+
+
+def candidate_pairs(lo_a:np.ndarray, hi_a:np.ndarray, lo_b=None, hi_b=None, cell:float=30,) -> np.ndarray:
+    """
+    Finds all pairs (i,j) of boxes from a and b with overlapping
+    bounding boxes. The boxes are bucketed into grid cells and only
+    boxes sharing a cell are compared. Without b, the pairs (i,j)
+    with i < j within a are returned.
+
+    >>> lo = np.array([[0.,0.],[5.,5.],[100.,0.]])
+    >>> candidate_pairs(lo,lo + 10).tolist()
+    [[0, 1]]
+    """
+    same = lo_b is None
+    if same:
+        lo_b,hi_b = lo_a,hi_a
+    if not len(lo_a) or not len(lo_b):
+        return np.zeros((0,2),dtype=int)
+
+    origin = np.minimum(lo_a.min(axis=0),lo_b.min(axis=0))
+    top = np.maximum(hi_a.max(axis=0),hi_b.max(axis=0))
+    n_rows = int((top[1] - origin[1]) // cell) + 1
+    key_a,box_a = _box_cells(lo_a,hi_a,origin,cell,n_rows)
+    key_b,box_b = _box_cells(lo_b,hi_b,origin,cell,n_rows)
+    order = np.argsort(key_b,kind="stable")
+    key_b,box_b = key_b[order],box_b[order]
+
+    # Joins every cell entry of a with all entries of b in that cell:
+    start = np.searchsorted(key_b,key_a,side="left")
+    counts = np.searchsorted(key_b,key_a,side="right") - start
+    i = np.repeat(box_a,counts)
+    k = np.arange(len(i)) - np.repeat(np.cumsum(counts) - counts,counts)
+    j = box_b[np.repeat(start,counts) + k]
+
+    keep = (lo_a[i] <= hi_b[j]).all(axis=1) & (lo_b[j] <= hi_a[i]).all(axis=1)
+    if same:
+        keep &= i < j
+    # Boxes sharing several cells show up once per cell:
+    pairs = np.unique(i[keep] * len(lo_b) + j[keep])
+    return np.stack([pairs // len(lo_b),pairs % len(lo_b)],axis=1)
+
+
+def _orient(a:np.ndarray, b:np.ndarray, c:np.ndarray) -> np.ndarray:
+    return (b[:,0]-a[:,0])*(c[:,1]-a[:,1]) - (b[:,1]-a[:,1])*(c[:,0]-a[:,0])
+
+
+def segment_crossings(p1:np.ndarray, p2:np.ndarray, cell:float=30,):
+    """
+    Finds all pairs of segments (p1[i],p2[i]) that properly cross
+    each other. Segments that merely touch, e.g. bonds sharing an
+    atom, do not count. Returns the index pairs and the crossing points.
+
+    >>> p1 = np.array([[0.,0.],[0.,10.],[10.,10.]])
+    >>> p2 = np.array([[10.,10.],[10.,0.],[20.,10.]])
+    >>> pairs,points = segment_crossings(p1,p2)
+    >>> pairs.tolist(), points.tolist()
+    ([[0, 1]], [[5.0, 5.0]])
+    """
+    pairs = candidate_pairs(np.minimum(p1,p2),np.maximum(p1,p2),cell=cell)
+    i,j = pairs[:,0],pairs[:,1]
+    d1 = _orient(p1[i],p2[i],p1[j])
+    d2 = _orient(p1[i],p2[i],p2[j])
+    d3 = _orient(p1[j],p2[j],p1[i])
+    d4 = _orient(p1[j],p2[j],p2[i])
+    crossing = (d1*d2 < 0) & (d3*d4 < 0)
+    pairs,d3,d4 = pairs[crossing],d3[crossing],d4[crossing]
+    i = pairs[:,0]
+    t = (d3 / (d3 - d4))[:,None]
+    return pairs, p1[i] + t * (p2[i] - p1[i])
+
+
+def box_segment_hits(lo:np.ndarray, hi:np.ndarray, p1:np.ndarray, p2:np.ndarray, cell:float=30,) -> np.ndarray:
+    """
+    Finds all pairs (box i, segment j) where the segment passes
+    through the box, using a vectorized Liang-Barsky clipping test.
+
+    >>> lo,hi = np.array([[0.,0.]]),np.array([[10.,10.]])
+    >>> box_segment_hits(lo,hi,np.array([[-5.,5.],[-5.,20.]]),np.array([[15.,5.],[15.,20.]])).tolist()
+    [[0, 0]]
+    """
+    pairs = candidate_pairs(lo,hi,np.minimum(p1,p2),np.maximum(p1,p2),cell=cell)
+    i,j = pairs[:,0],pairs[:,1]
+    a = p1[j]
+    d = p2[j] - a
+    t0 = np.zeros(len(pairs))
+    t1 = np.ones(len(pairs))
+    with np.errstate(divide="ignore",invalid="ignore"):
+        for axis in range(2):
+            ta = (lo[i,axis] - a[:,axis]) / d[:,axis]
+            tb = (hi[i,axis] - a[:,axis]) / d[:,axis]
+            t_enter,t_leave = np.fmin(ta,tb),np.fmax(ta,tb)
+            # Segments parallel to this axis either lie within the slab or miss it:
+            flat = d[:,axis] == 0
+            inside = (lo[i,axis] <= a[:,axis]) & (a[:,axis] <= hi[i,axis])
+            t_enter = np.where(flat,np.where(inside,-np.inf,np.inf),t_enter)
+            t_leave = np.where(flat,np.inf,t_leave)
+            t0 = np.maximum(t0,t_enter)
+            t1 = np.minimum(t1,t_leave)
+    return pairs[t0 <= t1]
+
+
+@dataclass
+class Clashes:
+    """
+    Layout problems of a document: bonds crossing each other (with
+    the points where they cross) and bonds running through the
+    label of an atom they are not attached to.
+    """
+    crossings:list = field(default_factory=list)
+    crossing_points:np.ndarray = field(default_factory=lambda: np.zeros((0,2)))
+    label_overlaps:list = field(default_factory=list)
+
+    def __len__(self) -> int:
+        return len(self.crossings) + len(self.label_overlaps)
+
+    def items(self) -> list:
+        result = {}
+        for pair in self.crossings + self.label_overlaps:
+            for itm in pair:
+                result[id(itm)] = itm
+        return list(result.values())
+
+
+def find_clashes(p1:np.ndarray, p2:np.ndarray, bond_atoms:np.ndarray,
+        label_lo:np.ndarray, label_hi:np.ndarray, label_atoms:np.ndarray, cell:float=30,):
+    """
+    Runs all clash tests on plain arrays: bonds are segments p1,p2
+    between the atoms bond_atoms (m,2), labels are boxes label_lo,
+    label_hi of the atoms label_atoms. Returns the crossing bond pairs,
+    the crossing points and the (label,bond) overlaps.
+    """
+    crossings,points = segment_crossings(p1,p2,cell)
+    overlaps = box_segment_hits(label_lo,label_hi,p1,p2,cell)
+    # Bonds always start within the labels of their own atoms:
+    own = (bond_atoms[overlaps[:,1]] == label_atoms[overlaps[:,0],None]).any(axis=1)
+    return crossings,points,overlaps[~own]
@@ -0,0 +1,173 @@
+
+import json
+import re
+from typing import Callable, Optional
+
+from PyQt5 import QtCore, QtWidgets
+import numpy as np
+
+from core import Fragment
+from molfile import fragment_to_molblock, molblock_to_fragment
+
+
+# Our own compact format, which other editor instances paste losslessly.
+# Other programs get a molfile as plain text.
+FRAGMENT_MIME_TYPE = "application/x-alchemy-fragment"
+
+# One capital letter, optionally followed by lower case ones:
+ELEMENT_SYMBOL = re.compile("[A-Z][a-z]{0,2}")
+
+
+def fragment_to_json(frag:Fragment) -> bytes:
+    return json.dumps({
+        "symbols": frag.symbols,
+        "coords": np.round(frag.coords,4).reshape(-1).tolist(),
+        "bonds": np.asarray(frag.bonds,dtype=int).reshape(-1).tolist(),
+        "orders": list(frag.orders),
+    },separators=(",",":")).encode()
+
+
+def json_to_fragment(data:bytes) -> Fragment:
+    """
+    Reads what fragment_to_json wrote. The data comes from whatever
+    program filled the clipboard, so it is checked as thoroughly as a
+    molfile before it gets anywhere near the document.
+
+    >>> frag = Fragment(['C','O'],np.zeros((2,2)),np.array([[0,1]]),[2])
+    >>> json_to_fragment(fragment_to_json(frag)).orders
+    [2]
+    >>> try:
+    ...     json_to_fragment(b'{"symbols":["C"],"coords":[0,0],"bonds":[0,-1],"orders":[1]}')
+    ... except AssertionError as e:
+    ...     print(str(e).splitlines()[0])
+    Not a fragment: bond 0 -1 refers to a missing atom
+    """
+    obj = json.loads(data)
+    assert isinstance(obj,dict), "Not a fragment: no object"
+    symbols,orders = obj["symbols"],obj["orders"]
+    assert isinstance(symbols,list) and isinstance(orders,list), "Not a fragment: symbols and orders have to be lists"
+    for symbol in symbols:
+        # Unknown elements are fine (see Mol.valence_info), as long as
+        # they look like an element symbol:
+        assert isinstance(symbol,str) and ELEMENT_SYMBOL.fullmatch(symbol), f"Not a fragment: {symbol!r} is not an element symbol"
+    coords = np.array(obj["coords"],dtype=float)
+    assert coords.size == 2 * len(symbols), "Not a fragment: every atom needs two coordinates"
+    assert np.isfinite(coords).all(), "Not a fragment: coordinates have to be finite"
+    bonds = np.array(obj["bonds"],dtype=int)
+    assert bonds.size == 2 * len(orders), "Not a fragment: every bond needs two atoms and an order"
+    bonds = bonds.reshape((-1,2))
+    for a,b in bonds.tolist():
+        assert 0 <= a < len(symbols) and 0 <= b < len(symbols), f"Not a fragment: bond {a} {b} refers to a missing atom"
+        assert a != b, f"Not a fragment: atom {a} is bonded to itself"
+    for order in orders:
+        assert not isinstance(order,bool) and isinstance(order,(int,float)) and 0 < order <= 3, f"Not a fragment: {order!r} is not a bond order"
+    return Fragment(
+        symbols=symbols,
+        coords=coords.reshape((-1,2)),
+        bonds=bonds,
+        orders=orders,
+    )
+
+
+class ClipboardSignals(QtCore.QObject):
+    # (callback, result). Emitted from a worker thread, the
+    # callback runs on the GUI thread.
+    done = QtCore.pyqtSignal(object,object)
+    # The reason why the clipboard content could not be read:
+    failed = QtCore.pyqtSignal(str)
+
+
+class ClipboardJob(QtCore.QRunnable):
+
+    def __init__(self, signals:ClipboardSignals, work:Callable, callback:Callable,) -> None:
+        super().__init__()
+        self.signals = signals
+        self.work = work
+        self.callback = callback
+
+    def run(self) -> None:
+        try:
+            result = self.work()
+        except (AssertionError,TypeError,ValueError,KeyError,IndexError) as e:
+            # Whatever was on the clipboard was not a molecule after all.
+            self.signals.failed.emit(str(e) or type(e).__name__)
+            result = None
+        self.signals.done.emit(self.callback,result)
+
+
+class FragmentClipboard:
+    """
+    Copies fragments to and pastes them from the system clipboard.
+
+    The GUI thread only ever takes a snapshot of the fragment (copy)
+    or grabs the raw clipboard data (paste). Encoding and decoding
+    happen on a worker thread, so even huge selections do not block
+    the user interface.
+    """
+
+    def __init__(self, on_error:Optional[Callable[[str],None]]=None,) -> None:
+        self.on_error = on_error
+        self.pool = QtCore.QThreadPool()
+        # A single worker keeps copies and pastes in order:
+        self.pool.setMaxThreadCount(1)
+        self.signals = ClipboardSignals()
+        self.signals.done.connect(self._on_done)
+        self.signals.failed.connect(self._on_failed)
+        self._copies_pending = 0
+        self._paste_after_copy:Optional[Callable] = None
+
+    def copy(self, frag:Fragment) -> None:
+        def encode():
+            return fragment_to_json(frag),fragment_to_molblock(frag)
+        self._copies_pending += 1
+        self.pool.start(ClipboardJob(self.signals,encode,self._on_encoded))
+
+    def _on_encoded(self, encoded) -> None:
+        self._copies_pending -= 1
+        if encoded is not None:
+            data,molblock = encoded
+            mime = QtCore.QMimeData()
+            mime.setData(FRAGMENT_MIME_TYPE,QtCore.QByteArray(data))
+            mime.setText(molblock)
+            QtWidgets.QApplication.clipboard().setMimeData(mime)
+        if self._copies_pending == 0 and self._paste_after_copy is not None:
+            on_fragment, self._paste_after_copy = self._paste_after_copy, None
+            self.paste(on_fragment)
+
+    def paste(self, on_fragment:Callable[[Fragment],None]) -> None:
+        """
+        Decodes the clipboard content and hands the fragment to
+        on_fragment on the GUI thread. Nothing happens if the
+        clipboard does not hold a molecule.
+        """
+        if self._copies_pending:
+            # The user pastes what they just copied, which is
+            # not on the clipboard yet:
+            self._paste_after_copy = on_fragment
+            return
+        mime = QtWidgets.QApplication.clipboard().mimeData()
+        if mime is None:
+            return
+        if mime.hasFormat(FRAGMENT_MIME_TYPE):
+            data = bytes(mime.data(FRAGMENT_MIME_TYPE))
+            work = lambda: json_to_fragment(data)
+        elif mime.hasText():
+            text = mime.text()
+            work = lambda: molblock_to_fragment(text)
+        else:
+            return
+        def on_decoded(frag):
+            if frag is not None:
+                on_fragment(frag)
+        self.pool.start(ClipboardJob(self.signals,work,on_decoded))
+
+    def _on_done(self, callback:Callable, result) -> None:
+        callback(result)
+
+    def _on_failed(self, message:str) -> None:
+        if self.on_error is not None:
+            self.on_error(message)
+
+    def wait_for_done(self) -> None:
+        self.pool.waitForDone()
+        QtCore.QCoreApplication.processEvents()
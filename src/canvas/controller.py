@@ -8,11 +8,14 @@ from typing import TYPE_CHECKING
 from PyQt5 import QtCore, QtGui, QtWidgets
 from PyQt5.QtCore import Qt
 import numpy as np
+from canvas.affine import reflection
+from canvas.clipboard import FragmentClipboard
 from canvas.drag_n_drop import DragNDrop
 from canvas.mode_button import Mode
 from canvas.model import CanvasModel
 from canvas.pse_widget import PSEDialog, PSEWidget
 from canvas.view import CanvasView
+from config_dlg import show_configuration_dialog
 from transf import Transf
 from ui_utils import keyevent_to_keys
 
@@ -32,6 +35,9 @@ class CanvasController(QtWidgets.QLabel):
 
         self.view:CanvasView = view
         self.model:CanvasModel = model
+        # Every change of the model schedules a repaint, no matter
+        # who made it. Qt merges repeated updates into one repaint:
+        self.model.subscribe(self._on_model_event)
 
         self.current_mode = None
         self.activate_bonds_mode()
@@ -41,15 +47,90 @@ class CanvasController(QtWidgets.QLabel):
 
         self.transf = Transf()
         self.keys_pressed = set()
-
+        self.pan_last_pos = None
+        self.mouse_pos = None
+        self.lasso_path = []
+        self.clipboard = FragmentClipboard(on_error=self._on_clipboard_error)
+
+        # Paged models read from disk when the viewport changes, which
+        # must not happen while painting. A paint only notes the new
+        # viewport and the timer hands it to the model afterwards:
+        self._viewport = None
+        self._viewport_timer = QtCore.QTimer(self)
+        self._viewport_timer.setSingleShot(True)
+        self._viewport_timer.setInterval(50)
+        self._viewport_timer.timeout.connect(self._apply_viewport)
+
+
+    def _on_model_event(self, event):
+        self.update()
 
     def activate_bonds_mode(self):
         self.current_mode = Mode.SINGLE_BOND
 
 
-    def _unhover_all(self):
-        for item in self.model.document_items():
-            item.set_hovered(False)
+    def insert_fragment(self, symbols, coords, bonds, orders=None,):
+        # Templates and scripts insert whole fragments at once,
+        # which only ever requires a single repaint:
+        return self.model.add_fragment(symbols,coords,bonds,orders=orders,)
+
+
+    def copy_selection(self):
+        frag = self.model.selection_fragment()
+        if len(frag):
+            self.clipboard.copy(frag)
+
+    def paste(self):
+        self.clipboard.paste(self._paste_fragment)
+
+    def _on_clipboard_error(self, message:str):
+        if self.chem_app is not None:
+            self.chem_app.display_message(f"Cannot paste: {message}")
+
+    def _paste_fragment(self, frag):
+        if not len(frag):
+            return
+        # The pasted fragment is centered at the mouse, or shifted
+        # a bit if the mouse is not over the canvas, so that it
+        # never ends up right on top of the original:
+        coords = frag.coords
+        if self.mouse_pos is not None:
+            coords = coords - coords.mean(axis=0) + self.mouse_pos
+        else:
+            coords = coords + self.model.BOND_LENGTH
+        mols = self.model.add_fragment(frag.symbols,coords,frag.bonds,orders=frag.orders,fuse_delta=None,)
+        self.model.set_selection([itm for mol in mols for itm in mol.atoms + mol.bonds])
+
+
+    def select_matching_atoms(self):
+        self.model.select_matching(self.model.current_atom_symbol)
+
+    def highlight_matching_atoms(self):
+        self.model.highlight_matching(self.model.current_atom_symbol)
+        self.update()
+
+    def highlight_duplicates(self):
+        self.model.highlight_duplicates()
+        self.update()
+
+    def set_show_clashes(self, show:bool):
+        self.view.show_clashes = show
+        self.update()
+
+    def select_clashes(self):
+        clashes = self.view.clashes(self.model,self.font())
+        self.model.set_selection(clashes.items())
+
+    def arrange_molecules(self):
+        self.model.arrange()
+
+    def flip_selection(self, axis_angle:float):
+        # Mirrors the selection at an axis through its centroid:
+        self.model.transform_selection(reflection(axis_angle))
+
+    def clear_highlights(self):
+        self.model.set_highlighted([])
+        self.update()
 
 
     def mouseDoubleClickEvent(self, evt: QtGui.QMouseEvent) -> None:
@@ -61,10 +142,7 @@ class CanvasController(QtWidgets.QLabel):
             # anything else (we are not in bond mode). Hence,
             # the atom will be placed in its own molecule.
             pos = np.array(self.transf.backward(evt.x(),evt.y()))
-            atm = Atom(self.model.current_atom_symbol, pos)
-            mol = Mol(atoms=[atm],bonds=[])
-            self.model.mols.append(mol)
-            self.update()
+            self.model.add_atom(self.model.current_atom_symbol, pos)
 
         return super().mouseDoubleClickEvent(evt)
 
@@ -79,6 +157,7 @@ class CanvasController(QtWidgets.QLabel):
                 if dnd.at_start():
                     dnd.start_x = x
                     dnd.start_y = y
+                    self.lasso_path = [(x,y)]
                 else:
                     dnd.end_x = x
                     dnd.end_y = y
@@ -93,14 +172,42 @@ class CanvasController(QtWidgets.QLabel):
                         add_to_selection = 'Shift' in self.keys_pressed
                         self.model.preview_rect_select(dnd.start_x,dnd.start_y,dnd.end_x,dnd.end_y,add_to_selection=add_to_selection,commit_action=False,)
 
+                    elif self.current_mode == Mode.LASSO_SELECT:
+                        # Points closer than a pixel to the last one are
+                        # not worth keeping:
+                        last_x,last_y = self.lasso_path[-1]
+                        if abs(x-last_x) + abs(y-last_y) > 1 / self.transf.zoom_factor():
+                            self.lasso_path.append((x,y))
+                        add_to_selection = 'Shift' in self.keys_pressed
+                        self.model.preview_lasso_select(self.lasso_path,add_to_selection=add_to_selection,commit_action=False,)
+
                     elif self.current_mode == Mode.TRANSLATE:
                         dx = dnd.end_x - dnd.start_x
                         dy = dnd.end_y - dnd.start_y
                         #dx,dy = self.transf.backward(dx,dy)
                         self.model.translate(dx=dx,dy=dy,)
+
+                    elif self.current_mode == Mode.ROTATE:
+                        snap = 'Shift' in self.keys_pressed
+                        self.model.preview_rotate(dnd.start_x,dnd.start_y,dnd.end_x,dnd.end_y,snap=snap,)
+
+                    elif self.current_mode == Mode.MIRROR:
+                        self.model.preview_mirror(dnd.start_x,dnd.start_y,dnd.end_x,dnd.end_y,)
+
+                    elif self.current_mode == Mode.SCALE:
+                        self.model.preview_scale(dnd.start_x,dnd.start_y,dnd.end_x,dnd.end_y,)
                     else:
                         assert False, f"Cannot handle mode {self.current_mode}"
 
+            elif ev.buttons() & QtCore.Qt.MiddleButton and self.pan_last_pos:
+                # Dragging with the middle mouse button pans the canvas.
+                # Panning is applied before zooming, so we have to
+                # convert the mouse movement to document units:
+                last_x,last_y = self.pan_last_pos
+                zoomf = self.transf.zoom_factor()
+                self.transf.panning((ev.x()-last_x)/zoomf,(ev.y()-last_y)/zoomf)
+                self.pan_last_pos = (ev.x(),ev.y())
+
             self.update()
 
         else: # no buttons pressed
@@ -109,16 +216,16 @@ class CanvasController(QtWidgets.QLabel):
             # therefore check wheter any document items are nearby
             # to the current mouse position and highlight them
             # if appropriate.
-            self._unhover_all()
             pos = np.array(self.transf.backward(ev.x(),ev.y()))
+            # (a changed hover repaints via the model event)
             item = self.model.doc_item_near_pos(pos)
-
-            if item:
-                item.set_hovered(True)
-        
-        self.update()
+            self.model.set_hovered(item)
+            self.mouse_pos = pos
 
     def mousePressEvent(self, ev: QtGui.QMouseEvent) -> None:
+        if ev.buttons() & QtCore.Qt.MiddleButton:
+            self.pan_last_pos = (ev.x(),ev.y())
+
         if ev.buttons() & QtCore.Qt.RightButton:
             # The user right clicked on the canvas.
             # This means that the user is interested
@@ -130,10 +237,14 @@ class CanvasController(QtWidgets.QLabel):
             pos = np.array(self.transf.backward(ev.x(),ev.y()))
             item = self.model.doc_item_near_pos(pos)
             if item:
-                item.show_configuration_dialog()
+                changes = show_configuration_dialog(item)
+                if "symbol" in changes:
+                    self.model.set_atom_symbol(item,changes["symbol"])
 
     def mouseReleaseEvent(self, ev: QtGui.QMouseEvent) -> None:
         dnd = self.drag_n_drop
+        if not ev.buttons() & QtCore.Qt.MiddleButton:
+            self.pan_last_pos = None
 
         if dnd.ready_to_commit():
 
@@ -145,8 +256,12 @@ class CanvasController(QtWidgets.QLabel):
             elif self.current_mode == Mode.RECT_SELECT:
                 add_to_selection = 'Shift' in self.keys_pressed
                 self.model.preview_rect_select(dnd.start_x,dnd.start_y,dnd.end_x,dnd.end_y,add_to_selection=add_to_selection,commit_action=True,)
-            elif self.current_mode == Mode.TRANSLATE:
-                self.model.commit_translate()
+            elif self.current_mode == Mode.LASSO_SELECT:
+                add_to_selection = 'Shift' in self.keys_pressed
+                self.model.preview_lasso_select(self.lasso_path,add_to_selection=add_to_selection,commit_action=True,)
+                self.lasso_path = []
+            elif self.current_mode.is_transform_mode():
+                self.model.commit_transform()
             else:
                 assert False, f"Cannot handle mode {self.current_mode}"
 
@@ -167,8 +282,20 @@ class CanvasController(QtWidgets.QLabel):
     def paintEvent(self,
             ev: QtGui.QPaintEvent,
             ) -> None:
+        viewport = (self.transf.backward(0,0),self.transf.backward(self.width(),self.height()))
+        if viewport != self._viewport:
+            self._viewport = viewport
+            # While panning, this loads at most once per interval:
+            if not self._viewport_timer.isActive():
+                self._viewport_timer.start()
         self.view.paintEvent(ev=ev,controller=self,)
 
+    def _apply_viewport(self):
+        # Pages that get loaded or evicted emit model events,
+        # which repaint the canvas with what is resident now:
+        lo,hi = self._viewport
+        self.model.set_viewport(np.array(lo),np.array(hi))
+
     def keyPressEvent(self, ev: QtGui.QKeyEvent) -> None:
         self.keys_pressed = self.keys_pressed.union(keyevent_to_keys(ev))
         print(">>",self.keys_pressed)
@@ -176,9 +303,19 @@ class CanvasController(QtWidgets.QLabel):
         if ev.key() == Qt.Key.Key_Left:
             do_refresh = True
 
+        if ev.matches(QtGui.QKeySequence.StandardKey.Copy):
+            self.copy_selection()
+        elif ev.matches(QtGui.QKeySequence.StandardKey.Paste):
+            self.paste()
+
         if ev.key() == Qt.Key.Key_Escape:
-            self.model.selection = []
-            do_refresh = True
+            if self.model.transform is not None:
+                # Escape while dragging puts the selection back:
+                self.model.cancel_transform()
+                self.drag_n_drop.clear()
+                do_refresh = True
+            else:
+                self.model.set_selection([])
 
         if do_refresh:
             self.update()
@@ -0,0 +1,213 @@
+
+import json
+import time
+from pathlib import Path
+from typing import TYPE_CHECKING, Optional
+
+from PyQt5 import QtCore, QtGui, QtWidgets
+import numpy as np
+
+from canvas.mode_button import Mode
+from journal import build_mols, capture_document
+
+if TYPE_CHECKING:
+    from canvas.controller import CanvasController
+
+
+MOUSE_EVENTS = {
+    QtCore.QEvent.Type.MouseMove: "move",
+    QtCore.QEvent.Type.MouseButtonPress: "press",
+    QtCore.QEvent.Type.MouseButtonRelease: "release",
+    QtCore.QEvent.Type.MouseButtonDblClick: "double_click",
+}
+KEY_EVENTS = {
+    QtCore.QEvent.Type.KeyPress: "key_press",
+    QtCore.QEvent.Type.KeyRelease: "key_release",
+}
+
+
+class EventRecorder(QtCore.QObject):
+    """
+    Records the input events that reach a CanvasController as one
+    JSON record per line. The first record holds everything needed
+    to start a replay from the same state: the document, the widget
+    size, the view transformation and the current mode.
+    Mode changes are recorded lazily, i.e. right before the first
+    event that happens in the new mode.
+
+    The main window forwards its key events to the controller, so we
+    also record the key events of the window.
+    """
+
+    def __init__(self, controller:"CanvasController", path:Path,) -> None:
+        super().__init__()
+        self.controller = controller
+        self.path = Path(path)
+        self._f = open(self.path,"w")
+        self._t0 = time.perf_counter()
+        self._mode = None
+        transf = controller.transf
+        self._write({
+            "type": "start",
+            "width": controller.width(),
+            "height": controller.height(),
+            "zoom": transf.zoom_level(),
+            "translation": list(transf.translation()),
+            "document": capture_document(controller.model),
+        })
+        self._check_mode()
+        self._window = controller.window()
+        controller.installEventFilter(self)
+        if self._window is not controller:
+            self._window.installEventFilter(self)
+
+    def _write(self, rec:dict) -> None:
+        rec["t"] = round(time.perf_counter() - self._t0,6)
+        self._f.write(json.dumps(rec,separators=(",",":")) + "\n")
+
+    def _check_mode(self) -> None:
+        model = self.controller.model
+        mode = (self.controller.current_mode.value,model.current_atom_symbol,model.current_bond_order)
+        if mode != self._mode:
+            self._mode = mode
+            self._write({"type": "mode","mode": mode[0],"symbol": mode[1],"bond_order": mode[2]})
+
+    def eventFilter(self, obj, ev) -> bool:
+        kind = ev.type()
+        if obj is not self.controller and kind not in KEY_EVENTS:
+            return False
+        if kind in MOUSE_EVENTS:
+            self._check_mode()
+            self._write({
+                "type": MOUSE_EVENTS[kind],
+                "x": ev.localPos().x(),
+                "y": ev.localPos().y(),
+                "button": int(ev.button()),
+                "buttons": int(ev.buttons()),
+                "modifiers": int(ev.modifiers()),
+            })
+        elif kind == QtCore.QEvent.Type.Wheel:
+            self._check_mode()
+            self._write({
+                "type": "wheel",
+                "x": ev.position().x(),
+                "y": ev.position().y(),
+                "delta": ev.angleDelta().y(),
+                "buttons": int(ev.buttons()),
+                "modifiers": int(ev.modifiers()),
+            })
+        elif kind in KEY_EVENTS:
+            self._check_mode()
+            self._write({
+                "type": KEY_EVENTS[kind],
+                "key": ev.key(),
+                "modifiers": int(ev.modifiers()),
+                "text": ev.text(),
+            })
+        elif kind == QtCore.QEvent.Type.Resize:
+            self._write({"type": "resize","width": ev.size().width(),"height": ev.size().height()})
+        return False
+
+    def close(self) -> None:
+        self.controller.removeEventFilter(self)
+        self._window.removeEventFilter(self)
+        self._f.close()
+
+
+def trace_event(rec:dict) -> Optional[QtCore.QEvent]:
+    """
+    Turns a recorded event back into a Qt event.
+    """
+    kind = rec["type"]
+    if kind in MOUSE_EVENTS.values():
+        qt_type = {v: k for k,v in MOUSE_EVENTS.items()}[kind]
+        return QtGui.QMouseEvent(
+            qt_type,QtCore.QPointF(rec["x"],rec["y"]),
+            QtCore.Qt.MouseButton(rec["button"]),QtCore.Qt.MouseButtons(rec["buttons"]),
+            QtCore.Qt.KeyboardModifiers(rec["modifiers"]),
+        )
+    if kind == "wheel":
+        pos = QtCore.QPointF(rec["x"],rec["y"])
+        return QtGui.QWheelEvent(
+            pos,pos,QtCore.QPoint(),QtCore.QPoint(0,rec["delta"]),
+            QtCore.Qt.MouseButtons(rec["buttons"]),QtCore.Qt.KeyboardModifiers(rec["modifiers"]),
+            QtCore.Qt.ScrollPhase.NoScrollPhase,False,
+        )
+    if kind in KEY_EVENTS.values():
+        qt_type = {v: k for k,v in KEY_EVENTS.items()}[kind]
+        return QtGui.QKeyEvent(qt_type,rec["key"],QtCore.Qt.KeyboardModifiers(rec["modifiers"]),rec["text"])
+    return None
+
+
+class TraceReplayer:
+    """
+    Replays a recorded trace against a controller as fast as possible.
+    For every event we measure how long the controller took to handle
+    it and how long the following repaint took. The repaint goes into
+    an offscreen image, so replaying does not need a visible window.
+    """
+
+    def __init__(self, controller:"CanvasController", paint:bool=True,) -> None:
+        self.controller = controller
+        self.paint = paint
+        self.latencies:list[dict] = []
+
+    def replay(self, path:Path) -> list[dict]:
+        ctrl = self.controller
+        img = None
+        with open(path) as f:
+            for line in f:
+                rec = json.loads(line)
+                kind = rec["type"]
+                if kind == "start":
+                    ctrl.model.add_mols(build_mols(
+                        {uid: [symbol,x,y] for uid,symbol,x,y in rec["document"]["atoms"]},
+                        {(a,b): order for a,b,order in rec["document"]["bonds"]},
+                    ))
+                    ctrl.transf.set_state(rec["zoom"],*rec["translation"])
+                    ctrl.resize(rec["width"],rec["height"])
+                    img = self._image(rec["width"],rec["height"])
+                elif kind == "resize":
+                    ctrl.resize(rec["width"],rec["height"])
+                    img = self._image(rec["width"],rec["height"])
+                elif kind == "mode":
+                    ctrl.current_mode = Mode(rec["mode"])
+                    ctrl.model.current_atom_symbol = rec["symbol"]
+                    ctrl.model.current_bond_order = rec["bond_order"]
+                elif kind == "press" and rec["button"] == int(QtCore.Qt.MouseButton.RightButton):
+                    # Right clicks open a modal configuration dialog,
+                    # which would block the replay.
+                    continue
+                else:
+                    ev = trace_event(rec)
+                    t0 = time.perf_counter()
+                    QtWidgets.QApplication.sendEvent(ctrl,ev)
+                    t1 = time.perf_counter()
+                    if self.paint and img is not None:
+                        ctrl.render(img)
+                    t2 = time.perf_counter()
+                    self.latencies.append({"type": kind,"t": rec["t"],"handle": t1-t0,"paint": t2-t1})
+        return self.latencies
+
+    @staticmethod
+    def _image(width:int, height:int) -> QtGui.QImage:
+        return QtGui.QImage(max(1,width),max(1,height),QtGui.QImage.Format.Format_RGB32)
+
+    def report(self, n_slowest:int=10) -> str:
+        lines = [f"{'event':<14}{'count':>7}{'mean ms':>10}{'p50 ms':>10}{'p95 ms':>10}{'max ms':>10}"]
+        by_type:dict[str,list[float]] = {}
+        for lat in self.latencies:
+            by_type.setdefault(lat["type"],[]).append(lat["handle"] + lat["paint"])
+        by_type["all"] = [lat["handle"] + lat["paint"] for lat in self.latencies]
+        for kind,values in by_type.items():
+            if not values:
+                continue
+            ms = np.array(values) * 1000
+            lines.append(f"{kind:<14}{len(ms):>7}{ms.mean():>10.2f}{np.percentile(ms,50):>10.2f}{np.percentile(ms,95):>10.2f}{ms.max():>10.2f}")
+        slowest = sorted(self.latencies,key=lambda lat: lat["handle"] + lat["paint"],reverse=True)[:n_slowest]
+        if slowest:
+            lines.append("")
+            lines.append("slowest events:")
+            for lat in slowest:
+                lines.append(f"  t={lat['t']:9.3f}s {lat['type']:<14} handle {lat['handle']*1000:8.2f} ms  paint {lat['paint']*1000:8.2f} ms")
+        return "\n".join(lines)
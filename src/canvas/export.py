@@ -0,0 +1,147 @@
+
+from typing import TYPE_CHECKING
+
+from PyQt5 import QtCore, QtGui
+from PyQt5.QtCore import Qt
+from PyQt5.QtSvg import QSvgGenerator
+import numpy as np
+
+from canvas.bond_geometry import mol_bond_geometry
+from canvas.label_cache import LabelCache
+from core import Mol
+
+if TYPE_CHECKING:
+    from canvas.model import CanvasModel
+
+
+def segments_to_path(segs:np.ndarray) -> QtGui.QPainterPath:
+    """
+    Merges line segments into a single path. Segments that start
+    where the previous one ended continue the current subpath.
+    """
+    path = QtGui.QPainterPath()
+    eta = 0.0001
+    last = None
+    for x1,y1,x2,y2 in segs.tolist():
+        if last is None or abs(last[0]-x1) > eta or abs(last[1]-y1) > eta:
+            path.moveTo(x1,y1)
+        path.lineTo(x2,y2)
+        last = (x2,y2)
+    return path
+
+
+class VectorExporter:
+    """
+    Exports the whole document as SVG or PDF using the same bond
+    geometry and label layout as the CanvasView.
+
+    The document is streamed to the painter one molecule at a time:
+    all bond lines of a molecule are merged into one path and the
+    painter state only changes a few times per molecule, so the
+    output does not repeat the same style for every single line.
+    """
+
+    def __init__(self, chem_style, margin:float=20,) -> None:
+        self.chem_style = chem_style
+        self.margin = margin
+
+    def document_bounds(self, model:"CanvasModel") -> np.ndarray:
+        lo = np.array([np.inf,np.inf])
+        hi = -lo
+        for mol in model.mols:
+            if mol.atoms:
+                pos = np.array([atm.pos for atm in mol.atoms],dtype=float)
+                lo = np.minimum(lo,pos.min(axis=0))
+                hi = np.maximum(hi,pos.max(axis=0))
+        if not np.isfinite(lo).all():
+            lo,hi = np.zeros(2),np.zeros(2)
+        return np.array([lo - self.margin,hi + self.margin])
+
+    def export_svg(self, model:"CanvasModel", path:str,) -> None:
+        lo,hi = self.document_bounds(model)
+        w,h = [int(np.ceil(v)) for v in hi - lo]
+        gen = QSvgGenerator()
+        gen.setFileName(str(path))
+        gen.setSize(QtCore.QSize(w,h))
+        gen.setViewBox(QtCore.QRect(0,0,w,h))
+        gen.setTitle("alchemy-editor document")
+        painter = QtGui.QPainter(gen)
+        try:
+            self.paint(painter,model,-lo)
+        finally:
+            painter.end()
+
+    def export_pdf(self, model:"CanvasModel", path:str,) -> None:
+        lo,hi = self.document_bounds(model)
+        w,h = hi - lo
+        writer = QtGui.QPdfWriter(str(path))
+        # One document unit is one point:
+        writer.setResolution(72)
+        writer.setPageSize(QtGui.QPageSize(QtCore.QSizeF(w,h),QtGui.QPageSize.Unit.Point))
+        writer.setPageMargins(QtCore.QMarginsF(0,0,0,0))
+        writer.setTitle("alchemy-editor document")
+        painter = QtGui.QPainter(writer)
+        try:
+            self.paint(painter,model,-lo)
+        finally:
+            painter.end()
+
+    def export_png(self, model:"CanvasModel", path:str, scale:float=1.0,) -> None:
+        lo,hi = self.document_bounds(model)
+        w,h = [max(1,int(np.ceil(v * scale))) for v in hi - lo]
+        img = QtGui.QImage(w,h,QtGui.QImage.Format.Format_ARGB32)
+        img.fill(QtGui.QColor("white"))
+        painter = QtGui.QPainter(img)
+        try:
+            painter.scale(scale,scale)
+            self.paint(painter,model,-lo)
+        finally:
+            painter.end()
+        assert img.save(str(path)), f"Could not write {path}"
+
+    def export(self, model:"CanvasModel", path:str,) -> None:
+        suffix = str(path).lower().rsplit(".",1)[-1]
+        if suffix == "svg":
+            self.export_svg(model,path)
+        elif suffix == "pdf":
+            self.export_pdf(model,path)
+        elif suffix == "png":
+            self.export_png(model,path)
+        else:
+            assert False, f"Cannot export to {path}, only .svg, .pdf and .png are supported"
+
+    def paint(self, painter:QtGui.QPainter, model:"CanvasModel", offset:np.ndarray,) -> None:
+        painter.setRenderHint(QtGui.QPainter.RenderHint.Antialiasing)
+        pen = QtGui.QPen(QtGui.QColor("black"))
+        pen.setWidth(2)
+        pen.setCapStyle(Qt.PenCapStyle.RoundCap)
+        back_brush = QtGui.QBrush(QtGui.QColor("white"),Qt.BrushStyle.SolidPattern)
+        label_cache = LabelCache()
+        font = label_cache.scaled_font(painter.font(),1.0)
+        painter.setFont(font)
+        for mol in model.mols:
+            self._paint_mol(painter,mol,offset,pen,back_brush,label_cache,font)
+
+    def _paint_mol(self, painter, mol:Mol, offset:np.ndarray, pen, back_brush, label_cache:LabelCache, font,) -> None:
+        if mol.bonds:
+            segs = mol_bond_geometry(mol,self.chem_style).segments + np.tile(offset,2)
+            painter.strokePath(segments_to_path(segs),pen)
+
+        labels = [(atm,label_cache.label(mol.atom_label(atm),font,1.0)) for atm in mol.atoms if mol.is_explicit_atom(atm)]
+        if not labels:
+            return
+
+        # All label backgrounds of a molecule are filled at once
+        # (winding fill, so overlapping backgrounds do not cancel)...
+        backs = QtGui.QPainterPath()
+        backs.setFillRule(Qt.FillRule.WindingFill)
+        for atm,lbl in labels:
+            ax,ay = atm.pos + offset
+            backs.addRect(lbl.back_rect.translated(ax,ay))
+        painter.fillPath(backs,back_brush)
+
+        # ...before the symbols are written on top of them:
+        painter.setPen(pen)
+        for atm,lbl in labels:
+            ax,ay = atm.pos + offset
+            painter.drawStaticText(lbl.text_offset + QtCore.QPointF(ax,ay),lbl.static_text)
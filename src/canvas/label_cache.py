@@ -0,0 +1,82 @@
+
+from PyQt5 import QtCore, QtGui
+from PyQt5.QtCore import Qt
+
+
+class AtomLabel:
+    """
+    A prepared atom label. All rectangles are relative to the
+    (already transformed) position of the atom, so drawing a
+    label only requires translating them.
+    """
+
+    def __init__(self, text:str, font:QtGui.QFont,) -> None:
+        fm = QtGui.QFontMetricsF(font)
+
+        # We want to vertically and horizontally center the atom
+        # symbol at the position of the atom. To achieve this, we
+        # use the tight bounding rect of the text:
+        text_rect = QtCore.QRectF(fm.tightBoundingRect(text))
+        text_width = text_rect.width()
+        text_height = text_rect.height()
+        text_rect.translate(-text_width/2,text_height/2)
+        self.text_rect = text_rect
+
+        # If bonds are drawn from an explicit atom, then
+        # the bonds would draw over the atom label leading to
+        # lines clashing with each other. To avoid this effect,
+        # we paint a white rectangle behind the symbol that will
+        # remove any possible bonds.
+        # This also includes some small amount of padding to
+        # visually separate the atom symbols from the bond lines:
+        atom_pad = 0.5
+        back_rect = QtCore.QRectF(text_rect)
+        back_rect.setWidth(back_rect.width() * (1 + 2*atom_pad))
+        back_rect.setHeight(back_rect.height() * (1 + 2*atom_pad))
+        back_rect.translate(-back_rect.width() * atom_pad/2, -back_rect.height() * atom_pad/2)
+        self.back_rect = back_rect
+
+        self.static_text = QtGui.QStaticText(text)
+        self.static_text.setTextFormat(Qt.TextFormat.PlainText)
+        self.static_text.prepare(QtGui.QTransform(),font)
+        size = self.static_text.size()
+        self.text_offset = text_rect.center() - QtCore.QPointF(size.width()/2,size.height()/2)
+
+    def draw(self, painter:QtGui.QPainter, ax:float, ay:float, back_brush:QtGui.QBrush,) -> None:
+        painter.fillRect(self.back_rect.translated(ax,ay),back_brush)
+        painter.drawStaticText(self.text_offset + QtCore.QPointF(ax,ay),self.static_text)
+
+
+class LabelCache:
+    """
+    Caches laid out atom labels keyed by (text, font, zoom).
+    Labels only depend on the zoom level through the font size,
+    so whenever the zoom changes all cached labels are dropped.
+    """
+
+    def __init__(self) -> None:
+        self._labels:dict[tuple,AtomLabel] = {}
+        self._zoomf = None
+        self._base_font_key = None
+        self._font = None
+
+    def scaled_font(self, base_font:QtGui.QFont, zoomf:float) -> QtGui.QFont:
+        base_font_key = base_font.key()
+        if zoomf != self._zoomf or base_font_key != self._base_font_key:
+            self._labels.clear()
+            self._zoomf = zoomf
+            self._base_font_key = base_font_key
+            self._font = QtGui.QFont(base_font)
+            self._font.setPointSizeF(base_font.pointSizeF() * zoomf)
+        return self._font
+
+    def label(self, text:str, font:QtGui.QFont, zoomf:float) -> AtomLabel:
+        key = (text,font.key(),zoomf)
+        lbl = self._labels.get(key)
+        if lbl is None:
+            lbl = AtomLabel(text,font)
+            self._labels[key] = lbl
+        return lbl
+
+    def __len__(self) -> int:
+        return len(self._labels)
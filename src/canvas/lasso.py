@@ -0,0 +1,71 @@
+
+import numpy as np
+
+
+def simplify_path(path:np.ndarray, tolerance:float) -> np.ndarray:
+    """
+    Simplifies a polyline with the Ramer-Douglas-Peucker algorithm:
+    points closer than tolerance to the simplified line are dropped.
+
+    >>> path = np.array([[0.,0.],[5.,0.1],[10.,0.],[10.,10.]])
+    >>> simplify_path(path,1.0).tolist()
+    [[0.0, 0.0], [10.0, 0.0], [10.0, 10.0]]
+    """
+    path = np.asarray(path,dtype=float).reshape((-1,2))
+    if len(path) < 3:
+        return path
+    keep = np.zeros(len(path),dtype=bool)
+    keep[0] = keep[-1] = True
+    stack = [(0,len(path)-1)]
+    while stack:
+        first,last = stack.pop()
+        if last - first < 2:
+            continue
+        a,b = path[first],path[last]
+        d = b - a
+        rel = path[first+1:last] - a
+        length = np.hypot(*d)
+        if length > 0:
+            dist = np.abs(d[0]*rel[:,1] - d[1]*rel[:,0]) / length
+        else:
+            dist = np.hypot(rel[:,0],rel[:,1])
+        i = int(np.argmax(dist))
+        if dist[i] > tolerance:
+            mid = first + 1 + i
+            keep[mid] = True
+            stack += [(first,mid),(mid,last)]
+    return path[keep]
+
+
+def points_in_polygon(points:np.ndarray, polygon:np.ndarray, y_order=None) -> np.ndarray:
+    """
+    Even-odd test of all points against a closed polygon. y_order,
+    the argsort of the points' y coordinates, can be passed in if it
+    is known already. Every edge then only looks at the points within
+    its y range, which makes the test about linear in the number of
+    points instead of points times edges.
+
+    >>> square = np.array([[0.,0.],[10.,0.],[10.,10.],[0.,10.]])
+    >>> points_in_polygon(np.array([[5.,5.],[15.,5.],[5.,-1.]]),square).tolist()
+    [True, False, False]
+    """
+    points = np.asarray(points,dtype=float).reshape((-1,2))
+    inside = np.zeros(len(points),dtype=bool)
+    if len(polygon) < 3 or not len(points):
+        return inside
+    if y_order is None:
+        y_order = np.argsort(points[:,1],kind="stable")
+    xs = points[y_order,0]
+    ys = points[y_order,1]
+    result = np.zeros(len(points),dtype=bool)
+    p1 = np.asarray(polygon,dtype=float)
+    p2 = np.roll(p1,-1,axis=0)
+    # Half open in y, so vertices are not counted twice:
+    lo = np.searchsorted(ys,np.minimum(p1[:,1],p2[:,1]),side="left")
+    hi = np.searchsorted(ys,np.maximum(p1[:,1],p2[:,1]),side="left")
+    for e in np.flatnonzero(hi > lo).tolist():
+        (x1,y1),(x2,y2),l,h = p1[e],p2[e],lo[e],hi[e]
+        x_cross = x1 + (ys[l:h] - y1) * ((x2 - x1) / (y2 - y1))
+        inside[l:h] ^= xs[l:h] < x_cross
+    result[y_order] = inside
+    return result
@@ -0,0 +1,53 @@
+
+from PyQt5 import QtCore, QtNetwork
+
+from scripting import ScriptSession
+
+
+class ScriptServer(QtCore.QObject):
+    """
+    Serves a ScriptSession on a local socket (a Unix domain socket on
+    Linux and macOS). Clients send one JSON-RPC request or batch per
+    line and get one response line back.
+
+    Everything runs on the GUI thread as part of the event loop, so
+    requests are applied between input events and the model never
+    sees two threads at a time.
+    """
+
+    def __init__(self, session:ScriptSession, path:str,) -> None:
+        super().__init__()
+        self.session = session
+        self.path = path
+        self._buffers:dict[int,bytes] = {}
+        self._server = QtNetwork.QLocalServer(self)
+        # A socket file left behind by a crashed editor would block us:
+        QtNetwork.QLocalServer.removeServer(path)
+        assert self._server.listen(path), f"Cannot listen on {path}: {self._server.errorString()}"
+        self._server.newConnection.connect(self._on_connection)
+
+    def _on_connection(self) -> None:
+        while self._server.hasPendingConnections():
+            sock = self._server.nextPendingConnection()
+            self._buffers[id(sock)] = b""
+            sock.readyRead.connect(lambda sock=sock: self._on_ready_read(sock))
+            sock.disconnected.connect(lambda sock=sock: self._on_disconnected(sock))
+
+    def _on_ready_read(self, sock:QtNetwork.QLocalSocket) -> None:
+        data = self._buffers[id(sock)] + bytes(sock.readAll())
+        *lines,rest = data.split(b"\n")
+        self._buffers[id(sock)] = rest
+        for line in lines:
+            if not line.strip():
+                continue
+            response = self.session.handle_line(line.decode("utf-8"))
+            if response is not None:
+                sock.write((response + "\n").encode("utf-8"))
+        sock.flush()
+
+    def _on_disconnected(self, sock:QtNetwork.QLocalSocket) -> None:
+        self._buffers.pop(id(sock),None)
+        sock.deleteLater()
+
+    def close(self) -> None:
+        self._server.close()
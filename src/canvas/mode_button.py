@@ -27,12 +27,19 @@ class Mode(enum.Enum):
     DOUBLE_BOND = "double_bond"
     TRIPLE_BOND = "triple_bond"
     RECT_SELECT = "rect_select"
+    LASSO_SELECT = "lasso_select"
     TRANSLATE = "translate"
+    ROTATE = "rotate"
+    MIRROR = "mirror"
+    SCALE = "scale"
 
 
     def is_bond_mode(self) -> bool:
         return self in [Mode.SINGLE_BOND,Mode.DOUBLE_BOND,Mode.TRIPLE_BOND]
 
+    def is_transform_mode(self) -> bool:
+        return self in [Mode.TRANSLATE,Mode.ROTATE,Mode.MIRROR,Mode.SCALE]
+
     def to_bond_order(self) -> int:
         assert self.is_bond_mode(), "attempted to convert non-bond mode to bond order!"
         return {Mode.SINGLE_BOND: 1, Mode.DOUBLE_BOND: 2, Mode.TRIPLE_BOND: 3,}[self]
@@ -113,6 +120,16 @@ class ModeButton(QtWidgets.QPushButton):
             pad = 4
             painter.drawRect(pad,pad,w-pad*2,h-pad*2)
 
+        elif self.mode == Mode.LASSO_SELECT:
+            pen.setStyle(Qt.PenStyle.DotLine)
+            painter.setPen(pen)
+            pad = 4
+            painter.drawEllipse(QtCore.QRectF(pad,pad,w-pad*2,h*0.6))
+            # the end of the lasso rope
+            pen.setStyle(Qt.PenStyle.SolidLine)
+            painter.setPen(pen)
+            painter.drawLine(QtCore.QLineF(w/2,pad+h*0.6,w/2-2,h-pad))
+
         elif self.mode == Mode.TRANSLATE:
             pen.setStyle(Qt.PenStyle.SolidLine)
             painter.setPen(pen)
@@ -130,7 +147,29 @@ class ModeButton(QtWidgets.QPushButton):
             painter.drawLine(QtCore.QLineF(w/2,pad,w/2-d,pad+d,))
             painter.drawLine(QtCore.QLineF(w/2,h-pad,w/2-d,h-pad-d,))
             painter.drawLine(QtCore.QLineF(w/2,h-pad,w/2+d,h-pad-d,))
-        
+
+        elif self.mode == Mode.ROTATE:
+            pad = 5
+            # three quarters of a circle with an arrow tip at its end
+            painter.drawArc(QtCore.QRectF(pad,pad,w-pad*2,h-pad*2),90*16,270*16)
+            d = 3
+            painter.drawLine(QtCore.QLineF(w-pad,h/2,w-pad-d,h/2-d))
+            painter.drawLine(QtCore.QLineF(w-pad,h/2,w-pad+d,h/2-d))
+
+        elif self.mode == Mode.MIRROR:
+            # a triangle and its mirror image on both sides of a dotted axis
+            painter.drawPolygon(QtGui.QPolygonF([QtCore.QPointF(w/2-3,pad+2),QtCore.QPointF(w/2-3,h-pad-2),QtCore.QPointF(pad,h-pad-2)]))
+            painter.drawPolygon(QtGui.QPolygonF([QtCore.QPointF(w/2+3,pad+2),QtCore.QPointF(w/2+3,h-pad-2),QtCore.QPointF(w-pad,h-pad-2)]))
+            pen.setStyle(Qt.PenStyle.DotLine)
+            painter.setPen(pen)
+            painter.drawLine(QtCore.QLineF(w/2,0,w/2,h))
+
+        elif self.mode == Mode.SCALE:
+            # a small and a large square sharing a corner
+            pad = 4
+            painter.drawRect(QtCore.QRectF(pad,h/2,w/2-pad,h/2-pad))
+            painter.drawRect(QtCore.QRectF(pad,pad,w-pad*2,h-pad*2))
+
         else:
             assert False, f"Unknown mode {self.mode}"
         
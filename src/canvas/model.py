@@ -1,19 +1,25 @@
 
+from contextlib import contextmanager
 import enum
 import math
 from pathlib import Path
 import random
 import sys
-from typing import TYPE_CHECKING, Optional 
+from typing import Optional 
 
-from PyQt6 import QtCore, QtGui, QtWidgets
-from PyQt6.QtCore import Qt
 import numpy as np
 
-if TYPE_CHECKING:
-    from app import ChemApp
-
-from core import Atom,Bond,Angle, DocItem,Mol, Rect, debug_trace, eucl_dist,rot_2d
+from canvas.affine import SelectionTransform, reflection, rotation, scaling
+from canvas.arrange import group_bounding_boxes, shelf_pack
+from canvas.atom_index import AtomIndex
+from canvas.bond_geometry import point_segment_distances
+from canvas.clashes import Clashes, find_clashes
+from canvas.lasso import points_in_polygon, simplify_path
+from canvas.model_events import (
+    AtomsAdded, AtomsChanged, AtomsMoved, BondsAdded, HoverChanged, ModelEvent,
+    MolsAdded, MolsMerged, SelectionChanged, Subscriber,
+)
+from core import Atom,Bond,Angle, DocItem,Fragment,Mol, Rect, acceptable_angles, debug_trace, eucl_dist,rot_2d
 
 
 class CanvasModel:
@@ -24,11 +30,295 @@ class CanvasModel:
         self.mols:list[Mol] = [] 
         self.active_bond = None
         self.selection_rectangle = None
+        self.selection_lasso:Optional[np.ndarray] = None
         self.selection = []
         self.delta_coords = 5
         self.current_atom_symbol = 'C'
         self.current_bond_order = 1
         self.bond_constraint_slack = 20
+        self.hovered:Optional[DocItem] = None
+        self.highlighted:list[Atom] = []
+        # Set while the selection is moved, rotated, mirrored or scaled
+        # (see begin_transform):
+        self.translating = False
+        self.transform:Optional[SelectionTransform] = None
+
+        # Inverted indexes from atom attributes to atoms, so that
+        # queries only cost as much as the number of matches:
+        self.atom_indexes = {"symbol": AtomIndex("symbol"),"uid": AtomIndex("uid"),}
+        self._mol_of_atom:dict[int,Mol] = {}
+        self._pick_arrays = None
+        self._pick_y_order = None
+
+        # Called with a ModelEvent after every change, see subscribe:
+        self._subscribers:list[Subscriber] = []
+        # Events held back by an open transaction:
+        self._pending_events:Optional[list[ModelEvent]] = None
+
+        # Every change to what the document looks like bumps its
+        # revision. Caches remember the revision they were built
+        # for and catch up using the regions (world bounding boxes)
+        # that were logged as dirty since then:
+        self.revision = 0
+        # Only bumped by changes to atoms and bonds themselves, not
+        # by changes of the selection:
+        self.geometry_revision = 0
+        self.dirty_regions:list[tuple[int,Optional[np.ndarray]]] = []
+        self.max_dirty_regions = 1000
+
+    def mark_dirty(self, points=None, geometry:bool=True,) -> None:
+        """
+        Bumps the document revision. points are the world coordinates
+        touched by the change, None means that the whole document
+        has to be considered dirty. geometry is False for changes that
+        leave all atoms and bonds as they are.
+        """
+        self.revision += 1
+        if geometry:
+            self.geometry_revision += 1
+        bbox = None
+        if points is not None:
+            points = np.asarray(points,dtype=float).reshape((-1,2))
+            if len(points):
+                bbox = np.array([points.min(axis=0),points.max(axis=0)])
+            else:
+                bbox = np.array([[np.inf,np.inf],[-np.inf,-np.inf]])
+        self.dirty_regions.append((self.revision,bbox))
+        if len(self.dirty_regions) > self.max_dirty_regions:
+            del self.dirty_regions[:-self.max_dirty_regions]
+
+    def subscribe(self, callback:Subscriber) -> None:
+        """
+        Registers a callback that gets every ModelEvent, so that
+        indexes and caches (and the autosave journal) can follow
+        the document incrementally instead of rescanning it.
+        """
+        self._subscribers.append(callback)
+
+    def unsubscribe(self, callback:Subscriber) -> None:
+        self._subscribers.remove(callback)
+
+    def _emit(self, event:ModelEvent) -> None:
+        event.revision = self.revision
+        if self._pending_events is not None:
+            self._pending_events.append(event)
+            return
+        for callback in list(self._subscribers):
+            callback(event)
+
+    @contextmanager
+    def transaction(self):
+        """
+        Groups several operations: subscribers get all their events
+        once the (outermost) transaction ends, so e.g. the canvas is
+        repainted once for the whole group, not after every operation.
+        There is no rollback, operations that succeeded stay applied.
+        """
+        if self._pending_events is not None:
+            yield
+            return
+        self._pending_events = []
+        try:
+            yield
+        finally:
+            events,self._pending_events = self._pending_events,None
+            for event in events:
+                for callback in list(self._subscribers):
+                    callback(event)
+
+    def dirty_regions_since(self, revision:int) -> Optional[list[Optional[np.ndarray]]]:
+        """
+        Returns the dirty bounding boxes logged after the given
+        revision or None if the log does not reach back that far.
+        """
+        if revision == self.revision:
+            return []
+        if not self.dirty_regions or self.dirty_regions[0][0] > revision + 1:
+            return None
+        return [bbox for rev,bbox in self.dirty_regions if rev > revision]
+
+    @staticmethod
+    def _item_points(items) -> list[np.ndarray]:
+        points = []
+        for itm in items:
+            if isinstance(itm,Bond):
+                points += [itm.fst.pos,itm.snd.pos]
+            else:
+                points.append(itm.pos)
+        return points
+
+    def set_selection(self, items:list[DocItem]) -> None:
+        # Replaces the selection.
+        old_ids = {id(itm) for itm in self.selection}
+        new_ids = {id(itm) for itm in items}
+        removed = [itm for itm in self.selection if id(itm) not in new_ids]
+        added = [itm for itm in items if id(itm) not in old_ids]
+        self.selection = items
+        if added or removed:
+            self.mark_dirty(self._item_points(added + removed),geometry=False)
+            self._emit(SelectionChanged(added=added,removed=removed))
+
+    def extend_selection(self, items:list[DocItem], dirty_points=None,) -> None:
+        """
+        Adds items that are not selected yet. Callers that already know
+        where the new items are can pass dirty_points, which saves
+        collecting the positions item by item.
+        """
+        if not items:
+            return
+        self.selection = self.selection + items
+        if dirty_points is None:
+            dirty_points = self._item_points(items)
+        self.mark_dirty(dirty_points,geometry=False)
+        self._emit(SelectionChanged(added=items,removed=[]))
+
+    def set_hovered(self, item:Optional[DocItem]) -> None:
+        # Hovering is drawn on top of the (cached) document,
+        # so it does not count as a change of the document:
+        if self.hovered is item:
+            return
+        old = self.hovered
+        if old:
+            old.set_hovered(False)
+        self.hovered = item
+        if item:
+            item.set_hovered(True)
+        self._emit(HoverChanged(old=old,new=item))
+
+    def set_viewport(self, lo:np.ndarray, hi:np.ndarray) -> None:
+        # Called with the visible world rectangle whenever it changed,
+        # but never from within a paint event. Models that keep their
+        # document on disk load what is visible:
+        pass
+
+    def add_atom(self, symbol:str, pos:np.ndarray) -> Mol:
+        # Per definition, a single atom is placed in its own molecule:
+        mol = Mol(atoms=[Atom(symbol,pos)],bonds=[])
+        self.mols.append(mol)
+        self._register_mols([mol])
+        self._index_atoms(mol.atoms)
+        self.mark_dirty([pos])
+        self._emit(MolsAdded(mols=[mol]))
+        self._emit(AtomsAdded(atoms=mol.atoms))
+        return mol
+
+    def add_mols(self, mols:list[Mol]) -> None:
+        # Adds complete molecules, e.g. when restoring a document:
+        self.mols += mols
+        self._register_mols(mols)
+        atoms = [atm for mol in mols for atm in mol.atoms]
+        self._index_atoms(atoms)
+        self.mark_dirty(None)
+        self._emit(MolsAdded(mols=mols))
+        self._emit(AtomsAdded(atoms=atoms))
+        self._emit(BondsAdded(bonds=[bnd for mol in mols for bnd in mol.bonds]))
+
+    def _register_mols(self, mols:list[Mol]) -> None:
+        # Keeps track of the molecule every atom belongs to. Merging
+        # molecules already costs time linear in their size, so we
+        # can afford to update the lookup at the same time:
+        for mol in mols:
+            for atm in mol.atoms:
+                self._mol_of_atom[id(atm)] = mol
+
+    def mol_of_atom(self, atm:Atom) -> Optional[Mol]:
+        return self._mol_of_atom.get(id(atm))
+
+    def atoms_by_mol(self, atoms:list[Atom]) -> list[tuple[Mol,list[Atom]]]:
+        groups:dict[int,tuple[Mol,list[Atom]]] = {}
+        for atm in atoms:
+            mol = self.mol_of_atom(atm)
+            if mol is not None:
+                groups.setdefault(id(mol),(mol,[]))[1].append(atm)
+        return list(groups.values())
+
+    def _index_atoms(self, atoms:list[Atom]) -> None:
+        for index in self.atom_indexes.values():
+            index.add(atoms)
+
+    def set_atom_symbol(self, atm:Atom, symbol:str) -> None:
+        if atm.symbol == symbol:
+            return
+        atm.symbol = symbol
+        self.atom_indexes["symbol"].update(atm)
+        mol = self.mol_of_atom(atm)
+        if mol:
+            mol.atom_changed(atm)
+        self.mark_dirty([atm.pos])
+        self._emit(AtomsChanged(atoms=[atm]))
+
+    def find_atoms(self, value, attr:str="symbol") -> list[Atom]:
+        return self.atom_indexes[attr].lookup(value)
+
+    def select_matching(self, value, attr:str="symbol", add_to_selection:bool=False) -> None:
+        matches = self.find_atoms(value,attr)
+        if add_to_selection:
+            selected = {id(itm) for itm in self.selection}
+            matches = self.selection + [atm for atm in matches if id(atm) not in selected]
+        self.set_selection(matches)
+
+    def find_duplicates(self) -> list[list[Mol]]:
+        """
+        Groups all molecules with the same molecular graph. Only
+        groups with more than one molecule are returned. Canonical
+        hashes are cached per molecule, so repeated calls only hash
+        molecules that changed in between.
+        """
+        groups:dict[str,list[Mol]] = {}
+        for mol in self.mols:
+            groups.setdefault(mol.canonical_hash(),[]).append(mol)
+        return [group for group in groups.values() if len(group) > 1]
+
+    def highlight_duplicates(self) -> None:
+        # The first molecule of every group is regarded as the original:
+        self.set_highlighted([atm for group in self.find_duplicates() for mol in group[1:] for atm in mol.atoms])
+
+    def set_highlighted(self, atoms:list[Atom]) -> None:
+        # Highlights are drawn on top of the document, just like hovering:
+        self.highlighted = atoms
+
+    def highlight_matching(self, value, attr:str="symbol") -> None:
+        self.set_highlighted(self.find_atoms(value,attr))
+
+    def find_clashes(self, label_rect) -> Clashes:
+        """
+        Finds bonds crossing each other and bonds running through atom
+        labels. label_rect(text) gives the box (left,top,right,bottom)
+        of a label relative to its atom, in world units.
+        """
+        atoms, bonds = [], []
+        labels, label_boxes = [], []
+        # There are only a few distinct labels:
+        rects = {}
+        for mol in self.mols:
+            atoms += mol.atoms
+            bonds += mol.bonds
+            for atm in mol.atoms:
+                if mol.is_explicit_atom(atm):
+                    text = mol.atom_label(atm)
+                    if text not in rects:
+                        rects[text] = label_rect(text)
+                    labels.append(atm)
+                    label_boxes.append(rects[text])
+        if not bonds:
+            return Clashes()
+
+        idx = {id(atm): i for i,atm in enumerate(atoms)}
+        pos = np.array([atm.pos for atm in atoms],dtype=float)
+        bond_atoms = np.array([(idx[id(bnd.fst)],idx[id(bnd.snd)]) for bnd in bonds],dtype=int)
+        label_atoms = np.array([idx[id(atm)] for atm in labels],dtype=int)
+        label_boxes = np.array(label_boxes,dtype=float).reshape((-1,4))
+        label_pos = pos[label_atoms]
+        crossings,points,overlaps = find_clashes(
+            pos[bond_atoms[:,0]],pos[bond_atoms[:,1]],bond_atoms,
+            label_pos + label_boxes[:,:2],label_pos + label_boxes[:,2:],label_atoms,
+            cell=self.BOND_LENGTH,
+        )
+        return Clashes(
+            crossings=[(bonds[i],bonds[j]) for i,j in crossings.tolist()],
+            crossing_points=points,
+            label_overlaps=[(labels[i],bonds[j]) for i,j in overlaps.tolist()],
+        )
 
     def document_items(self) -> list[DocItem]:
         for mol in self.mols:
@@ -38,23 +328,42 @@ class CanvasModel:
                 yield bnd
 
     
+    def _pickable(self):
+        # Positions only change with the geometry revision, so the arrays
+        # used for hit-testing are rebuilt at most once per revision:
+        if self._pick_arrays is None or self._pick_arrays[0] != self.geometry_revision:
+            atoms = [atm for mol in self.mols for atm in mol.atoms]
+            bonds = [bnd for mol in self.mols for bnd in mol.bonds]
+            idx = {id(atm): i for i,atm in enumerate(atoms)}
+            atom_pos = np.array([atm.pos for atm in atoms],dtype=float).reshape((-1,2))
+            bond_atoms = np.array([(idx[id(bnd.fst)],idx[id(bnd.snd)]) for bnd in bonds],dtype=int).reshape((-1,2))
+            self._pick_arrays = (self.geometry_revision,atoms,atom_pos,bonds,bond_atoms)
+        return self._pick_arrays[1:]
+
     def doc_item_near_pos(self, p_mouse:np.array, ) -> Optional[DocItem]:
-        hit = None
+        """
+        Returns the atom or bond closest to p_mouse, if it is within
+        10 units. Bonds count with their whole length, not just their
+        center.
+        """
         delta_max = 10
-        best_dist = 10000000
-        for mol in self.mols:
-
-            for atm in mol.atoms:
-                dist = eucl_dist(atm.pos,p_mouse)
-                if dist < delta_max and dist < best_dist:
-                    hit = atm
-                    best_dist = dist
-
-            for bnd in mol.bonds:
-                dist = eucl_dist(bnd.center_pos(),p_mouse)
-                if dist < delta_max and dist < best_dist:
-                    hit = bnd
-                    best_dist = dist
+        atoms, atom_pos, bonds, bond_atoms = self._pickable()
+        p_mouse = np.asarray(p_mouse,dtype=float)
+        hit, best_dist = None, delta_max
+        if atoms:
+            dist = np.sqrt(((atom_pos - p_mouse)**2).sum(axis=1))
+            i = int(np.argmin(dist))
+            if dist[i] < best_dist:
+                hit, best_dist = atoms[i], dist[i]
+            # Every bond passes right by its atoms, so the
+            # cursor has to be kept off them to pick a bond:
+            if best_dist < delta_max / 2:
+                return hit
+        if bonds:
+            dist = point_segment_distances(p_mouse,atom_pos[bond_atoms[:,0]],atom_pos[bond_atoms[:,1]])
+            i = int(np.argmin(dist))
+            if dist[i] < best_dist:
+                hit = bonds[i]
         return hit
 
 
@@ -72,14 +381,214 @@ class CanvasModel:
                     mol_found = mol
         return mol_found,atm_found
 
+    def _existing_atoms_near(self, coords:np.ndarray, delta_max:float):
+        """
+        For every row of coords, returns the (mol,atm) pair of the
+        closest already existing atom that lies within delta_max or
+        None if there is no such atom.
+        """
+        n = coords.shape[0]
+        hits = [None] * n
+        if n == 0:
+            return hits
+
+        # We only ever need the atoms around the fragment, so we
+        # gather their positions once and restrict them to the
+        # bounding box of the fragment (plus some margin):
+        lo = coords.min(axis=0) - delta_max
+        hi = coords.max(axis=0) + delta_max
+        cand_atms, cand_mols, cand_pos = [], [], []
+        for mol in self.mols:
+            for atm in mol.atoms:
+                if (atm.pos >= lo).all() and (atm.pos <= hi).all():
+                    cand_atms.append(atm)
+                    cand_mols.append(mol)
+                    cand_pos.append(atm.pos)
+        if not cand_atms:
+            return hits
+
+        cand_pos = np.array(cand_pos, dtype=float).reshape((-1,2))
+        chunk = 512
+        for start in range(0, n, chunk):
+            diff = coords[start:start+chunk,None,:] - cand_pos[None,:,:]
+            dist2 = (diff**2).sum(axis=-1)
+            best = dist2.argmin(axis=1)
+            best_dist2 = dist2[np.arange(len(best)),best]
+            for offset in np.flatnonzero(best_dist2 < delta_max**2):
+                k = best[offset]
+                hits[start+offset] = (cand_mols[k],cand_atms[k])
+        return hits
+
+
+    def selection_fragment(self) -> Fragment:
+        """
+        Takes a snapshot of the selected atoms and all bonds between them.
+        """
+        atoms = [itm for itm in self.selection if isinstance(itm,Atom)]
+        mols = {}
+        for atm in atoms:
+            mol = self.mol_of_atom(atm)
+            if mol is not None:
+                mols[id(mol)] = mol
+        bonds = [bnd for mol in mols.values() for bnd in mol.bonds]
+        return Fragment.from_items(atoms,bonds)
+
+    def add_fragment(self, symbols:list[str], coords:np.ndarray, bonds, orders=None, fuse_delta:float=10,) -> list[Mol]:
+        """
+        Inserts a whole fragment in one go. symbols and coords describe
+        the atoms of the fragment, bonds is a sequence of (i,j) index
+        pairs into them and orders holds the bond orders (single bonds
+        if omitted).
+        Fragment atoms that land within fuse_delta of an existing atom
+        are fused with that atom, and all molecules touched that way are
+        merged with the fragment in a single pass. Returns the molecules
+        that were created. Bonds pointing outside the fragment raise a
+        ValueError and leave the document unchanged.
+        """
+        return self._add_fragment(symbols,coords,bonds,orders,fuse_delta)[0]
+
+    def add_fragment_atoms(self, symbols:list[str], coords:np.ndarray, bonds, orders=None, fuse_delta:float=10,) -> list[Atom]:
+        # Like add_fragment, but returns the document atom of every
+        # fragment atom (which is an existing atom if it got fused):
+        return self._add_fragment(symbols,coords,bonds,orders,fuse_delta)[1]
+
+    def _add_fragment(self, symbols:list[str], coords:np.ndarray, bonds, orders=None, fuse_delta:float=10,) -> tuple[list[Mol],list[Atom]]:
+        coords = np.asarray(coords, dtype=float).reshape((-1,2))
+        bonds = np.asarray(bonds, dtype=int).reshape((-1,2))
+        n = len(symbols)
+        assert coords.shape[0] == n, "every fragment atom needs coordinates!"
+        if orders is None:
+            orders = [1] * len(bonds)
+        orders = np.asarray(orders).tolist()
+        assert len(orders) == len(bonds), "every fragment bond needs an order!"
+        # Fragments come from scripts and the clipboard, so we check the
+        # bonds before anything in the document is touched:
+        if len(bonds) and (bonds.min() < 0 or bonds.max() >= n):
+            raise ValueError("bond index out of range")
+        if np.any(bonds[:,0] == bonds[:,1]):
+            raise ValueError("an atom cannot be bonded to itself")
+
+        fused = self._existing_atoms_near(coords, fuse_delta) if fuse_delta else [None] * n
+
+        # Fragment atoms are nodes 0..n-1, molecules that some fragment
+        # atom got fused into are appended behind them. A union find
+        # over these nodes then gives us the resulting molecules:
+        touched_mols:list[Mol] = []
+        mol_node = {}
+        for hit in fused:
+            if hit and id(hit[0]) not in mol_node:
+                mol_node[id(hit[0])] = n + len(touched_mols)
+                touched_mols.append(hit[0])
+
+        parent = list(range(n + len(touched_mols)))
+        def find(i):
+            while parent[i] != i:
+                parent[i] = parent[parent[i]]
+                i = parent[i]
+            return i
+        def union(i,j):
+            ri,rj = find(i),find(j)
+            if ri != rj:
+                parent[ri] = rj
+
+        for i,hit in enumerate(fused):
+            if hit:
+                union(i, mol_node[id(hit[0])])
+        for i,j in bonds:
+            union(int(i),int(j))
+
+        atoms = [hit[1] if hit else Atom(symbols[i],coords[i].copy()) for i,hit in enumerate(fused)]
+
+        groups = {}
+        for node in range(len(parent)):
+            groups.setdefault(find(node),[]).append(node)
+
+        new_mols = []
+        mol_of_root = {}
+        sources_of_mol = {}
+        for root,nodes in groups.items():
+            mol_atoms, mol_bonds = [], []
+            for node in nodes:
+                if node >= n:
+                    mol = touched_mols[node-n]
+                    mol_atoms += mol.atoms
+                    mol_bonds += mol.bonds
+                elif not fused[node]:
+                    mol_atoms.append(atoms[node])
+            mol = Mol(atoms=mol_atoms,bonds=mol_bonds)
+            sources = [touched_mols[node-n] for node in nodes if node >= n]
+            for source in sources:
+                mol.inherit_valences(source)
+            sources_of_mol[id(mol)] = sources
+            mol_of_root[root] = mol
+            new_mols.append(mol)
+
+        # Finally, we add the bonds of the fragment. Bonds between two
+        # fused atoms might already exist, so we skip those:
+        new_bonds = []
+        existing = set()
+        for mol in touched_mols:
+            for bnd in mol.bonds:
+                existing.add(frozenset((id(bnd.fst),id(bnd.snd))))
+        for (i,j),order in zip(bonds,orders):
+            fst,snd = atoms[i],atoms[j]
+            key = frozenset((id(fst),id(snd)))
+            if fst is snd or key in existing:
+                continue
+            existing.add(key)
+            bnd = Bond(fst=fst,snd=snd,order=order,)
+            mol_of_root[find(int(i))].add_bond(bnd)
+            new_bonds.append(bnd)
+
+        self.mols = [mol for mol in self.mols if id(mol) not in mol_node]
+        self.mols += new_mols
+        self._register_mols(new_mols)
+        new_atoms = [atm for atm,hit in zip(atoms,fused) if not hit]
+        self._index_atoms(new_atoms)
+        self.mark_dirty(coords)
+        for mol in new_mols:
+            sources = sources_of_mol[id(mol)]
+            self._emit(MolsMerged(sources=sources,merged=mol) if sources else MolsAdded(mols=[mol]))
+        if new_atoms:
+            self._emit(AtomsAdded(atoms=new_atoms))
+        if new_bonds:
+            self._emit(BondsAdded(bonds=new_bonds))
+        return new_mols,atoms
+
+
+    def add_bond(self, fst:Atom, snd:Atom, order:float=1,) -> Bond:
+        """
+        Bonds two atoms of the document, merging their molecules if
+        they are not connected yet.
+        """
+        mol_fst,mol_snd = self.mol_of_atom(fst),self.mol_of_atom(snd)
+        assert mol_fst is not None and mol_snd is not None, "both atoms have to be part of the document!"
+        assert fst is not snd, "cannot bond an atom to itself!"
+        if mol_fst is mol_snd and any({id(b.fst),id(b.snd)} == {id(fst),id(snd)} for b in mol_fst.bonds):
+            raise ValueError("the atoms are already bonded")
+        bnd = Bond(fst=fst,snd=snd,order=order,)
+        if mol_fst is mol_snd:
+            mol_fst.add_bond(bnd)
+        else:
+            merged = Mol.merge_molecules(mol_fst,mol_snd)
+            merged.add_bond(bnd)
+            self.mols = [mol for mol in self.mols if mol is not mol_fst and mol is not mol_snd]
+            self.mols.append(merged)
+            self._register_mols([merged])
+        self.mark_dirty([fst.pos,snd.pos])
+        if mol_fst is not mol_snd:
+            self._emit(MolsMerged(sources=[mol_fst,mol_snd],merged=merged))
+        self._emit(BondsAdded(bonds=[bnd]))
+        return bnd
+
     def acceptable_angle(self,ang:Angle):
-        ang = abs(round(ang.enclosed_angle()))
-        return ang in [30*i for i in range(12+1)]
+        return bool(acceptable_angles(np.array([ang.enclosed_angle()]))[0])
 
     
     def preview_new_bond(self, x1, y1, x2, y2, commit_action,):
         mol_from,atm_from = self.find_mol_and_atom_at_point(x1,y1)
         mol_to,atm_to = self.find_mol_and_atom_at_point(x2,y2)
+        existing_mols = [mol for mol in [mol_from,mol_to] if mol is not None]
 
         absolute_angle_constraints = False
         if not atm_from:
@@ -145,30 +654,165 @@ class CanvasModel:
 
         active_bond = Bond(fst=atm_from,snd=atm_to,order=self.current_bond_order,)
         if commit_action:
+            # Atoms we did not find in the document are new:
+            new_atoms = [atm for atm,mol in [(atm_from,mol_from),(atm_to,mol_to)] if mol not in existing_mols]
             if mol_from == mol_to:
-                mol_from.bonds.append(active_bond)
+                mol_from.add_bond(active_bond)
+                mol_merged = None
                 self.active_bond = None
             else:
                 mol_merged = Mol.merge_molecules(mol_from,mol_to)
-                mol_merged.bonds.append(active_bond)
+                mol_merged.add_bond(active_bond)
                 self.mols = [mol for mol in self.mols if mol not in [mol_from,mol_to,]]
                 self.mols.append(mol_merged)
+                self._register_mols([mol_merged])
                 self.active_bond = None
+            self._index_atoms(new_atoms)
+            self.mark_dirty([atm_from.pos,atm_to.pos])
+            if mol_merged is not None:
+                self._emit(MolsMerged(sources=existing_mols,merged=mol_merged) if existing_mols else MolsAdded(mols=[mol_merged]))
+            if new_atoms:
+                self._emit(AtomsAdded(atoms=new_atoms))
+            self._emit(BondsAdded(bonds=[active_bond]))
         else:
             # we are still in preview mode
             self.active_bond = active_bond
 
     
-    def translate(self, dx:float, dy:float,):
+    def begin_transform(self) -> SelectionTransform:
+        """
+        Starts a transform of the selected atoms. Until it is committed,
+        every preview starts over from the positions at this point.
+        """
+        if self.transform is None:
+            self.transform = SelectionTransform([itm for itm in self.selection if isinstance(itm,Atom)])
+            self.translating = True
+        return self.transform
+
+    def preview_transform(self, matrix:np.ndarray, offset=(0.,0.)) -> None:
+        # matrix is applied about the centroid of the selected atoms:
+        self.begin_transform().apply(matrix,offset)
+
+    def commit_transform(self) -> None:
+        transform = self.transform
+        self.transform = None
+        self.translating = False
+        if transform is None or not len(transform):
+            return
+        transform.detach()
+        groups = self.atoms_by_mol(transform.atoms)
+        # Bonds attached to a moved atom changed as well, they lie
+        # within the atoms of the touched molecules:
+        points = [transform.base,transform.pos]
+        points += [np.array([atm.pos for mol,_ in groups for atm in mol.atoms],dtype=float).reshape((-1,2))]
+        for mol,atoms in groups:
+            mol.moved(atoms)
+        self.mark_dirty(np.concatenate(points))
+        self._emit(AtomsMoved(atoms=transform.atoms))
+
+    def cancel_transform(self) -> None:
+        if self.transform is not None:
+            self.transform.cancel()
+            # The render geometry followed the preview:
+            for mol,atoms in self.atoms_by_mol(self.transform.atoms):
+                mol.moved(atoms)
+        self.transform = None
+        self.translating = False
+
+    def transform_selection(self, matrix:np.ndarray) -> None:
+        # Applies a transform right away, e.g. from a menu:
+        self.preview_transform(matrix)
+        self.commit_transform()
+
+    def arrange(self, aspect:float=1.5) -> None:
+        """
+        Packs all molecules into rows without overlaps, starting at the
+        upper left corner of the document. The rows are about aspect
+        times as wide as the whole arrangement is high. All atoms are
+        moved in a single batched update.
+        """
+        atoms = [atm for mol in self.mols for atm in mol.atoms]
+        if not atoms:
+            return
+        sizes = [len(mol.atoms) for mol in self.mols]
+        labels = np.repeat(np.arange(len(self.mols)),sizes)
+        pos = np.array([atm.pos for atm in atoms],dtype=float).reshape((-1,2))
+        new_pos = pos + self._shelf_layout(pos,labels,len(self.mols),aspect) + pos.min(axis=0)
+        for i,atm in enumerate(atoms):
+            atm.pos = new_pos[i].copy()
+        for mol in self.mols:
+            mol.moved()
+        self.mark_dirty(None)
+        self._emit(AtomsMoved(atoms=atoms))
+
+    def _shelf_layout(self, pos:np.ndarray, labels:np.ndarray, n_groups:int, aspect:float,) -> np.ndarray:
+        # The shift of every point that packs the groups of points into
+        # rows starting at the origin (see arrange):
+        lo,hi = group_bounding_boxes(pos,labels,n_groups)
+        size = hi - lo
+        # Keeps labels and implicit hydrogens apart as well:
+        gap = self.BOND_LENGTH
+        shelf_width = max(float(size[:,0].max()),math.sqrt(float(((size[:,0] + gap) * (size[:,1] + gap)).sum()) * aspect))
+        offsets = shelf_pack(size[:,0],size[:,1],shelf_width,gap)
+        return (offsets - lo)[labels]
+
+    def add_fragments(self, frags:list[Fragment], aspect:float=1.5,) -> list[Mol]:
+        """
+        Inserts many fragments (e.g. an imported collection) at once.
+        They are packed into rows like by arrange, below everything
+        that is on the sheet already, and inserted in a single batch.
+        """
+        frags = [frag for frag in frags if len(frag)]
+        if not frags:
+            return []
+        sizes = [len(frag) for frag in frags]
+        coords = np.concatenate([np.asarray(frag.coords,dtype=float).reshape((-1,2)) for frag in frags])
+        labels = np.repeat(np.arange(len(frags)),sizes)
+        origin = np.zeros(2)
+        atoms = [atm for mol in self.mols for atm in mol.atoms]
+        if atoms:
+            pos = np.array([atm.pos for atm in atoms],dtype=float)
+            origin = np.array([pos[:,0].min(),pos[:,1].max() + 2 * self.BOND_LENGTH])
+        coords = coords + self._shelf_layout(coords,labels,len(frags),aspect) + origin
+
+        starts = np.cumsum(sizes) - sizes
+        bonds = np.concatenate([np.asarray(frag.bonds,dtype=int).reshape((-1,2)) + start for frag,start in zip(frags,starts)])
+        orders = [order for frag in frags for order in frag.orders]
+        symbols = [symbol for frag in frags for symbol in frag.symbols]
+        return self.add_fragment(symbols,coords,bonds,orders=orders,fuse_delta=None)
 
-        for itm in self.selection:
-            itm:DocItem
-            itm.translate(dx,dy)
+    def translate(self, dx:float, dy:float,):
+        self.preview_transform(np.eye(2),(dx,dy))
 
     def commit_translate(self):
-        for itm in self.selection:
-            itm:DocItem
-            itm.commit_translate()
+        self.commit_transform()
+
+    def preview_rotate(self, x1, y1, x2, y2, snap:bool=False,) -> None:
+        """
+        Rotates the selection about its centroid by the angle the mouse
+        was dragged around it, from (x1,y1) to (x2,y2). snap rounds the
+        angle to multiples of 15°.
+        """
+        c = self.begin_transform().center
+        angle = math.degrees(math.atan2(y2-c[1],x2-c[0]) - math.atan2(y1-c[1],x1-c[0]))
+        if snap:
+            angle = 15 * round(angle / 15)
+        self.preview_transform(rotation(angle))
+
+    def preview_scale(self, x1, y1, x2, y2,) -> None:
+        # Scales by how much closer to or farther from the centroid the mouse got:
+        c = self.begin_transform().center
+        d1 = math.hypot(x1-c[0],y1-c[1])
+        factor = max(math.hypot(x2-c[0],y2-c[1]) / d1,0.05) if d1 > 0 else 1.0
+        self.preview_transform(scaling(factor))
+
+    def preview_mirror(self, x1, y1, x2, y2,) -> None:
+        # Mirrors at the line through the centroid parallel to the drag:
+        self.begin_transform()
+        if math.hypot(x2-x1,y2-y1) < self.delta_coords:
+            self.preview_transform(np.eye(2))
+            return
+        self.preview_transform(reflection(math.degrees(math.atan2(y2-y1,x2-x1))))
 
 
     def preview_rect_select(self,
@@ -178,12 +822,44 @@ class CanvasModel:
             commit_action:bool,):
 
         if not add_to_selection:
-            self.selection = []
+            self.set_selection([])
         selection_rectangle = Rect([x1,y1,x2,y2])
         self.selection_rectangle = selection_rectangle
 
         if commit_action:
+            selection = list(self.selection)
+            selected = {id(itm) for itm in selection}
             for itm in self.document_items():
-                if itm.within_rectangle(selection_rectangle) and itm not in self.selection:
-                    self.selection.append(itm)
+                if itm.within_rectangle(selection_rectangle) and id(itm) not in selected:
+                    selection.append(itm)
+            self.set_selection(selection)
             self.selection_rectangle = None
+
+    def preview_lasso_select(self, path, add_to_selection:bool, commit_action:bool,):
+        """
+        path holds the world coordinates the mouse was dragged along.
+        Committing selects all atoms within the closed path as well
+        as all bonds between two such atoms.
+        """
+        if not add_to_selection:
+            self.set_selection([])
+        self.selection_lasso = np.asarray(path,dtype=float).reshape((-1,2))
+
+        if commit_action:
+            polygon = simplify_path(self.selection_lasso,tolerance=self.BOND_LENGTH/10)
+            self.selection_lasso = None
+            if len(polygon) < 3:
+                return
+            atoms, atom_pos, bonds, bond_atoms = self._pickable()
+            if self._pick_y_order is None or self._pick_y_order[0] != self.geometry_revision:
+                self._pick_y_order = (self.geometry_revision,np.argsort(atom_pos[:,1],kind="stable"))
+            inside = points_in_polygon(atom_pos,polygon,self._pick_y_order[1])
+            bond_inside = inside[bond_atoms[:,0]] & inside[bond_atoms[:,1]]
+
+            new_items = [atoms[i] for i in np.flatnonzero(inside).tolist()]
+            new_items += [bonds[i] for i in np.flatnonzero(bond_inside).tolist()]
+            if self.selection:
+                selected = {id(itm) for itm in self.selection}
+                new_items = [itm for itm in new_items if id(itm) not in selected]
+            # Everything that got selected lies within the lasso:
+            self.extend_selection(new_items,dirty_points=atom_pos[inside])
@@ -0,0 +1,89 @@
+
+from dataclasses import dataclass, field
+from typing import Callable, Optional
+
+from core import Atom, Bond, DocItem, Mol
+
+
+@dataclass
+class ModelEvent:
+    """
+    Base class of the change notifications of a CanvasModel. Events
+    hold the affected objects themselves, atoms carry their uid.
+    Subscribers are called synchronously right after the change, so
+    everything they read from the model is already up to date.
+    """
+    # The model revision right after the change:
+    revision:int = field(default=0,init=False)
+
+
+@dataclass
+class AtomsAdded(ModelEvent):
+    # Atoms that are new to the document (not loaded ones, see MolsAdded):
+    atoms:list[Atom]
+
+    @property
+    def uids(self) -> list[int]:
+        return [atm.uid for atm in self.atoms]
+
+
+@dataclass
+class BondsAdded(ModelEvent):
+    bonds:list[Bond]
+
+
+@dataclass
+class AtomsMoved(ModelEvent):
+    atoms:list[Atom]
+
+    @property
+    def uids(self) -> list[int]:
+        return [atm.uid for atm in self.atoms]
+
+
+@dataclass
+class AtomsChanged(ModelEvent):
+    # Atoms whose element changed:
+    atoms:list[Atom]
+
+    @property
+    def uids(self) -> list[int]:
+        return [atm.uid for atm in self.atoms]
+
+
+@dataclass
+class MolsAdded(ModelEvent):
+    """
+    Molecules that appeared in the document together with all their
+    atoms and bonds. Atoms and bonds that did not exist before are
+    announced by AtomsAdded and BondsAdded in addition, molecules
+    loaded by a PagedCanvasModel only come with this event.
+    """
+    mols:list[Mol]
+
+
+@dataclass
+class MolsRemoved(ModelEvent):
+    mols:list[Mol]
+
+
+@dataclass
+class MolsMerged(ModelEvent):
+    # The sources are gone, merged holds all their atoms and bonds:
+    sources:list[Mol]
+    merged:Mol
+
+
+@dataclass
+class SelectionChanged(ModelEvent):
+    added:list[DocItem]
+    removed:list[DocItem]
+
+
+@dataclass
+class HoverChanged(ModelEvent):
+    old:Optional[DocItem]
+    new:Optional[DocItem]
+
+
+Subscriber = Callable[[ModelEvent],None]
@@ -0,0 +1,179 @@
+
+from collections import OrderedDict
+from typing import Optional
+
+import numpy as np
+
+from canvas.model import CanvasModel
+from canvas.model_events import HoverChanged, MolsAdded, MolsRemoved, SelectionChanged
+from core import Atom, Mol
+from journal import build_mols
+from paged_store import PagedStore
+
+
+class PagedCanvasModel(CanvasModel):
+    """
+    A CanvasModel for documents too large to keep in memory as Atom
+    and Bond objects. The document lives in a PagedStore on disk and
+    only the pages around the viewport are materialised as molecules.
+
+    Loaded pages are kept in LRU order. Once more than max_loaded_atoms
+    atoms are loaded, the least recently used pages outside of the
+    viewport are evicted. An evicted page whose molecules were changed
+    is written back to the store first.
+
+    Every molecule has a home page: the page it was loaded from, or the
+    page of its centroid for new molecules. A molecule that results from
+    merging takes over the home of one of the molecules it was merged from.
+    """
+
+    def __init__(self, store:PagedStore, max_loaded_atoms:int=200_000, prefetch:float=0.5,) -> None:
+        super().__init__()
+        self.store = store
+        self.max_loaded_atoms = max_loaded_atoms
+        # Margin around the viewport, as a fraction of its size:
+        self.prefetch = prefetch
+        self._loaded:OrderedDict[tuple,int] = OrderedDict()
+        self._home:dict[int,tuple] = {}
+        self._flushed_revision = self.geometry_revision
+        # New atoms must not reuse the uids of atoms on disk:
+        Atom._next_uid = max(Atom._next_uid,store.next_uid)
+
+    def set_viewport(self, lo:np.ndarray, hi:np.ndarray) -> None:
+        margin = (hi - lo) * self.prefetch
+        wanted = self.store.pages_in(lo - margin,hi + margin)
+        for key in wanted:
+            if key in self._loaded:
+                self._loaded.move_to_end(key)
+            else:
+                self._load_page(key)
+        self._evict(keep=set(wanted))
+
+    def loaded_pages(self) -> list[tuple]:
+        return list(self._loaded)
+
+    def _load_page(self, key:tuple) -> None:
+        arrays = self.store.read_page(key)
+        atoms = {uid: [symbol,x,y] for uid,symbol,(x,y) in zip(
+            arrays["atom_uid"].tolist(),arrays["atom_symbol"].tolist(),arrays["atom_xy"].tolist())}
+        bonds = {(a,b): order for (a,b),order in zip(arrays["bond_uids"].tolist(),arrays["bond_order"].tolist())}
+        mols = build_mols(atoms,bonds)
+        for mol in mols:
+            self._home[id(mol)] = key
+        self._loaded[key] = len(atoms)
+        self.mols += mols
+        CanvasModel._register_mols(self,mols)
+        self._index_atoms([atm for mol in mols for atm in mol.atoms])
+        self.mark_dirty(arrays["atom_xy"])
+        self._emit(MolsAdded(mols=mols))
+
+    def _register_mols(self, mols:list[Mol]) -> None:
+        for mol in mols:
+            home = None
+            for atm in mol.atoms:
+                old = self.mol_of_atom(atm)
+                if old is not None and id(old) in self._home:
+                    home = self._home[id(old)]
+                    break
+            if home is None:
+                pos = np.array([atm.pos for atm in mol.atoms],dtype=float)
+                home = self.store.page_of(pos.mean(axis=0))
+                if home not in self._loaded:
+                    # The page might hold molecules already, which
+                    # we must not lose when it gets written back:
+                    self._load_page(home)
+            self._home[id(mol)] = home
+        super()._register_mols(mols)
+
+    def _page_mols(self, key:tuple) -> list[Mol]:
+        return [mol for mol in self.mols if self._home.get(id(mol)) == key]
+
+    @staticmethod
+    def _page_arrays(mols:list[Mol]) -> dict[str,np.ndarray]:
+        atoms = [atm for mol in mols for atm in mol.atoms]
+        bonds = [bnd for mol in mols for bnd in mol.bonds]
+        return {
+            "atom_uid": np.array([atm.uid for atm in atoms],dtype=np.int64),
+            "atom_symbol": np.array([atm.symbol for atm in atoms],dtype="<U3"),
+            "atom_xy": np.array([atm.pos for atm in atoms],dtype=float).reshape((-1,2)),
+            "bond_uids": np.array([(bnd.fst.uid,bnd.snd.uid) for bnd in bonds],dtype=np.int64).reshape((-1,2)),
+            "bond_order": np.array([bnd.order for bnd in bonds],dtype=float),
+        }
+
+    @staticmethod
+    def _canonical(arrays:dict[str,np.ndarray]) -> dict[str,np.ndarray]:
+        # Materialising a page does not keep the order of its atoms
+        # and bonds, so we sort both before comparing pages:
+        atom_sort = np.argsort(arrays["atom_uid"],kind="stable")
+        pairs = np.sort(arrays["bond_uids"],axis=1)
+        bond_sort = np.lexsort((pairs[:,1],pairs[:,0]))
+        return {
+            "atom_uid": arrays["atom_uid"][atom_sort],
+            "atom_symbol": arrays["atom_symbol"][atom_sort],
+            "atom_xy": arrays["atom_xy"][atom_sort],
+            "bond_uids": pairs[bond_sort],
+            "bond_order": arrays["bond_order"][bond_sort],
+        }
+
+    def _same_content(self, a:dict[str,np.ndarray], b:dict[str,np.ndarray]) -> bool:
+        a,b = self._canonical(a),self._canonical(b)
+        return all(a[name].shape == b[name].shape and np.array_equal(a[name],b[name]) for name in PagedStore.ARRAYS)
+
+    def _write_back(self, key:tuple, mols:list[Mol]) -> None:
+        arrays = self._page_arrays(mols)
+        if not self._same_content(arrays,self.store.read_page(key)):
+            self.store.write_page(key,arrays)
+
+    def _evict(self, keep:set) -> None:
+        n_loaded = sum(self._loaded.values())
+        for key in list(self._loaded):
+            if n_loaded <= self.max_loaded_atoms:
+                break
+            if key in keep:
+                continue
+            n_loaded -= self._loaded[key]
+            self._unload_page(key)
+
+    def _unload_page(self, key:tuple) -> None:
+        mols = self._page_mols(key)
+        self._write_back(key,mols)
+        del self._loaded[key]
+
+        evicted = set()
+        atoms = []
+        for mol in mols:
+            evicted.add(id(mol))
+            self._home.pop(id(mol),None)
+            for atm in mol.atoms:
+                self._mol_of_atom.pop(id(atm),None)
+                evicted.add(id(atm))
+                atoms.append(atm)
+            for bnd in mol.bonds:
+                evicted.add(id(bnd))
+        for index in self.atom_indexes.values():
+            index.remove(atoms)
+        self.mols = [mol for mol in self.mols if id(mol) not in evicted]
+        deselected = [itm for itm in self.selection if id(itm) in evicted]
+        if deselected:
+            self.selection = [itm for itm in self.selection if id(itm) not in evicted]
+        self.highlighted = [atm for atm in self.highlighted if id(atm) not in evicted]
+        unhovered = self.hovered if self.hovered is not None and id(self.hovered) in evicted else None
+        if unhovered is not None:
+            self.hovered = None
+        self.mark_dirty([atm.pos for atm in atoms])
+        self._emit(MolsRemoved(mols=mols))
+        if deselected:
+            self._emit(SelectionChanged(added=[],removed=deselected))
+        if unhovered is not None:
+            self._emit(HoverChanged(old=unhovered,new=None))
+
+    def flush(self) -> None:
+        """
+        Writes all changed pages that are currently loaded to the store.
+        Returns right away if no atom or bond changed since the last call.
+        """
+        if self._flushed_revision == self.geometry_revision:
+            return
+        self._flushed_revision = self.geometry_revision
+        for key in self._loaded:
+            self._write_back(key,self._page_mols(key))
@@ -0,0 +1,111 @@
+
+from collections import OrderedDict
+from typing import TYPE_CHECKING, Optional
+
+from PyQt5 import QtGui
+import numpy as np
+
+if TYPE_CHECKING:
+    from canvas.model import CanvasModel
+
+
+class TileCache:
+    """
+    A LRU cache of rasterised tiles of the static document.
+
+    Tiles are square images of TILE_SIZE device pixels. They are
+    keyed by (zoom factor, tx, ty), where tile (tx,ty) covers the
+    world coordinates whose zoomed position (world * zoom factor)
+    lies in [tx*TILE_SIZE,(tx+1)*TILE_SIZE) x [ty*TILE_SIZE,(ty+1)*TILE_SIZE).
+    Hence, tiles do not depend on the panning and stay valid across
+    zoom steps until the document changes underneath them.
+
+    Invalidated tiles are only marked as stale: they can still be
+    shown until their replacement has been rasterised.
+    """
+
+    TILE_SIZE = 256
+
+    def __init__(self, memory_budget:int=64*1024*1024, margin:float=30,) -> None:
+        self.memory_budget = memory_budget
+        # Labels and line widths reach a bit beyond the coordinates
+        # of the atoms. Dirty regions are padded (in world units)
+        # by this margin:
+        self.margin = margin
+        self.revision:Optional[int] = None
+        self._tiles:OrderedDict[tuple,QtGui.QImage] = OrderedDict()
+        self._stale:set[tuple] = set()
+        self._bytes = 0
+
+    def __len__(self) -> int:
+        return len(self._tiles)
+
+    def memory_usage(self) -> int:
+        return self._bytes
+
+    def clear(self) -> None:
+        self._tiles.clear()
+        self._stale.clear()
+        self._bytes = 0
+
+    def is_stale(self, key:tuple) -> bool:
+        return key in self._stale
+
+    def get(self, key:tuple) -> Optional[QtGui.QImage]:
+        img = self._tiles.get(key)
+        if img is not None:
+            self._tiles.move_to_end(key)
+        return img
+
+    def put(self, key:tuple, img:QtGui.QImage) -> None:
+        self._drop(key)
+        self._tiles[key] = img
+        self._bytes += img.sizeInBytes()
+        while self._bytes > self.memory_budget and len(self._tiles) > 1:
+            self._drop(next(iter(self._tiles)))
+
+    def _drop(self, key:tuple) -> None:
+        img = self._tiles.pop(key,None)
+        self._stale.discard(key)
+        if img is not None:
+            self._bytes -= img.sizeInBytes()
+
+    def tile_world_rect(self, key:tuple) -> np.ndarray:
+        zoomf,tx,ty = key
+        ts = self.TILE_SIZE
+        return np.array([[tx*ts,ty*ts],[(tx+1)*ts,(ty+1)*ts]],dtype=float) / zoomf
+
+    def invalidate(self, bbox:np.ndarray) -> None:
+        lo,hi = bbox[0] - self.margin, bbox[1] + self.margin
+        for key in list(self._tiles):
+            t_lo,t_hi = self.tile_world_rect(key)
+            if (t_lo <= hi).all() and (lo <= t_hi).all():
+                self._stale.add(key)
+
+    def sync(self, model:"CanvasModel") -> None:
+        """
+        Marks all tiles that were invalidated by changes of the
+        document since the last call as stale.
+        """
+        if self.revision == model.revision:
+            return
+        regions = model.dirty_regions_since(self.revision) if self.revision is not None else None
+        if regions is None or any(bbox is None for bbox in regions):
+            self._stale.update(self._tiles)
+        else:
+            for bbox in regions:
+                self.invalidate(bbox)
+        self.revision = model.revision
+
+    def visible_tiles(self, zoomf:float, origin_x:float, origin_y:float, width:int, height:int,) -> list[tuple]:
+        """
+        Returns the keys of all tiles that intersect the device
+        rectangle (0,0,width,height), where origin is the device
+        position of the world origin.
+        """
+        ts = self.TILE_SIZE
+        tx0 = int(np.floor(-origin_x / ts))
+        ty0 = int(np.floor(-origin_y / ts))
+        tx1 = int(np.floor((width - origin_x) / ts))
+        ty1 = int(np.floor((height - origin_y) / ts))
+        return [(zoomf,tx,ty) for ty in range(ty0,ty1+1) for tx in range(tx0,tx1+1)]
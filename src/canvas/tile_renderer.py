@@ -0,0 +1,178 @@
+
+from typing import TYPE_CHECKING
+
+from PyQt5 import QtCore, QtGui
+from PyQt5.QtCore import Qt
+import numpy as np
+
+from canvas.bond_geometry import mol_bond_geometry
+from canvas.label_cache import LabelCache
+
+if TYPE_CHECKING:
+    from canvas.model import CanvasModel
+
+
+# Colors of the atom labels in a snapshot, by index:
+LABEL_COLORS = ["black","blue","red"]
+LABEL_PLAIN, LABEL_SELECTED, LABEL_ERROR = 0, 1, 2
+
+
+class SceneSnapshot:
+    """
+    An immutable copy of everything needed to rasterise the static
+    document: the lines of all bonds and the labels of all explicit
+    atoms, in world coordinates. Worker threads only ever see such
+    a snapshot and never touch the (mutable) model itself.
+    """
+
+    def __init__(self, revision:int, segments:np.ndarray, segment_selected:np.ndarray,
+            label_pos:np.ndarray, label_text:list[str], label_color:np.ndarray,) -> None:
+        self.revision = revision
+        self.segments = segments
+        self.segment_selected = segment_selected
+        self.label_pos = label_pos
+        self.label_text = label_text
+        self.label_color = label_color
+        for arr in [segments,segment_selected,label_pos,label_color]:
+            arr.setflags(write=False)
+
+    @staticmethod
+    def from_model(model:"CanvasModel", selected:set[int], chem_style,) -> "SceneSnapshot":
+        segments, segment_selected = [], []
+        label_pos, label_text, label_color = [], [], []
+        for mol in model.mols:
+            geom = mol_bond_geometry(mol,chem_style)
+            bond_selected = np.fromiter((id(bnd) in selected for bnd in mol.bonds),dtype=bool,count=len(mol.bonds))
+            segments.append(geom.segments)
+            segment_selected.append(bond_selected[geom.segment_bond])
+            for atm in mol.atoms:
+                if mol.is_explicit_atom(atm):
+                    label_pos.append((atm.x(),atm.y()))
+                    label_text.append(mol.atom_label(atm))
+                    if id(atm) in selected:
+                        label_color.append(LABEL_SELECTED)
+                    elif mol.valence_info(atm).error:
+                        label_color.append(LABEL_ERROR)
+                    else:
+                        label_color.append(LABEL_PLAIN)
+
+        # The snapshot gets its own copy of the render geometry:
+        return SceneSnapshot(
+            revision=model.revision,
+            segments=np.concatenate(segments) if segments else np.zeros((0,4)),
+            segment_selected=np.concatenate(segment_selected) if segments else np.zeros(0,dtype=bool),
+            label_pos=np.array(label_pos,dtype=float).reshape((-1,2)),
+            label_text=label_text,
+            label_color=np.array(label_color,dtype=int),
+        )
+
+    def paint(self, painter:QtGui.QPainter, zoomf:float, dx:float, dy:float,
+            lo:np.ndarray, hi:np.ndarray, label_cache:LabelCache,) -> None:
+        """
+        Paints all items within the world rectangle lo,hi. World
+        coordinates are mapped to device coordinates as world*zoomf + (dx,dy).
+        """
+        pen = QtGui.QPen()
+        pen.setWidth(2)
+        colors = {False: QtGui.QColor("black"), True: QtGui.QColor("blue"),}
+        label_colors = [QtGui.QColor(c) for c in LABEL_COLORS]
+
+        segs = self.segments
+        seg_lo = np.minimum(segs[:,:2],segs[:,2:])
+        seg_hi = np.maximum(segs[:,:2],segs[:,2:])
+        visible = (seg_lo <= hi).all(axis=1) & (seg_hi >= lo).all(axis=1)
+        for is_selected,color in colors.items():
+            dev = segs[visible & (self.segment_selected == is_selected)] * zoomf + [dx,dy,dx,dy]
+            if len(dev):
+                pen.setColor(color)
+                painter.setPen(pen)
+                painter.drawLines([QtCore.QLineF(*seg) for seg in dev.tolist()])
+
+        visible = np.flatnonzero((self.label_pos >= lo).all(axis=1) & (self.label_pos <= hi).all(axis=1))
+        back_brush = QtGui.QBrush(QtGui.QColor("white"),Qt.BrushStyle.SolidPattern)
+        font = painter.font()
+        for i in visible:
+            ax,ay = self.label_pos[i] * zoomf + [dx,dy]
+            pen.setColor(label_colors[self.label_color[i]])
+            painter.setPen(pen)
+            label_cache.label(self.label_text[i],font,zoomf).draw(painter,ax,ay,back_brush)
+
+
+class TileSignals(QtCore.QObject):
+    # (key, revision, image). The image is None if the
+    # tile was not wanted anymore when the job started.
+    done = QtCore.pyqtSignal(object,int,object)
+
+
+class TileJob(QtCore.QRunnable):
+
+    def __init__(self, renderer:"TileRenderer", key:tuple, snapshot:SceneSnapshot, font:QtGui.QFont,) -> None:
+        super().__init__()
+        self.renderer = renderer
+        self.key = key
+        self.snapshot = snapshot
+        self.font = font
+
+    def run(self) -> None:
+        if self.key not in self.renderer.wanted:
+            # The user zoomed or panned away in the meantime.
+            self.renderer.signals.done.emit(self.key,self.snapshot.revision,None)
+            return
+
+        zoomf,tx,ty = self.key
+        ts = self.renderer.tile_size
+        img = QtGui.QImage(ts,ts,QtGui.QImage.Format.Format_RGB32)
+        img.fill(QtGui.QColor("white"))
+
+        # Tile (tx,ty) shows world coordinates whose zoomed
+        # position lies in [tx*ts,(tx+1)*ts) x [ty*ts,(ty+1)*ts):
+        margin = self.renderer.margin
+        lo = np.array([tx*ts,ty*ts]) / zoomf - margin
+        hi = np.array([(tx+1)*ts,(ty+1)*ts]) / zoomf + margin
+
+        painter = QtGui.QPainter(img)
+        painter.setRenderHint(QtGui.QPainter.RenderHint.Antialiasing)
+        painter.setFont(self.font)
+        try:
+            # Label caches are not shared between threads:
+            self.snapshot.paint(painter,zoomf,-tx*ts,-ty*ts,lo,hi,LabelCache())
+        finally:
+            painter.end()
+        self.renderer.signals.done.emit(self.key,self.snapshot.revision,img)
+
+
+class TileRenderer:
+    """
+    Rasterises tiles of a SceneSnapshot on a thread pool. Finished
+    tiles are handed to on_tile_ready on the GUI thread.
+    """
+
+    def __init__(self, on_tile_ready, tile_size:int, margin:float,) -> None:
+        self.on_tile_ready = on_tile_ready
+        self.tile_size = tile_size
+        self.margin = margin
+        self.pool = QtCore.QThreadPool()
+        self.pool.setMaxThreadCount(max(1,QtCore.QThread.idealThreadCount()))
+        self.signals = TileSignals()
+        self.signals.done.connect(self._on_done)
+        self.pending:set[tuple] = set()
+        self.wanted:frozenset = frozenset()
+
+    def set_wanted(self, keys) -> None:
+        # Replaced as a whole, so workers can read it without locking:
+        self.wanted = frozenset(keys)
+
+    def request(self, key:tuple, snapshot:SceneSnapshot, font:QtGui.QFont,) -> None:
+        if (key,snapshot.revision) in self.pending:
+            return
+        self.pending.add((key,snapshot.revision))
+        self.pool.start(TileJob(self,key,snapshot,QtGui.QFont(font)))
+
+    def _on_done(self, key:tuple, revision:int, img) -> None:
+        self.pending.discard((key,revision))
+        if img is not None:
+            self.on_tile_ready(key,revision,img)
+
+    def wait_for_done(self) -> None:
+        self.pool.waitForDone()
+        QtCore.QCoreApplication.processEvents()
@@ -4,12 +4,17 @@ import math
 from pathlib import Path
 import random
 import sys
-from typing import TYPE_CHECKING 
+from typing import TYPE_CHECKING, Optional
 
 from PyQt5 import QtCore, QtGui, QtWidgets
 from PyQt5.QtCore import Qt
 import numpy as np
 
+from canvas.bond_geometry import bond_line_segments, mol_bond_geometry
+from canvas.clashes import Clashes
+from canvas.label_cache import LabelCache
+from canvas.tile_cache import TileCache
+from canvas.tile_renderer import SceneSnapshot, TileRenderer
 from transf import Transf
 
 if TYPE_CHECKING:
@@ -26,13 +31,27 @@ class ChemStyle:
     # TODO: different subclasses of ChemStyle, e.g. ACSChemStyle
     double_bond_spread = 3
     triple_bond_spread = 4
+    # Fraction of the bond cut off at both ends of the inner line
+    # of double bonds within rings:
+    inner_bond_shortening = 0.15
 
 class CanvasView:
 
-    def __init__(self) -> None:
+    def __init__(self, tile_memory_budget:int=64*1024*1024,) -> None:
         self.chem_style = ChemStyle()
         self.pen_color = QtGui.QColor("#000000")
         self.transf = Transf()
+        self.label_cache = LabelCache()
+        self.tile_cache = TileCache(memory_budget=tile_memory_budget)
+        self.tile_renderer = TileRenderer(self._on_tile_ready,self.tile_cache.TILE_SIZE,self.tile_cache.margin)
+        self._snapshot:Optional[SceneSnapshot] = None
+        # Labels at zoom level 1, i.e. in world units:
+        self._world_labels = LabelCache()
+        self.show_clashes = False
+        self._clashes = None
+        self._widget = None
+        # The atoms of the running transform, grouped by molecule:
+        self._moving:Optional[tuple] = None
 
     def set_pen_color(self, c):
         self.pen_color = QtGui.QColor(c)
@@ -45,42 +64,180 @@ class CanvasView:
         bx,by = self.transf.forward(bx,by)
         painter.drawLine(QtCore.QLineF(ax,ay,bx,by))
 
-    def _draw_bond(self, bond:Bond, painter):
-        eta = 0.0001
-        atm1, atm2 = bond.fst, bond.snd
-        v_1 = np.array([atm1.x(), atm1.y()])
-        v_2 = np.array([atm2.x(), atm2.y()])
-        v_12 = v_2 - v_1
-        v_orth = rot_2d(v_12,math.radians(90))
-        norm_vo = np.linalg.norm(v_orth)
-        if norm_vo < eta:
-            norm_vo = eta
+    def _draw_bond(self, bond:Bond, painter, mol:Optional[Mol]=None,):
+        # Bonds of a molecule come from its render geometry, others
+        # (the bond being drawn) are computed on the fly:
+        segs = None if mol is None else mol_bond_geometry(mol,self.chem_style).bond_segments(bond)
+        if segs is None:
+            atm1, atm2 = bond.fst, bond.snd
+            v_1 = np.array([[atm1.x(), atm1.y()]])
+            v_2 = np.array([[atm2.x(), atm2.y()]])
+            segs,_ = bond_line_segments(v_1,v_2,np.array([bond.order]),self.chem_style)
+        for seg in segs:
+            self._draw_line(painter,seg[:2],seg[2:])
 
-        v_orth = v_orth / norm_vo
+    def _moving_atoms(self, model) -> dict[int,list[Atom]]:
+        transform = model.transform
+        if transform is None:
+            self._moving = None
+            return {}
+        if self._moving is None or self._moving[0] is not transform:
+            self._moving = (transform,{id(mol): atoms for mol,atoms in model.atoms_by_mol(transform.atoms)})
+        return self._moving[1]
 
-        if bond.order == 1:
-            self._draw_line(painter,v_1,v_2)
+    def _paint_mols(self, painter, model, selected:set[int],) -> None:
+        pen = QtGui.QPen()
+        pen.setWidth(2)
+        black,blue,red = QtGui.QColor("black"),QtGui.QColor("blue"),QtGui.QColor("red")
+        zoomf = self.transf.zoom_factor()
+        ox,oy = self.transf.forward(0,0)
+        f = painter.font()
+        back_brush = QtGui.QBrush(QtGui.QColor("white"),Qt.BrushStyle.SolidPattern)
+        moving = self._moving_atoms(model)
+        for mol in model.mols:
+            # Only the bonds of atoms that move are computed again,
+            # everything else is read from the render geometry:
+            geom = mol_bond_geometry(mol,self.chem_style,moving.get(id(mol)))
+            if len(geom.segments):
+                bond_selected = np.fromiter((id(bnd) in selected for bnd in mol.bonds),dtype=bool,count=len(mol.bonds))
+                seg_selected = bond_selected[geom.segment_bond]
+                dev = geom.segments * zoomf + [ox,oy,ox,oy]
+                for is_selected,color in [(False,black),(True,blue)]:
+                    lines = dev[seg_selected == is_selected]
+                    if len(lines):
+                        pen.setColor(color)
+                        painter.setPen(pen)
+                        painter.drawLines([QtCore.QLineF(*seg) for seg in lines.tolist()])
 
-        if bond.order == 2:
-            dbs = self.chem_style.double_bond_spread
-            self._draw_line(painter,v_1+dbs*v_orth,v_2+dbs*v_orth)
-            self._draw_line(painter,v_1-dbs*v_orth,v_2-dbs*v_orth)
+            for atm in mol.atoms:
+                if mol.is_explicit_atom(atm):
+                    # We want to draw the atom symbol centered at the
+                    # position of atom (ax,ay) on top of a white
+                    # background box. Both are laid out only once per
+                    # symbol and zoom level by the label cache:
+                    ax,ay = self.transf.forward(atm.x(),atm.y())
+                    lbl = self.label_cache.label(mol.atom_label(atm),f,zoomf)
+                    if id(atm) in selected:
+                        pen.setColor(blue)
+                    elif mol.valence_info(atm).error:
+                        pen.setColor(red)
+                    else:
+                        pen.setColor(black)
+                    painter.setPen(pen)
+                    lbl.draw(painter,ax,ay,back_brush)
 
-        if bond.order == 3:
-            tbs = self.chem_style.triple_bond_spread
-            self._draw_line(painter,v_1+tbs*v_orth,v_2+tbs*v_orth)
-            self._draw_line(painter,v_1-tbs*v_orth,v_2-tbs*v_orth)
-            self._draw_line(painter,v_1,v_2)
+    def _paint_tiles(self, painter, model, selected:set[int],) -> None:
+        cache = self.tile_cache
+        cache.sync(model)
+        if self._snapshot is None or self._snapshot.revision != model.revision:
+            self._snapshot = SceneSnapshot.from_model(model,selected,self.chem_style)
 
-    
+        zoomf = self.transf.zoom_factor()
+        origin_x,origin_y = self.transf.forward(0,0)
+        origin_x,origin_y = round(origin_x),round(origin_y)
+        width,height = painter.device().width(),painter.device().height()
+        ts = cache.TILE_SIZE
+        keys = cache.visible_tiles(zoomf,origin_x,origin_y,width,height)
+        self.tile_renderer.set_wanted(keys)
+        for key in keys:
+            # Missing and stale tiles are rasterised in the background.
+            # Until they arrive, we keep showing the stale tile (if any):
+            img = cache.get(key)
+            if img is None or cache.is_stale(key):
+                self.tile_renderer.request(key,self._snapshot,painter.font())
+            if img is not None:
+                _,tx,ty = key
+                painter.drawImage(QtCore.QPoint(origin_x + tx*ts,origin_y + ty*ts),img)
 
+    def _on_tile_ready(self, key:tuple, revision:int, img:QtGui.QImage) -> None:
+        if self._snapshot is None or revision != self._snapshot.revision:
+            return
+        self.tile_cache.put(key,img)
+        if self._widget is not None:
+            self._widget.update()
 
+    def clashes(self, model, font) -> Clashes:
+        # Clash detection is fast enough to rerun whenever atoms or
+        # bonds change (not the selection), but not on every repaint:
+        if self._clashes is None or self._clashes[0] != model.geometry_revision:
+            def label_rect(text):
+                r = self._world_labels.label(text,font,1.0).back_rect
+                return r.left(),r.top(),r.right(),r.bottom()
+            self._clashes = (model.geometry_revision,model.find_clashes(label_rect))
+        return self._clashes[1]
+
+    def _paint_clashes(self, painter, model, font) -> None:
+        clashes = self.clashes(model,font)
+        if not len(clashes):
+            return
+        pen = QtGui.QPen()
+        pen.setWidth(2)
+        pen.setColor(QtGui.QColor("orange"))
+        painter.setPen(pen)
+        painter.setBrush(QtGui.QBrush())
+        zoomf = self.transf.zoom_factor()
+        r = 5 * zoomf
+        for x,y in clashes.crossing_points.tolist():
+            painter.drawEllipse(QtCore.QPointF(*self.transf.forward(x,y)),r,r)
+        for atm,_ in clashes.label_overlaps:
+            ax,ay = self.transf.forward(atm.x(),atm.y())
+            rect = self._world_labels.label(model.mol_of_atom(atm).atom_label(atm),font,1.0).back_rect
+            painter.drawRect(QtCore.QRectF(ax + rect.left()*zoomf,ay + rect.top()*zoomf,rect.width()*zoomf,rect.height()*zoomf))
+
+    def _paint_highlighted(self, painter, model) -> None:
+        if not model.highlighted:
+            return
+        pen = QtGui.QPen()
+        pen.setWidth(2)
+        pen.setColor(QtGui.QColor("green"))
+        painter.setPen(pen)
+        painter.setBrush(QtGui.QBrush())
+        r = 8 * self.transf.zoom_factor()
+        for atm in model.highlighted:
+            ax,ay = self.transf.forward(atm.x(),atm.y())
+            painter.drawEllipse(QtCore.QPointF(ax,ay),r,r)
+
+    def _paint_hovered(self, painter, model) -> None:
+        # Hovering changes with every mouse move, so it is drawn
+        # on top of the document instead of being part of it.
+        # Selected items stay blue, though:
+        item = model.hovered
+        if item is None or any(item is itm for itm in model.selection):
+            return
+        hov_col = QtGui.QColor(255,0,0)
+        pen = QtGui.QPen()
+        pen.setWidth(2)
+        pen.setColor(hov_col)
+        painter.setPen(pen)
+        if isinstance(item,Bond):
+            self._draw_bond(item,painter,model.mol_of_atom(item.fst))
+            return
+
+        mol = model.mol_of_atom(item)
+        if mol is None:
+            return
+        ax,ay = self.transf.forward(item.x(),item.y())
+        if mol.is_explicit_atom(item):
+            zoomf = self.transf.zoom_factor()
+            lbl = self.label_cache.label(mol.atom_label(item),painter.font(),zoomf)
+            lbl.draw(painter,ax,ay,QtGui.QBrush(QtGui.QColor("white"),Qt.BrushStyle.SolidPattern))
+        else:
+            # The user hovered over an implicit atom.
+            # We will display a little circle to notify
+            # the user that we registered the hovering
+            # over this atom:
+            r = QtCore.QRectF(ax-3,ay-3,6,6)
+            painter.setBrush(QtGui.QBrush(hov_col,Qt.BrushStyle.SolidPattern))
+            painter.drawEllipse(r,)
+            painter.setBrush(QtGui.QBrush())
 
     def paintEvent(self,
             ev: QtGui.QPaintEvent,
             controller: "CanvasController",
             ) -> None:
         self.transf = controller.transf
+        self._widget = controller
+        model = controller.model
         painter = QtGui.QPainter(controller)
         painter.setRenderHint(QtGui.QPainter.RenderHint.Antialiasing)
 
@@ -95,94 +252,51 @@ class CanvasView:
         rect = QtCore.QRect(0,0,painter.device().width(), painter.device().height())
         painter.fillRect(rect, brush)
 
-        zoomf = self.transf.zoom_factor()
-        f = painter.font()
-        f.setPointSizeF(f.pointSizeF() * zoomf)
-        painter.setFont(f)
-        fm = QtGui.QFontMetrics(f)
-        for mol in controller.model.mols:
-            for bond in mol.bonds:
-                if bond in controller.model.selection:
-                    pen.setColor(QtGui.QColor("blue"))
-                elif bond.is_hovered():
-                    pen.setColor(QtGui.QColor("red"))
-                else:
-                    pen.setColor(QtGui.QColor("black"))
-                painter.setPen(pen)
-                self._draw_bond(bond,painter)
+        base_font = painter.font()
+        painter.setFont(self.label_cache.scaled_font(base_font,self.transf.zoom_factor()))
+        selected = {id(itm) for itm in model.selection}
+        if model.translating:
+            # While the selection is dragged around, the document changes
+            # with every mouse move. Caching tiles would not pay off, so
+            # we draw the document directly:
+            self._paint_mols(painter,model,selected)
+        else:
+            self._paint_tiles(painter,model,selected)
+        if self.show_clashes and not model.translating:
+            self._paint_clashes(painter,model,base_font)
+        self._paint_highlighted(painter,model)
+        self._paint_hovered(painter,model)
 
-            for atm in mol.atoms:
-                ax,ay = self.transf.forward(atm.x(),atm.y())
-                if mol.is_explicit_atom(atm):
-                    # We want to draw the atom symbol:
-                    # at position of atom (ax,ay):
-                    text = atm.symbol
-                    # Furthermore, we need to vertically and horizontally
-                    # center the atom symbol. To achieve this, we get
-                    # the bounding rect of the text using font metrics:
-                    text_rect = QtCore.QRectF(fm.tightBoundingRect(text))
-                    text_width = text_rect.width()
-                    text_height = text_rect.height()
-                    text_rect.translate(ax-text_width/2,ay+text_height/2)
-
-                    # If bonds are drawn from an explicit atom, then
-                    # the bonds would draw over the atom label leading to
-                    # lines clashing with each other. To avoid this effect,
-                    # we paint a white rectangle behind the symbol that will
-                    # remove any possible bonds.
-                    # This also includes some small amount of padding to
-                    # visually separate the atom symbols from the bond lines:
-                    atom_pad = 0.5
-                    text_back_rect = QtCore.QRectF(text_rect)
-                    text_back_rect.setWidth(text_back_rect.width() * (1 + 2*atom_pad))
-                    text_back_rect.setHeight(text_back_rect.height() * (1 + 2*atom_pad))
-                    text_back_rect.translate(-text_back_rect.width() * atom_pad/2, -text_back_rect.height() * atom_pad/2)
-                    brush.setColor(QtGui.QColor("white"))
-                    painter.fillRect(text_back_rect,brush)
-
-                    if atm in controller.model.selection:
-                        pen.setColor(QtGui.QColor("blue"))
-                    elif atm.is_hovered():
-                        pen.setColor(QtGui.QColor("red"))
-                    else:
-                        pen.setColor(QtGui.QColor("black"))
-                    painter.setPen(pen)
-                    painter.drawText(
-                        text_rect,
-                        Qt.AlignmentFlag.AlignHCenter | Qt.AlignmentFlag.AlignVCenter,
-                        atm.symbol)
-
-                else: # implicit atom
-                    if atm.is_hovered():
-                        # The user hovered over an implicit atom.
-                        # We will display a little circle to notify
-                        # the user that we registered the hovering
-                        # over this atom:
-                        r = QtCore.QRectF(ax-3,ay-3,6,6)
-                        hov_col = QtGui.QColor(255,0,0)
-                        brush.setColor(hov_col)
-                        painter.setBrush(brush)
-                        pen.setColor(hov_col)
-                        painter.setPen(pen)
-                        painter.drawEllipse(r,)
-            
         pen.setWidth(2)
         pen.setColor(QtGui.QColor("red"))
-        active_bond = controller.model.active_bond
+        active_bond = model.active_bond
         if active_bond:
             painter.setPen(pen)
             self._draw_bond(active_bond,painter)
 
-        if controller.model.selection_rectangle:
+        if model.selection_rectangle:
             pen = QtGui.QPen()
             pen.setWidth(2)
             pen.setColor(QtGui.QColor("black"))
             pen.setStyle(Qt.PenStyle.DotLine)
             painter.setPen(pen)
-            x1,y1,x2,y2 = controller.model.selection_rectangle.points.reshape(-1)
+            x1,y1,x2,y2 = model.selection_rectangle.points.reshape(-1)
             x1,y1 = controller.transf.forward(x1,y1)
             x2,y2 = controller.transf.forward(x2,y2)
             qr:QtCore.QRectF = QtCore.QRectF(float(x1),float(y1),float(x2-x1),float(y2-y1))
             painter.drawRect(qr)#x1,y1,x2-x1,y2-y1)
 
-        painter.end()
\ No newline at end of file
+        lasso = model.selection_lasso
+        if lasso is not None and len(lasso) > 1:
+            pen = QtGui.QPen()
+            pen.setWidth(2)
+            pen.setColor(QtGui.QColor("black"))
+            pen.setStyle(Qt.PenStyle.DotLine)
+            painter.setPen(pen)
+            painter.setBrush(QtGui.QBrush())
+            zoomf = self.transf.zoom_factor()
+            ox,oy = self.transf.forward(0,0)
+            dev = lasso * zoomf + [ox,oy]
+            painter.drawPolygon(QtGui.QPolygonF([QtCore.QPointF(x,y) for x,y in dev.tolist()]))
+
+        painter.end()
@@ -1,17 +1,14 @@
 from PyQt5 import QtWidgets 
-from typing import TYPE_CHECKING
 
-
-if TYPE_CHECKING:
-    from core import Atom
+from core import Atom, DocItem
 
 
 class AtomConfigurationDialog(QtWidgets.QDialog):
 
-    def __init__(self, atm:"Atom",) -> None:
+    def __init__(self, atm:Atom,) -> None:
         super().__init__()
         self.atm = atm
-        self.setWindowTitle("HELLO!")
+        self.setWindowTitle("Atom")
 
         QBtn = QtWidgets.QDialogButtonBox.Ok | QtWidgets.QDialogButtonBox.Cancel
 
@@ -19,11 +16,37 @@ class AtomConfigurationDialog(QtWidgets.QDialog):
         self.buttonBox.accepted.connect(self.accept)
         self.buttonBox.rejected.connect(self.reject)
 
+        self.symbol_edit = QtWidgets.QLineEdit(atm.symbol)
+
         self.layout = QtWidgets.QVBoxLayout()
-        message = QtWidgets.QLabel("Something happened, is that OK?")
-        self.layout.addWidget(message)
+        form = QtWidgets.QFormLayout()
+        form.addRow("Symbol", self.symbol_edit)
+        self.layout.addLayout(form)
         self.layout.addWidget(self.buttonBox)
         self.setLayout(self.layout)
 
-    def show_dialog(self,):
-        self.exec()
\ No newline at end of file
+    def show_dialog(self,) -> dict:
+        # The dialog does not touch the atom itself. Instead, it
+        # returns the attributes that the user changed, so that
+        # the model can keep its indexes up to date:
+        if self.exec() != QtWidgets.QDialog.Accepted:
+            return {}
+        changes = {}
+        symbol = self.symbol_edit.text().strip()
+        if symbol and symbol != self.atm.symbol:
+            changes["symbol"] = symbol
+        return changes
+
+
+def show_configuration_dialog(item:DocItem) -> dict:
+    """
+    Shows a configuration dialog for a doc item. For example, an atom
+    might expose the current atom symbol, charge, num implicit/explicit
+    hydrogens et cetera. Returns a dict of the attributes that the
+    user changed. The dialogs live here, in the UI layer, so that the
+    model layer can be used without Qt.
+    """
+    if isinstance(item,Atom):
+        return AtomConfigurationDialog(item).show_dialog()
+    # There is nothing to configure for bonds yet:
+    return {}
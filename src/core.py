@@ -1,17 +1,19 @@
 from abc import abstractclassmethod
+from dataclasses import dataclass
+import hashlib
 import math
 from pathlib import Path 
+from typing import Optional
 import numpy as np
 
-from PyQt5.QtCore import pyqtRemoveInputHook
-
-from config_dlg import AtomConfigurationDialog
+from pse import valence_table
+from rings import smallest_rings
 
 def debug_trace():
   '''Set a tracepoint in the Python debugger that works with Qt'''
 
-  # Or for Qt5
-  #from PyQt5.QtCore import pyqtRemoveInputHook
+  # Imported here, so that the model layer does not depend on Qt:
+  from PyQt5.QtCore import pyqtRemoveInputHook
 
   from pdb import set_trace
   pyqtRemoveInputHook()
@@ -90,15 +92,6 @@ class DocItem:
         """
         raise NotImplementedError()
 
-    def show_configuration_dialog(self):
-        """
-        Shows a configuration dialog for this doc item.
-        For example, an atom might expose the current
-        atom symbol, charge, num implicit/explicit hydrogens
-        et cetera.
-        """
-        raise NotImplementedError()
-
     def set_hovered(self,is_hovered:bool) -> None:
         self._is_hovered = is_hovered
 
@@ -118,10 +111,18 @@ class DocItem:
 
 class Atom(DocItem):
 
-    def __init__(self,symbol:str,pos:np.ndarray,) -> None:
+    # Atoms get a unique id that (unlike the Python object) survives
+    # saving and restoring a document:
+    _next_uid = 0
+
+    def __init__(self,symbol:str,pos:np.ndarray,uid:Optional[int]=None,) -> None:
         super().__init__()
         self.symbol = symbol
         self.pos = pos
+        if uid is None:
+            uid = Atom._next_uid
+        Atom._next_uid = max(Atom._next_uid,uid+1)
+        self.uid = uid
 
     def x(self):
         return int(self.pos[0] + self.translation[0])
@@ -132,9 +133,6 @@ class Atom(DocItem):
     def within_rectangle(self, rect: Rect) -> bool:
         return rect.contains(self.pos)
 
-    def show_configuration_dialog(self):
-        AtomConfigurationDialog(self).show_dialog()
-
     def commit_translate(self):
         self.pos += self.translation
         self.translation = np.array([0.0,0.0])
@@ -195,11 +193,91 @@ class Angle:
             return math.degrees(math.acos(cos_w))
         except:
             import pdb; pdb.set_trace()
+
+    @staticmethod
+    def enclosed_angles(pa:np.ndarray, pb:np.ndarray, pc:np.ndarray) -> np.ndarray:
+        """
+        Same as enclosed_angle_vec, for whole arrays of angles at once.
+
+        >>> Angle.enclosed_angles(np.array([[-1,0]]),np.array([[0,0]]),np.array([[0,1]])).tolist()
+        [90.0]
+        """
+        eta = 0.00001
+        ab = np.asarray(pa,dtype=float) - pb
+        cb = np.asarray(pc,dtype=float) - pb
+        nom = np.maximum(np.hypot(ab[:,0],ab[:,1]) * np.hypot(cb[:,0],cb[:,1]),eta)
+        cos_w = np.clip((ab*cb).sum(axis=1) / nom,-1,1)
+        return np.degrees(np.arccos(cos_w))
+
+
+def acceptable_angles(angles:np.ndarray) -> np.ndarray:
+    """
+    The editor only accepts bond angles that are multiples of 30°.
+
+    >>> acceptable_angles(np.array([120.2,109.5,90.0])).tolist()
+    [True, False, True]
+    """
+    rounded = np.abs(np.round(angles))
+    return (rounded % 30 == 0) & (rounded <= 360)
         
         
 
 
+@dataclass
+class Fragment:
+    """
+    Atoms and bonds as plain arrays, as used for bulk insertion:
+    coords has shape (n,2), bonds holds (i,j) index pairs into the
+    atoms and orders the order of every bond.
+
+    >>> a = [Atom('C',np.array([0.,0.])),Atom('O',np.array([1.,0.])),Atom('N',np.array([2.,0.]))]
+    >>> frag = Fragment.from_items(a[:2],[Bond(a[0],a[1],2),Bond(a[1],a[2],1)])
+    >>> frag.symbols, frag.bonds.tolist(), frag.orders
+    (['C', 'O'], [[0, 1]], [2])
+    """
+    symbols:list[str]
+    coords:np.ndarray
+    bonds:np.ndarray
+    orders:list
+
+    def __len__(self) -> int:
+        return len(self.symbols)
+
+    @staticmethod
+    def from_items(atoms:list["Atom"], bonds:list["Bond"]) -> "Fragment":
+        # Bonds to atoms outside of the fragment are dropped:
+        idx = {id(atm): i for i,atm in enumerate(atoms)}
+        bonds = [bnd for bnd in bonds if id(bnd.fst) in idx and id(bnd.snd) in idx]
+        return Fragment(
+            symbols=[atm.symbol for atm in atoms],
+            coords=np.array([atm.pos for atm in atoms],dtype=float).reshape((-1,2)),
+            bonds=np.array([[idx[id(bnd.fst)],idx[id(bnd.snd)]] for bnd in bonds],dtype=int).reshape((-1,2)),
+            orders=[bnd.order for bnd in bonds],
+        )
+
+
+@dataclass
+class ValenceInfo:
+    bond_order_sum:float
+    implicit_hs:int
+    error:bool
+
+
 class Mol:
+    """
+
+    >>> a = [Atom('C',np.array([0.,0.])),Atom('O',np.array([1.,0.])),Atom('N',np.array([2.,0.]))]
+    >>> ethanol_like = Mol(atoms=a,bonds=[Bond(a[0],a[1],1),Bond(a[1],a[2],1)])
+    >>> b = [Atom('N',np.array([0.,0.])),Atom('C',np.array([5.,5.])),Atom('O',np.array([9.,1.]))]
+    >>> reordered = Mol(atoms=b,bonds=[Bond(b[2],b[0],1),Bond(b[1],b[2],1)])
+    >>> ethanol_like.canonical_hash() == reordered.canonical_hash()
+    True
+    >>> reordered.bonds[0].order = 2
+    >>> reordered.touch()
+    >>> ethanol_like.canonical_hash() == reordered.canonical_hash()
+    False
+    """
+
     def __init__(self, atoms=None,bonds=None,) -> None:
         if atoms is None:
             atoms = []
@@ -208,6 +286,199 @@ class Mol:
         self.atoms:list[Atom] = atoms
         self.bonds:list[Bond] = bonds
 
+        # Bumped whenever the atoms or bonds of this molecule change.
+        # Everything derived from the molecular graph is cached
+        # against this counter:
+        self.revision = 0
+        # Bumped only when bonds are added. Rings do not depend on
+        # elements or bond orders, so they are cached against this:
+        self.bond_revision = 0
+        self._hash_cache:Optional[tuple[int,str]] = None
+        self._ring_cache:Optional[tuple] = None
+        # Atoms that moved since the render geometry last looked,
+        # None if all of them may have moved:
+        self._moved:Optional[dict[int,Atom]] = {}
+        # Owned by the canvas, see canvas.bond_geometry:
+        self.render_geometry = None
+
+        # Valences are perceived incrementally: the bond order sum
+        # and degree of every atom are kept up to date and only atoms
+        # whose bonds or element changed are evaluated again.
+        self._order_sum:dict[int,float] = {}
+        self._degree:dict[int,int] = {}
+        for bnd in self.bonds:
+            self._count_bond(bnd)
+        self._valence:dict[int,ValenceInfo] = {}
+        self._valence_dirty:dict[int,Atom] = {id(atm): atm for atm in self.atoms}
+
+    def touch(self) -> None:
+        self.revision += 1
+
+    def moved(self, atoms:Optional[list[Atom]]=None) -> None:
+        # atoms are the atoms that moved, None stands for all of them:
+        if atoms is None:
+            self._moved = None
+        elif self._moved is not None:
+            for atm in atoms:
+                self._moved[id(atm)] = atm
+
+    def take_moved(self) -> Optional[list[Atom]]:
+        # Returns and forgets the atoms that moved since the last call
+        # (None if all of them may have moved):
+        moved = self._moved
+        self._moved = {}
+        return None if moved is None else list(moved.values())
+
+    def _count_bond(self, bnd:Bond) -> None:
+        for atm in [bnd.fst,bnd.snd]:
+            key = id(atm)
+            self._order_sum[key] = self._order_sum.get(key,0) + bnd.order
+            self._degree[key] = self._degree.get(key,0) + 1
+
+    def add_bond(self, bnd:Bond) -> None:
+        self.bonds.append(bnd)
+        self._count_bond(bnd)
+        self._valence_dirty[id(bnd.fst)] = bnd.fst
+        self._valence_dirty[id(bnd.snd)] = bnd.snd
+        self.bond_revision += 1
+        self.touch()
+
+    def atom_changed(self, atm:Atom) -> None:
+        # Has to be called whenever the element of an atom changed.
+        self._valence_dirty[id(atm)] = atm
+        self.touch()
+
+    def degree(self, atm:Atom) -> int:
+        return self._degree.get(id(atm),0)
+
+    def valence_info(self, atm:Atom) -> ValenceInfo:
+        """
+        Returns the (cached) valence state of an atom.
+
+        >>> a = [Atom('O',np.array([0.,0.])),Atom('C',np.array([1.,0.]))]
+        >>> mol = Mol(atoms=a,bonds=[Bond(a[0],a[1],1)])
+        >>> mol.valence_info(a[0])
+        ValenceInfo(bond_order_sum=1, implicit_hs=1, error=False)
+        >>> mol.add_bond(Bond(a[0],a[1],2))
+        >>> mol.valence_info(a[0])
+        ValenceInfo(bond_order_sum=3, implicit_hs=0, error=True)
+        """
+        key = id(atm)
+        if key in self._valence_dirty or key not in self._valence:
+            self._valence[key] = self._perceive_valence(atm)
+            self._valence_dirty.pop(key,None)
+        return self._valence[key]
+
+    def _perceive_valence(self, atm:Atom) -> ValenceInfo:
+        order_sum = self._order_sum.get(id(atm),0)
+        valences = valence_table().get(atm.symbol)
+        if valences is None:
+            # Unknown elements and elements without a fixed
+            # valence are accepted as they are:
+            return ValenceInfo(order_sum,0,False)
+        used = math.ceil(order_sum - 0.0001)
+        fitting = [v for v in valences if v >= used]
+        if not fitting:
+            return ValenceInfo(order_sum,0,True)
+        return ValenceInfo(order_sum,fitting[0] - used,False)
+
+    def valence_errors(self) -> list[Atom]:
+        return [atm for atm in self.atoms if self.valence_info(atm).error]
+
+    def inherit_valences(self, mol:"Mol") -> None:
+        # Atoms keep their bonds when molecules are merged,
+        # so everything that was perceived for them stays valid:
+        self._valence.update(mol._valence)
+        for key in mol._valence:
+            if key not in mol._valence_dirty:
+                self._valence_dirty.pop(key,None)
+
+    def canonical_hash(self) -> str:
+        """
+        Returns a hash of the molecular graph that does not depend on
+        the order of atoms and bonds (nor on coordinates), computed by
+        Weisfeiler-Lehman refinement of the atom symbols. Bond orders
+        count by value, so 2 and 2.0 hash the same.
+
+        >>> a = [Atom('C',np.array([0.,0.])),Atom('O',np.array([1.,0.]))]
+        >>> b = [Atom('O',np.array([5.,5.])),Atom('C',np.array([6.,5.]))]
+        >>> mol_a = Mol(atoms=a,bonds=[Bond(a[0],a[1],2)])
+        >>> mol_b = Mol(atoms=b,bonds=[Bond(b[1],b[0],2.0)])
+        >>> mol_a.canonical_hash() == mol_b.canonical_hash()
+        True
+        """
+        if self._hash_cache is not None and self._hash_cache[0] == self.revision:
+            return self._hash_cache[1]
+
+        def digest(text:str) -> str:
+            return hashlib.blake2b(text.encode(),digest_size=8).hexdigest()
+
+        idx = {id(atm): i for i,atm in enumerate(self.atoms)}
+        neighs:list[list[tuple[str,int]]] = [[] for _ in self.atoms]
+        for bnd in self.bonds:
+            i,j = idx[id(bnd.fst)],idx[id(bnd.snd)]
+            # Orders read from files or arrays may be floats:
+            order = f"{float(bnd.order):g}"
+            neighs[i].append((order,j))
+            neighs[j].append((order,i))
+
+        labels = [atm.symbol for atm in self.atoms]
+        n_classes = len(set(labels))
+        history = [sorted(labels)]
+        for _ in range(len(self.atoms)):
+            labels = [
+                digest(labels[i] + "|" + ",".join(sorted(f"{order}:{labels[j]}" for order,j in neighs[i])))
+                for i in range(len(self.atoms))
+            ]
+            history.append(sorted(labels))
+            # Once the partition of the atoms stops getting finer,
+            # further iterations cannot tell more atoms apart:
+            if len(set(labels)) == n_classes:
+                break
+            n_classes = len(set(labels))
+
+        h = digest(f"{len(self.atoms)}/{len(self.bonds)}/" + "/".join(",".join(lbls) for lbls in history))
+        self._hash_cache = (self.revision,h)
+        return h
+
+    def _perceive_rings(self) -> tuple:
+        if self._ring_cache is not None and self._ring_cache[0] == self.bond_revision:
+            return self._ring_cache
+        idx = {id(atm): i for i,atm in enumerate(self.atoms)}
+        edges = [(idx[id(bnd.fst)],idx[id(bnd.snd)]) for bnd in self.bonds]
+        rings = smallest_rings(len(self.atoms),edges)
+        edge_of = {frozenset(e): k for k,e in enumerate(edges)}
+
+        # Every bond is drawn towards the smallest ring it belongs to.
+        # Rings come smallest first, so the first one wins:
+        bond_ring = np.full(len(self.bonds),-1,dtype=int)
+        for r,ring in enumerate(rings):
+            for a,b in zip(ring,ring[1:] + ring[:1]):
+                k = edge_of[frozenset((a,b))]
+                if bond_ring[k] < 0:
+                    bond_ring[k] = r
+        self._ring_cache = (self.bond_revision,rings,bond_ring)
+        return self._ring_cache
+
+    def rings(self) -> list[list[Atom]]:
+        """
+        Returns the smallest set of smallest rings, every ring as its
+        atoms in ring order. Perceived once per change of the bonds.
+
+        >>> a = [Atom('C',np.array([np.cos(t),np.sin(t)])) for t in np.arange(6)*np.pi/3]
+        >>> benzene = Mol(atoms=a,bonds=[Bond(a[i],a[(i+1)%6],1+i%2) for i in range(6)])
+        >>> [len(ring) for ring in benzene.rings()]
+        [6]
+        >>> benzene.bond_ring_index().tolist()
+        [0, 0, 0, 0, 0, 0]
+        """
+        rings = self._perceive_rings()[1]
+        return [[self.atoms[i] for i in ring] for ring in rings]
+
+    def bond_ring_index(self) -> np.ndarray:
+        # For every bond, the index (into rings()) of the ring it is
+        # drawn towards, -1 for bonds outside of rings:
+        return self._perceive_rings()[2]
 
     def neighboring_atoms(self, atm:Atom) -> list[Atom]:
         neighs = []
@@ -219,18 +490,28 @@ class Mol:
         return neighs
 
     def is_explicit_atom(self, atm:Atom) -> bool:
-        ns = self.neighboring_atoms(atm)
-        if len(ns) and atm.symbol == 'C':
-            # TODO: for now regarding every carbon
-            # TODO: atom with neighbors as implicit
-            # TODO: finer logic!
-            return False
+        if self.degree(atm) and atm.symbol == 'C':
+            # Carbons with neighbors are drawn as corners of the
+            # skeleton, unless there is something wrong with them:
+            return self.valence_info(atm).error
 
         # TODO: handle other possible implicit cases
         return True
+
+    def atom_label(self, atm:Atom) -> str:
+        # The atom symbol followed by its implicit hydrogens (e.g. NH2):
+        n_h = self.valence_info(atm).implicit_hs
+        if atm.symbol == 'H' or n_h == 0:
+            return atm.symbol
+        if n_h == 1:
+            return atm.symbol + "H"
+        return f"{atm.symbol}H{n_h}"
     
 
     @staticmethod
     def merge_molecules(mol_a,mol_b):
         # TODO: apply deepcopy here for safety
-        return Mol(atoms=mol_a.atoms+mol_b.atoms,bonds=mol_a.bonds+mol_b.bonds)
+        merged = Mol(atoms=mol_a.atoms+mol_b.atoms,bonds=mol_a.bonds+mol_b.bonds)
+        merged.inherit_valences(mol_a)
+        merged.inherit_valences(mol_b)
+        return merged
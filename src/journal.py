@@ -0,0 +1,352 @@
+
+import json
+import os
+from pathlib import Path
+import queue
+import shutil
+import threading
+import time
+from typing import TYPE_CHECKING, Callable, Optional
+import uuid
+
+try:
+    import fcntl
+except ImportError:
+    # Windows
+    fcntl = None
+    import msvcrt
+
+import numpy as np
+
+from canvas.model_events import AtomsAdded, AtomsChanged, AtomsMoved, BondsAdded, ModelEvent
+from core import Atom, Bond, Mol
+
+if TYPE_CHECKING:
+    from canvas.model import CanvasModel
+
+
+def capture_document(model:"CanvasModel") -> dict:
+    """
+    Captures the document as plain data: atoms as [uid,symbol,x,y]
+    and bonds as [uid_a,uid_b,order].
+    """
+    atoms, bonds = [], []
+    for mol in model.mols:
+        for atm in mol.atoms:
+            atoms.append([atm.uid,atm.symbol,float(atm.pos[0]),float(atm.pos[1])])
+        for bnd in mol.bonds:
+            bonds.append([bnd.fst.uid,bnd.snd.uid,bnd.order])
+    return {"atoms": atoms, "bonds": bonds}
+
+
+def build_mols(atoms:dict, bonds:dict) -> list[Mol]:
+    """
+    Turns plain atoms ({uid: [symbol,x,y]}) and bonds ({(uid_a,uid_b): order})
+    back into molecules, i.e. the connected components of the bond graph.
+    """
+    objs = {uid: Atom(symbol,np.array([x,y],dtype=float),uid=uid) for uid,(symbol,x,y) in atoms.items()}
+    parent = {uid: uid for uid in objs}
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+    for a,b in bonds:
+        ra,rb = find(a),find(b)
+        if ra != rb:
+            parent[ra] = rb
+
+    components:dict[int,list[Atom]] = {}
+    for uid,atm in objs.items():
+        components.setdefault(find(uid),[]).append(atm)
+    result = [Mol(atoms=atms) for atms in components.values()]
+    mol_of = {atm.uid: mol for mol in result for atm in mol.atoms}
+    for (a,b),order in bonds.items():
+        mol_of[a].add_bond(Bond(fst=objs[a],snd=objs[b],order=order))
+    return result
+
+
+def event_records(event:ModelEvent) -> list[tuple[str,list]]:
+    """
+    Turns a model event into journal operations. Only changes of the
+    document content are journaled, e.g. not the selection.
+    """
+    if isinstance(event,AtomsAdded):
+        return [("add_atoms",[[atm.uid,atm.symbol,float(atm.pos[0]),float(atm.pos[1])] for atm in event.atoms])]
+    if isinstance(event,BondsAdded):
+        return [("add_bonds",[[bnd.fst.uid,bnd.snd.uid,bnd.order] for bnd in event.bonds])]
+    if isinstance(event,AtomsMoved):
+        return [("move_atoms",[[atm.uid,float(atm.pos[0]),float(atm.pos[1])] for atm in event.atoms])]
+    if isinstance(event,AtomsChanged):
+        return [("set_symbol",[atm.uid,atm.symbol]) for atm in event.atoms]
+    return []
+
+
+class DocumentState:
+    """
+    A plain (object free) copy of the document that the journal
+    writer keeps up to date by applying every operation it writes.
+    All operations are idempotent, so replaying one twice is harmless.
+    """
+
+    def __init__(self) -> None:
+        self.atoms:dict[int,list] = {}
+        self.bonds:dict[tuple[int,int],float] = {}
+
+    def load(self, data:dict) -> None:
+        self.atoms = {uid: [symbol,x,y] for uid,symbol,x,y in data["atoms"]}
+        self.bonds = {}
+        for a,b,order in data["bonds"]:
+            self.bonds[(min(a,b),max(a,b))] = order
+
+    def renumber(self, first_uid:int) -> None:
+        # Journals of different editors use the same uids, so recovered
+        # atoms get new ones:
+        new_uid = {uid: first_uid + i for i,uid in enumerate(self.atoms)}
+        self.atoms = {new_uid[uid]: vals for uid,vals in self.atoms.items()}
+        self.bonds = {(new_uid[a],new_uid[b]): order for (a,b),order in self.bonds.items() if a in new_uid and b in new_uid}
+
+    def dump(self) -> dict:
+        return {
+            "atoms": [[uid] + vals for uid,vals in self.atoms.items()],
+            "bonds": [[a,b,order] for (a,b),order in self.bonds.items()],
+        }
+
+    def apply(self, op:str, args:list) -> None:
+        if op == "add_atoms":
+            for uid,symbol,x,y in args:
+                self.atoms[uid] = [symbol,x,y]
+        elif op == "add_bonds":
+            for a,b,order in args:
+                self.bonds[(min(a,b),max(a,b))] = order
+        elif op == "move_atoms":
+            for uid,x,y in args:
+                if uid in self.atoms:
+                    self.atoms[uid][1:] = [x,y]
+        elif op == "set_symbol":
+            uid,symbol = args
+            if uid in self.atoms:
+                self.atoms[uid][0] = symbol
+        else:
+            assert False, f"Unknown journal operation {op}"
+
+
+def _try_lock(f) -> bool:
+    # Locks an open file without waiting. The lock is released when
+    # the file is closed, which includes the process dying:
+    try:
+        if fcntl is not None:
+            fcntl.flock(f.fileno(),fcntl.LOCK_EX | fcntl.LOCK_NB)
+        else:
+            msvcrt.locking(f.fileno(),msvcrt.LK_NBLCK,1)
+    except OSError:
+        return False
+    return True
+
+
+class Journal:
+    """
+    Autosaves the document as an append-only journal of model
+    operations. The GUI thread only puts small operation records
+    on a queue; encoding, writing and compacting all happen on a
+    background thread, so saving never blocks an input event.
+
+    Every record carries a sequence number. Compaction writes the
+    writer's copy of the document as a snapshot (which includes
+    all records up to some sequence number) and then starts a new
+    journal. Recovery loads the snapshot and replays all journal
+    records that came after it.
+
+    Every editor journals into a directory of its own below root,
+    which it keeps locked while it runs and removes when it is
+    closed. So a directory with a free lock was left behind by an
+    editor that crashed. If writing fails, on_error is called with
+    a message (on the writer thread) and journaling stops.
+    """
+
+    # Locks of the journals claimed by claim_stale:
+    _claims:dict[Path,object] = {}
+
+    def __init__(self, root:Path, compact_every:int=10000, compact_interval:float=300, on_error:Optional[Callable[[str],None]]=None,) -> None:
+        root = Path(root)
+        root.mkdir(parents=True,exist_ok=True)
+        self.directory = root / f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self.directory.mkdir()
+        self._lock = open(self.directory / "lock","w")
+        assert _try_lock(self._lock), f"Cannot lock {self.directory}"
+        self.journal_path = self.directory / "journal.jsonl"
+        self.snapshot_path = self.directory / "snapshot.json"
+        self.compact_every = compact_every
+        self.compact_interval = compact_interval
+        self.on_error = on_error
+        self.error:Optional[Exception] = None
+        self._seq = 0
+        self._queue:queue.Queue = queue.Queue()
+        self._thread:Optional[threading.Thread] = None
+        self._model:Optional["CanvasModel"] = None
+
+    @staticmethod
+    def claim_stale(root:Path) -> list[Path]:
+        """
+        Returns the journals left behind by crashed editors, i.e. with
+        a free lock and something to recover. They are claimed by
+        locking and renaming them, so two editors that start at the
+        same time do not recover the same journal. Claimed journals
+        stay locked until they are discarded.
+        """
+        root = Path(root)
+        if not root.is_dir():
+            return []
+        claimed = []
+        for directory in sorted(root.iterdir()):
+            if not directory.is_dir():
+                continue
+            if not ((directory / "journal.jsonl").exists() or (directory / "snapshot.json").exists()):
+                continue
+            lock = open(directory / "lock","a")
+            if not _try_lock(lock):
+                # The editor is still running (or another editor
+                # is recovering its journal).
+                lock.close()
+                continue
+            target = root / f"stale-{uuid.uuid4().hex[:8]}"
+            if fcntl is None:
+                # Windows cannot rename a directory with open files:
+                lock.close()
+            try:
+                os.rename(directory,target)
+            except OSError:
+                lock.close()
+                continue
+            if fcntl is None:
+                lock = open(target / "lock","a")
+                if not _try_lock(lock):
+                    lock.close()
+                    continue
+            # The lock is held until the journal is discarded:
+            Journal._claims[target] = lock
+            claimed.append(target)
+        return claimed
+
+    @staticmethod
+    def discard(directory:Path) -> None:
+        lock = Journal._claims.pop(Path(directory),None)
+        if lock is not None:
+            lock.close()
+        shutil.rmtree(directory,ignore_errors=True)
+
+    @staticmethod
+    def recover(directory:Path) -> DocumentState:
+        directory = Path(directory)
+        state = DocumentState()
+        seq = -1
+        snapshot_path = directory / "snapshot.json"
+        if snapshot_path.exists():
+            data = json.loads(snapshot_path.read_text())
+            state.load(data["document"])
+            seq = data["seq"]
+
+        journal_path = directory / "journal.jsonl"
+        if journal_path.exists():
+            with open(journal_path) as f:
+                for line in f:
+                    try:
+                        rec = json.loads(line)
+                    except json.JSONDecodeError:
+                        # The last record might have been cut off by the crash.
+                        break
+                    if rec["seq"] > seq:
+                        state.apply(rec["op"],rec["args"])
+        return state
+
+    def start(self, model:"CanvasModel") -> None:
+        """
+        Starts journaling the given model. The current content of the
+        model is captured once and becomes the first snapshot.
+        """
+        initial = capture_document(model)
+        self._thread = threading.Thread(target=self._run,args=(initial,),daemon=True)
+        self._thread.start()
+        self._model = model
+        model.subscribe(self.on_model_event)
+
+    def on_model_event(self, event:ModelEvent) -> None:
+        for op,args in event_records(event):
+            self.record(op,args)
+
+    def record(self, op:str, args:list) -> None:
+        if self.error is not None:
+            return
+        self._seq += 1
+        self._queue.put((self._seq,op,args))
+
+    def close(self, clean:bool=True) -> None:
+        if self._model is not None:
+            self._model.unsubscribe(self.on_model_event)
+            self._model = None
+        self._queue.put(None)
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        # Without the lock, the journal counts as left behind:
+        self._lock.close()
+        if clean:
+            # Nothing to recover after a regular shutdown:
+            self.discard(self.directory)
+
+    def _run(self, initial:dict) -> None:
+        try:
+            self._write(initial)
+        except Exception as e:
+            self.error = e
+            if self.on_error is not None:
+                self.on_error(f"Autosave failed: {e}")
+
+    def _write(self, initial:dict) -> None:
+        state = DocumentState()
+        state.load(initial)
+        last_seq = 0
+        self._write_snapshot(state,last_seq)
+        f = open(self.journal_path,"w")
+        n_since_compaction = 0
+        last_compaction = time.monotonic()
+        stop = False
+        while not stop:
+            batch = [self._queue.get()]
+            # Write everything that piled up in one go:
+            while True:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            lines = []
+            for item in batch:
+                if item is None:
+                    stop = True
+                    break
+                seq,op,args = item
+                state.apply(op,args)
+                lines.append(json.dumps({"seq": seq,"op": op,"args": args},separators=(",",":")))
+                last_seq = seq
+            if lines:
+                f.write("\n".join(lines) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+                n_since_compaction += len(lines)
+
+            if n_since_compaction >= self.compact_every or (n_since_compaction and time.monotonic() - last_compaction > self.compact_interval):
+                self._write_snapshot(state,last_seq)
+                f.close()
+                f = open(self.journal_path,"w")
+                n_since_compaction = 0
+                last_compaction = time.monotonic()
+        f.close()
+
+    def _write_snapshot(self, state:DocumentState, seq:int) -> None:
+        tmp = self.snapshot_path.with_suffix(".tmp")
+        with open(tmp,"w") as f:
+            json.dump({"seq": seq,"document": state.dump()},f,separators=(",",":"))
+            f.flush()
+            os.fsync(f.fileno())
+        # Replacing is atomic, so there is always a complete snapshot:
+        os.replace(tmp,self.snapshot_path)
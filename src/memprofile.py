@@ -0,0 +1,167 @@
+
+from contextlib import contextmanager
+import functools
+import tracemalloc
+
+
+class OperationStats:
+
+    def __init__(self) -> None:
+        self.calls = 0
+        # Calls that were measured with snapshots, see MemoryProfiler:
+        self.snapshots = 0
+        # Memory allocated by the operation and still held after it
+        # returned (e.g. new atoms):
+        self.net_bytes = 0
+        self.net_blocks = 0
+        # Memory allocated during the operation, even if it was
+        # freed again before the operation returned:
+        self.peak_bytes = 0
+        self.max_peak_bytes = 0
+        # (file,line) -> [bytes,blocks] of the allocations that outlived the operation:
+        self.sites:dict[tuple[str,int],list[int]] = {}
+
+
+class MemoryProfiler:
+    """
+    An opt-in memory instrumentation that measures editor operations
+    with tracemalloc. For every operation we record the memory it
+    allocated and still held when it returned (bytes and number of
+    blocks, grouped by allocation site), and the traced peak, which
+    shows how much it allocated temporarily. The peak is where many
+    tiny short-lived arrays show up.
+
+    Tracing slows everything down considerably, so this is meant for
+    measuring, e.g. while replaying an input trace, not for everyday use.
+    Snapshots cost time proportional to everything that is traced, so
+    the outermost operation clears the traces when it starts and its
+    closing snapshot only holds its own allocations. Operations may be
+    nested (e.g. a model operation within a mouse event), the outer
+    operation then includes the inner one. Nested operations must not
+    clear the traces, they only measure their net and peak bytes.
+    """
+
+    def __init__(self, frames:int=1,) -> None:
+        self.frames = frames
+        self.stats:dict[str,OperationStats] = {}
+        # Peaks seen by the enclosing operations before an inner
+        # operation reset the peak:
+        self._outer_peaks:list[int] = []
+        self._filters = [
+            tracemalloc.Filter(False,tracemalloc.__file__),
+            tracemalloc.Filter(False,__file__),
+        ]
+
+    def start(self) -> None:
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(self.frames)
+
+    def stop(self) -> None:
+        tracemalloc.stop()
+
+    def _snapshot(self) -> tracemalloc.Snapshot:
+        return tracemalloc.take_snapshot().filter_traces(self._filters)
+
+    @contextmanager
+    def measure(self, name:str):
+        if not tracemalloc.is_tracing():
+            yield
+            return
+
+        nested = bool(self._outer_peaks)
+        if nested:
+            self._outer_peaks[-1] = max(self._outer_peaks[-1],tracemalloc.get_traced_memory()[1])
+        else:
+            tracemalloc.clear_traces()
+        base,_ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        self._outer_peaks.append(0)
+        try:
+            yield
+        finally:
+            inner_peak = self._outer_peaks.pop()
+            current,peak = tracemalloc.get_traced_memory()
+            peak = max(peak,inner_peak)
+            st = self.stats.setdefault(name,OperationStats())
+            st.calls += 1
+            st.peak_bytes += peak - base
+            st.max_peak_bytes = max(st.max_peak_bytes,peak - base)
+            if nested:
+                st.net_bytes += current - base
+                self._outer_peaks[-1] = max(self._outer_peaks[-1],peak)
+            else:
+                self._account(st,self._snapshot())
+
+    def _account(self, st:OperationStats, snapshot:tracemalloc.Snapshot) -> None:
+        # The traces were cleared when the operation started, so the
+        # snapshot only holds what it allocated and did not free again.
+        st.snapshots += 1
+        for stat in snapshot.statistics("lineno"):
+            st.net_bytes += stat.size
+            st.net_blocks += stat.count
+            frame = stat.traceback[0]
+            site = st.sites.setdefault((frame.filename,frame.lineno),[0,0])
+            site[0] += stat.size
+            site[1] += stat.count
+
+    def wrap(self, obj, names:list[str], prefix:str="",) -> None:
+        """
+        Instruments the given methods of obj (on this instance only).
+        """
+        for name in names:
+            method = getattr(obj,name)
+
+            @functools.wraps(method)
+            def wrapper(*args,_method=method,_name=prefix+name,**kwargs):
+                with self.measure(_name):
+                    return _method(*args,**kwargs)
+            setattr(obj,name,wrapper)
+
+    def report(self, top_sites:int=5) -> str:
+        lines = [f"{'operation':<28}{'calls':>8}{'net KiB/call':>14}{'blocks/call':>13}{'peak KiB/call':>15}{'max peak KiB':>14}"]
+        ordered = sorted(self.stats.items(),key=lambda kv: kv[1].peak_bytes,reverse=True)
+        for name,st in ordered:
+            n = max(st.calls,1)
+            blocks = f"{st.net_blocks/st.snapshots:>13.1f}" if st.snapshots else f"{'-':>13}"
+            lines.append(f"{name:<28}{st.calls:>8}{st.net_bytes/n/1024:>14.2f}{blocks}{st.peak_bytes/n/1024:>15.2f}{st.max_peak_bytes/1024:>14.2f}")
+        for name,st in ordered:
+            if not st.sites:
+                continue
+            lines.append("")
+            lines.append(f"{name}: top allocation sites")
+            sites = sorted(st.sites.items(),key=lambda kv: kv[1][0],reverse=True)[:top_sites]
+            for (filename,lineno),(size,count) in sites:
+                lines.append(f"  {size/1024:10.2f} KiB {count:8d} blocks  {filename}:{lineno}")
+        return "\n".join(lines)
+
+    def to_dict(self) -> dict:
+        return {
+            name: {
+                "calls": st.calls,
+                "snapshots": st.snapshots,
+                "net_bytes": st.net_bytes,
+                "net_blocks": st.net_blocks,
+                "peak_bytes": st.peak_bytes,
+                "max_peak_bytes": st.max_peak_bytes,
+                "sites": [{"file": f,"line": l,"bytes": b,"blocks": c} for (f,l),(b,c) in st.sites.items()],
+            }
+            for name,st in self.stats.items()
+        }
+
+
+# Model operations and controller events worth measuring:
+MODEL_OPERATIONS = [
+    "add_atom","add_fragment","preview_new_bond","translate","commit_translate",
+    "preview_rotate","preview_mirror","preview_scale","commit_transform","arrange",
+    "preview_rect_select","preview_lasso_select","set_selection","extend_selection","set_atom_symbol",
+    "doc_item_near_pos",
+]
+CONTROLLER_EVENTS = [
+    "mouseMoveEvent","mousePressEvent","mouseReleaseEvent","mouseDoubleClickEvent",
+    "wheelEvent","keyPressEvent","paintEvent",
+]
+
+
+def instrument(profiler:MemoryProfiler, controller) -> None:
+    profiler.wrap(controller.model,MODEL_OPERATIONS,prefix="model.")
+    profiler.wrap(controller,CONTROLLER_EVENTS,prefix="controller.")
@@ -0,0 +1,124 @@
+
+import numpy as np
+
+from core import Fragment
+
+
+# A 1.5 Å bond maps onto CanvasModel.BOND_LENGTH (30 world units).
+# Molfiles also have their y axis pointing up, unlike the canvas.
+WORLD_PER_ANGSTROM = 20.0
+
+# Molfiles with more atoms or bonds than this need the V3000 format:
+V2000_MAX_COUNT = 999
+
+
+def fragment_to_molblock(frag:Fragment, title:str="") -> str:
+    """
+    Writes a fragment as MDL molfile. The V2000 format is used
+    whenever possible since more programs understand it.
+
+    >>> frag = Fragment(['C','O'],np.array([[0.,0.],[30.,0.]]),np.array([[0,1]]),[2])
+    >>> mb = fragment_to_molblock(frag)
+    >>> mb.splitlines()[3]
+    '  2  1  0  0  0  0  0  0  0  0999 V2000'
+    >>> back = molblock_to_fragment(mb)
+    >>> back.symbols, back.coords.tolist(), back.bonds.tolist(), back.orders
+    (['C', 'O'], [[0.0, 0.0], [30.0, 0.0]], [[0, 1]], [2])
+    """
+    pos = np.asarray(frag.coords,dtype=float).reshape((-1,2)) / WORLD_PER_ANGSTROM
+    # (Unlike negating, subtracting from 0.0 never gives -0.0.)
+    pos[:,1] = 0.0 - pos[:,1]
+    bonds = np.asarray(frag.bonds,dtype=int).reshape((-1,2))
+    header = [title,"  alchemy-editor",""]
+    if len(frag) <= V2000_MAX_COUNT and len(bonds) <= V2000_MAX_COUNT:
+        lines = header + [f"{len(frag):3d}{len(bonds):3d}  0  0  0  0  0  0  0  0999 V2000"]
+        lines += [f"{x:10.4f}{y:10.4f}{0:10.4f} {sym:<3} 0  0  0  0  0  0  0  0  0  0  0  0"
+                  for sym,(x,y) in zip(frag.symbols,pos.tolist())]
+        lines += [f"{a+1:3d}{b+1:3d}{int(order):3d}  0  0  0  0"
+                  for (a,b),order in zip(bonds.tolist(),frag.orders)]
+    else:
+        lines = header + ["  0  0  0     0  0            999 V3000",
+                          "M  V30 BEGIN CTAB",
+                          f"M  V30 COUNTS {len(frag)} {len(bonds)} 0 0 0",
+                          "M  V30 BEGIN ATOM"]
+        lines += [f"M  V30 {i+1} {sym} {x:.4f} {y:.4f} 0 0"
+                  for i,(sym,(x,y)) in enumerate(zip(frag.symbols,pos.tolist()))]
+        lines += ["M  V30 END ATOM","M  V30 BEGIN BOND"]
+        lines += [f"M  V30 {i+1} {int(order)} {a+1} {b+1}"
+                  for i,((a,b),order) in enumerate(zip(bonds.tolist(),frag.orders))]
+        lines += ["M  V30 END BOND","M  V30 END CTAB"]
+    lines.append("M  END")
+    return "\n".join(lines) + "\n"
+
+
+def molblock_to_fragment(text:str) -> Fragment:
+    """
+    Reads the atoms and bonds of a V2000 or V3000 molfile.
+    Aromatic bonds (order 4) become single bonds.
+
+    >>> mb = fragment_to_molblock(Fragment(['C','O'],np.zeros((2,2)),np.array([[0,1]]),[1]))
+    >>> try:
+    ...     molblock_to_fragment(mb.replace("  1  2  1","  1  5  1"))
+    ... except AssertionError as e:
+    ...     print(str(e).splitlines()[0])
+    Not a molfile: bond 1 5 refers to a missing atom
+    """
+    lines = text.splitlines()
+    assert len(lines) >= 4, "Not a molfile: the counts line is missing"
+    counts = lines[3]
+    symbols, xy, bonds, orders = [], [], [], []
+    if "V3000" in counts:
+        section = None
+        for line in lines[4:]:
+            if not line.startswith("M  V30 "):
+                continue
+            fields = line[7:].split()
+            if fields[0] in ("BEGIN","END"):
+                section = fields[1] if fields[0] == "BEGIN" else None
+            elif section == "ATOM":
+                symbols.append(fields[1])
+                xy.append((float(fields[2]),float(fields[3])))
+            elif section == "BOND":
+                orders.append(int(fields[1]))
+                bonds.append((int(fields[2])-1,int(fields[3])-1))
+        n_atoms = len(symbols)
+    else:
+        n_atoms,n_bonds = int(counts[0:3]),int(counts[3:6])
+        assert len(lines) >= 4 + n_atoms + n_bonds, "Not a molfile: atoms or bonds are missing"
+        for line in lines[4:4+n_atoms]:
+            xy.append((float(line[0:10]),float(line[10:20])))
+            symbols.append(line[31:34].strip())
+        for line in lines[4+n_atoms:4+n_atoms+n_bonds]:
+            bonds.append((int(line[0:3])-1,int(line[3:6])-1))
+            orders.append(int(line[6:9]))
+
+    for a,b in bonds:
+        # Atom numbers are 1-based, so 0 (i.e. -1) is invalid as well:
+        assert 0 <= a < n_atoms and 0 <= b < n_atoms, f"Not a molfile: bond {a+1} {b+1} refers to a missing atom"
+        assert a != b, f"Not a molfile: atom {a+1} is bonded to itself"
+
+    coords = np.array(xy,dtype=float).reshape((-1,2)) * WORLD_PER_ANGSTROM
+    coords[:,1] = 0.0 - coords[:,1]
+    return Fragment(
+        symbols=symbols,
+        coords=coords,
+        bonds=np.array(bonds,dtype=int).reshape((-1,2)),
+        orders=[1 if order == 4 else order for order in orders],
+    )
+
+
+def iter_molblocks(path):
+    """
+    Streams the records of an SD file (or the single record of a
+    molfile) one at a time, as (title, molblock) pairs.
+    """
+    lines = []
+    with open(path) as f:
+        for line in f:
+            if line.startswith("$$$$"):
+                yield (lines[0].strip() if lines else ""), "".join(lines)
+                lines = []
+            else:
+                lines.append(line)
+    if any(line.strip() for line in lines):
+        yield lines[0].strip(), "".join(lines)
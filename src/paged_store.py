@@ -0,0 +1,177 @@
+
+import json
+import os
+from pathlib import Path
+
+import numpy as np
+
+
+def connected_components(n:int, edges:np.ndarray) -> np.ndarray:
+    """
+    Labels the connected components of a graph with n nodes by
+    propagating the smallest node index along the edges, followed
+    by pointer jumping. Every node gets the smallest index within
+    its component as its label.
+
+    >>> connected_components(5,np.array([[0,1],[3,4],[1,2]])).tolist()
+    [0, 0, 0, 3, 3]
+    """
+    label = np.arange(n)
+    a,b = edges[:,0],edges[:,1]
+    while True:
+        m = np.minimum(label[a],label[b])
+        new = label.copy()
+        np.minimum.at(new,a,m)
+        np.minimum.at(new,b,m)
+        new = new[new]
+        if np.array_equal(new,label):
+            return label
+        label = new
+
+
+class PagedStore:
+    """
+    Stores a document on disk, partitioned into square spatial pages.
+    Every molecule lives in exactly one page, namely the one that
+    contains its centroid. Molecules can reach beyond their page, so
+    every page keeps the bounding box of its atoms.
+
+    The initial document is stored as a few flat arrays sorted by
+    page, which are memory mapped, so reading a page only touches the
+    part of the files it occupies. Pages written later on go into
+    files of their own which then replace the original slices.
+
+    Pages are read and written as plain arrays: atom uids, symbols and
+    positions, bonds as pairs of atom uids and bond orders.
+    """
+
+    ARRAYS = ["atom_uid","atom_symbol","atom_xy","bond_uids","bond_order"]
+
+    def __init__(self, directory:Path) -> None:
+        self.directory = Path(directory)
+        index = json.loads((self.directory / "index.json").read_text())
+        self.page_size = index["page_size"]
+        # Atoms of pages that were never loaded still own their uids:
+        self.next_uid = index["next_uid"]
+        self.pages = {tuple(int(v) for v in key.split(",")): page for key,page in index["pages"].items()}
+        self._base = {name: np.load(self.directory / f"{name}.npy",mmap_mode="r") for name in self.ARRAYS}
+
+    @staticmethod
+    def create(directory:Path, uids:np.ndarray, symbols, xy:np.ndarray, bond_uids:np.ndarray, orders, page_size:float=2048,) -> "PagedStore":
+        directory = Path(directory)
+        directory.mkdir(parents=True,exist_ok=True)
+        uids = np.asarray(uids,dtype=np.int64)
+        symbols = np.asarray(symbols,dtype="<U3")
+        xy = np.asarray(xy,dtype=float).reshape((-1,2))
+        bond_uids = np.asarray(bond_uids,dtype=np.int64).reshape((-1,2))
+        orders = np.asarray(orders,dtype=float)
+
+        # Molecules are the connected components of the bond graph:
+        by_uid = np.argsort(uids)
+        rows = by_uid[np.searchsorted(uids,bond_uids,sorter=by_uid)]
+        label = connected_components(len(uids),rows)
+        counts = np.bincount(label,minlength=len(uids))
+        with np.errstate(invalid="ignore"):
+            centroid = np.stack([np.bincount(label,xy[:,k],minlength=len(uids)) / counts for k in range(2)],axis=1)
+        cell = np.floor(centroid[label] / page_size).astype(np.int64)
+
+        atom_sort = np.lexsort((label,cell[:,1],cell[:,0]))
+        bond_sort = np.lexsort((cell[rows[:,0],1],cell[rows[:,0],0]))
+        atom_cells = cell[atom_sort]
+        bond_cells = cell[rows[bond_sort,0]]
+        arrays = {
+            "atom_uid": uids[atom_sort],
+            "atom_symbol": symbols[atom_sort],
+            "atom_xy": xy[atom_sort],
+            "bond_uids": bond_uids[bond_sort],
+            "bond_order": orders[bond_sort],
+        }
+        for name,arr in arrays.items():
+            np.save(directory / f"{name}.npy",arr)
+
+        pages = {}
+        keys,atom_start,atom_count = np.unique(atom_cells,axis=0,return_index=True,return_counts=True)
+        lo = np.minimum.reduceat(arrays["atom_xy"],atom_start) if len(keys) else np.zeros((0,2))
+        hi = np.maximum.reduceat(arrays["atom_xy"],atom_start) if len(keys) else np.zeros((0,2))
+        bond_keys,bond_start,bond_count = np.unique(bond_cells,axis=0,return_index=True,return_counts=True)
+        bond_ranges = {tuple(k): (int(s),int(s+c)) for k,s,c in zip(bond_keys.tolist(),bond_start,bond_count)}
+        for k,s,c,l,h in zip(keys.tolist(),atom_start.tolist(),atom_count.tolist(),lo.tolist(),hi.tolist()):
+            pages[tuple(k)] = {
+                "atoms": [s,s+c],
+                "bonds": list(bond_ranges.get(tuple(k),(0,0))),
+                "bbox": l + h,
+            }
+        store_index = {
+            "page_size": page_size,
+            "next_uid": int(uids.max()) + 1 if len(uids) else 0,
+            "pages": {f"{k[0]},{k[1]}": page for k,page in pages.items()},
+        }
+        (directory / "index.json").write_text(json.dumps(store_index))
+        return PagedStore(directory)
+
+    @staticmethod
+    def from_document(directory:Path, document:dict, page_size:float=2048,) -> "PagedStore":
+        # document as captured by journal.capture_document:
+        atoms, bonds = document["atoms"], document["bonds"]
+        return PagedStore.create(
+            directory,
+            uids=[a[0] for a in atoms],
+            symbols=[a[1] for a in atoms],
+            xy=[a[2:] for a in atoms],
+            bond_uids=[b[:2] for b in bonds],
+            orders=[b[2] for b in bonds],
+            page_size=page_size,
+        )
+
+    def page_of(self, pos:np.ndarray) -> tuple[int,int]:
+        tx,ty = np.floor(np.asarray(pos,dtype=float) / self.page_size).astype(int).tolist()
+        return tx,ty
+
+    def pages_in(self, lo:np.ndarray, hi:np.ndarray) -> list[tuple[int,int]]:
+        """
+        Returns the pages whose atoms might lie within the world
+        rectangle lo,hi.
+        """
+        keys = list(self.pages)
+        if not keys:
+            return []
+        bbox = np.array([self.pages[key]["bbox"] for key in keys],dtype=float).reshape((-1,4))
+        hit = (bbox[:,:2] <= hi).all(axis=1) & (bbox[:,2:] >= lo).all(axis=1)
+        return [keys[i] for i in np.flatnonzero(hit)]
+
+    def read_page(self, key:tuple[int,int]) -> dict[str,np.ndarray]:
+        page = self.pages.get(key)
+        if page is None:
+            return {name: self._base[name][:0].copy() for name in self.ARRAYS}
+        if "file" in page:
+            with np.load(self.directory / page["file"]) as data:
+                return {name: data[name] for name in self.ARRAYS}
+        a0,a1 = page["atoms"]
+        b0,b1 = page["bonds"]
+        return {name: np.array(self._base[name][a0:a1] if name.startswith("atom") else self._base[name][b0:b1])
+                for name in self.ARRAYS}
+
+    def write_page(self, key:tuple[int,int], arrays:dict[str,np.ndarray]) -> None:
+        """
+        Replaces the content of a page. Written pages get a file of
+        their own, the index is updated afterwards, so a crash leaves
+        either the old or the new page behind.
+        """
+        (self.directory / "pages").mkdir(exist_ok=True)
+        name = f"pages/{key[0]}_{key[1]}.npz"
+        tmp = self.directory / f"pages/{key[0]}_{key[1]}.tmp.npz"
+        np.savez(tmp,**arrays)
+        os.replace(tmp,self.directory / name)
+        xy = arrays["atom_xy"]
+        if len(xy):
+            self.next_uid = max(self.next_uid,int(arrays["atom_uid"].max()) + 1)
+            self.pages[key] = {"file": name,"bbox": xy.min(axis=0).tolist() + xy.max(axis=0).tolist()}
+        else:
+            self.pages[key] = {"file": name,"bbox": [np.inf,np.inf,-np.inf,-np.inf]}
+        self._write_index()
+
+    def _write_index(self) -> None:
+        pages = {f"{k[0]},{k[1]}": page for k,page in self.pages.items()}
+        tmp = self.directory / "index.json.tmp"
+        tmp.write_text(json.dumps({"page_size": self.page_size,"next_uid": self.next_uid,"pages": pages}))
+        os.replace(tmp,self.directory / "index.json")
@@ -1,5 +1,6 @@
+from functools import lru_cache
 from pathlib import Path
-import pandas as pd
+from typing import Optional
 from dataclasses import dataclass
 
 
@@ -27,6 +28,8 @@ class PSE:
         self.setup()
 
     def setup(self):
+        # pandas is only needed for the full table, not for valences:
+        import pandas as pd
         here = Path(__file__).parent
         csv = here.parent / "assets" / "pse.csv"
         assert csv.exists()
@@ -46,3 +49,77 @@ class PSE:
             self.elements.append(elt)
 
 
+def allowed_valences(elt:ChemElt) -> Optional[list[int]]:
+    """
+    Derives the valences an element may take from its number of
+    valence electrons. Returns None for elements without a fixed
+    valence (e.g. transition metals).
+
+    >>> allowed_valences(ChemElt(6,'Carbon','C',2,14,4))
+    [4]
+    >>> allowed_valences(ChemElt(7,'Nitrogen','N',2,15,5))
+    [3]
+    >>> allowed_valences(ChemElt(16,'Sulfur','S',3,16,6))
+    [2, 4, 6]
+    """
+    if str(elt.valence) == "nan" or str(elt.group) == "nan":
+        return None
+    n_val = int(elt.valence)
+    group = int(elt.group)
+    if group in [1,2,13]:
+        return [n_val]
+    if group == 14:
+        return [4]
+    if group in [15,16,17]:
+        # Starting with the third period, d orbitals allow
+        # for expanded octets (e.g. PCl5, SF6):
+        if int(elt.period) <= 2:
+            return [8 - n_val]
+        return list(range(8 - n_val,n_val + 1,2))
+    if group == 18:
+        return [0]
+    return None
+
+
+# The main group elements as (atomic number, symbol, period, group),
+# which are all that have a fixed valence:
+MAIN_GROUP_ELEMENTS = [
+    (1,"H",1,1),(2,"He",1,18),
+    (3,"Li",2,1),(4,"Be",2,2),(5,"B",2,13),(6,"C",2,14),(7,"N",2,15),(8,"O",2,16),(9,"F",2,17),(10,"Ne",2,18),
+    (11,"Na",3,1),(12,"Mg",3,2),(13,"Al",3,13),(14,"Si",3,14),(15,"P",3,15),(16,"S",3,16),(17,"Cl",3,17),(18,"Ar",3,18),
+    (19,"K",4,1),(20,"Ca",4,2),(31,"Ga",4,13),(32,"Ge",4,14),(33,"As",4,15),(34,"Se",4,16),(35,"Br",4,17),(36,"Kr",4,18),
+    (37,"Rb",5,1),(38,"Sr",5,2),(49,"In",5,13),(50,"Sn",5,14),(51,"Sb",5,15),(52,"Te",5,16),(53,"I",5,17),(54,"Xe",5,18),
+    (55,"Cs",6,1),(56,"Ba",6,2),(81,"Tl",6,13),(82,"Pb",6,14),(83,"Bi",6,15),(84,"Po",6,16),(85,"At",6,17),(86,"Rn",6,18),
+    (87,"Fr",7,1),(88,"Ra",7,2),
+]
+
+
+def main_group_elements() -> list[ChemElt]:
+    """
+    The main group elements without the periodic table file. Names
+    are left empty.
+
+    >>> main_group_elements()[5]
+    ChemElt(atomic_number=6, element='', symbol='C', period=2, group=14, valence=4)
+    """
+    return [
+        ChemElt(number,"",symbol,period,group,2 if symbol == "He" else group if group <= 2 else group - 10)
+        for number,symbol,period,group in MAIN_GROUP_ELEMENTS
+    ]
+
+
+@lru_cache(maxsize=1)
+def valence_table() -> dict[str,list[int]]:
+    # Loading the PSE is expensive, so the table is only built once.
+    # Without the periodic table file (or pandas), the valences of the
+    # main group elements are all we need for drawing:
+    try:
+        elements = PSE().elements
+    except (AssertionError,ImportError):
+        elements = main_group_elements()
+    table = {}
+    for elt in elements:
+        valences = allowed_valences(elt)
+        if valences:
+            table[elt.symbol] = valences
+    return table
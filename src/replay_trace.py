@@ -0,0 +1,51 @@
+# Replays a recorded input trace offscreen and reports per-event latencies:
+#
+#   QT_QPA_PLATFORM=offscreen python src/replay_trace.py trace.jsonl
+#
+# With --memprofile, every model operation and controller event is
+# measured with tracemalloc and a memory report follows the latencies.
+# Latencies are much higher then, so measure them in a separate run.
+#
+import argparse
+import json
+import sys
+
+from PyQt5 import QtWidgets
+from canvas.controller import CanvasController
+from canvas.event_trace import TraceReplayer
+from canvas.model import CanvasModel
+from canvas.view import CanvasView
+from memprofile import MemoryProfiler, instrument
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replays a recorded input trace offscreen and reports per-event latencies.")
+    parser.add_argument("trace", help="trace file recorded with Tools > Record input trace")
+    parser.add_argument("--no-paint", action="store_true", help="only measure event handling, not repainting")
+    parser.add_argument("--slowest", type=int, default=10, help="number of slowest events to list")
+    parser.add_argument("--memprofile", nargs="?", const="-", help="measure memory per operation, optionally write it as JSON to this file")
+    parser.add_argument("--top-sites", type=int, default=5, help="number of allocation sites to list per operation")
+    args = parser.parse_args()
+
+    app = QtWidgets.QApplication(sys.argv[:1])
+    canvas = CanvasController(chem_app=None,view=CanvasView(),model=CanvasModel(),)
+    profiler = None
+    if args.memprofile:
+        profiler = MemoryProfiler()
+        instrument(profiler,canvas)
+        profiler.start()
+    replayer = TraceReplayer(canvas,paint=not args.no_paint)
+    replayer.replay(args.trace)
+    canvas.view.tile_renderer.wait_for_done()
+    print(replayer.report(n_slowest=args.slowest))
+    if profiler is not None:
+        profiler.stop()
+        print()
+        print(profiler.report(top_sites=args.top_sites))
+        if args.memprofile != "-":
+            with open(args.memprofile,"w") as f:
+                json.dump(profiler.to_dict(),f,indent=1)
+
+
+if __name__ == '__main__':
+    main()
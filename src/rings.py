@@ -0,0 +1,157 @@
+
+from collections import deque
+from typing import Optional
+
+
+def _shortest_path_avoiding(adj:list[list[tuple[int,int]]], src:int, dst:int, skip_edge:int,) -> Optional[list[int]]:
+    # Breadth first search from src to dst that must not use skip_edge:
+    parent = {src: -1}
+    queue = deque([src])
+    while queue:
+        node = queue.popleft()
+        if node == dst:
+            path = [node]
+            while parent[node] != -1:
+                node = parent[node]
+                path.append(node)
+            return path[::-1]
+        for nb,e in adj[node]:
+            if e != skip_edge and nb not in parent:
+                parent[nb] = node
+                queue.append(nb)
+    return None
+
+
+def smallest_rings(n_atoms:int, edges:list[tuple[int,int]]) -> list[list[int]]:
+    """
+    Perceives the smallest set of smallest rings (SSSR) of a molecular
+    graph. Every bond contributes the shortest ring through it as a
+    candidate. The candidates are then taken smallest first as long as
+    they are linearly independent (over GF(2), with every ring as the
+    set of its bonds), until there are as many rings as the graph has
+    independent cycles. Should these candidates not suffice, Horton's
+    candidates are added. Returns every ring as its atoms in ring order.
+
+    >>> # naphthalene: two fused six-membered rings
+    >>> edges = [(0,1),(1,2),(2,3),(3,4),(4,5),(5,0),(4,6),(6,7),(7,8),(8,9),(9,5)]
+    >>> sorted(sorted(ring) for ring in smallest_rings(10,edges))
+    [[0, 1, 2, 3, 4, 5], [4, 5, 6, 7, 8, 9]]
+    >>> smallest_rings(3,[(0,1),(1,2)])
+    []
+    >>> len(smallest_rings(5,[(1,2),(2,4),(2,3),(0,1),(0,3),(3,4),(0,4),(0,2)]))
+    4
+    """
+    parent = list(range(n_atoms))
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+    n_components = n_atoms
+    for a,b in edges:
+        ra,rb = find(a),find(b)
+        if ra != rb:
+            parent[ra] = rb
+            n_components -= 1
+    n_rings = len(edges) - n_atoms + n_components
+    if n_rings <= 0:
+        return []
+
+    # Atoms with a single neighbor are not part of any ring, nor is
+    # that neighbor once they are gone. Peeling them off leaves only
+    # ring atoms and the chains between rings (the 2-core):
+    degree = [0] * n_atoms
+    for a,b in edges:
+        degree[a] += 1
+        degree[b] += 1
+    neighbors:list[list[int]] = [[] for _ in range(n_atoms)]
+    for a,b in edges:
+        neighbors[a].append(b)
+        neighbors[b].append(a)
+    peel = [i for i in range(n_atoms) if degree[i] <= 1]
+    removed = [False] * n_atoms
+    while peel:
+        i = peel.pop()
+        if removed[i]:
+            continue
+        removed[i] = True
+        for j in neighbors[i]:
+            degree[j] -= 1
+            if degree[j] == 1 and not removed[j]:
+                peel.append(j)
+
+    adj:list[list[tuple[int,int]]] = [[] for _ in range(n_atoms)]
+    edge_id = {}
+    core = []
+    for e,(a,b) in enumerate(edges):
+        if removed[a] or removed[b]:
+            continue
+        adj[a].append((b,e))
+        adj[b].append((a,e))
+        edge_id[(a,b)] = edge_id[(b,a)] = e
+        core.append(e)
+
+    def add_candidate(path:list[int]) -> None:
+        # Candidate rings as bit sets of their bonds:
+        mask = 0
+        for x,y in zip(path,path[1:] + path[:1]):
+            mask |= 1 << edge_id[(x,y)]
+        candidates.setdefault(mask,path)
+
+    def independent_rings() -> list[list[int]]:
+        rings = []
+        basis:dict[int,int] = {}
+        for mask,path in sorted(candidates.items(),key=lambda kv: (len(kv[1]),sorted(kv[1]))):
+            # Gaussian elimination: a ring is kept if it is not a sum of
+            # the rings kept so far.
+            v = mask
+            while v:
+                pivot = v.bit_length() - 1
+                if pivot not in basis:
+                    basis[pivot] = v
+                    rings.append(path)
+                    break
+                v ^= basis[pivot]
+            if len(rings) == n_rings:
+                break
+        return rings
+
+    candidates:dict[int,list[int]] = {}
+    for e in core:
+        a,b = edges[e]
+        path = _shortest_path_avoiding(adj,a,b,e)
+        if path is not None:
+            # (Bonds that are not part of any ring are bridges)
+            add_candidate(path)
+    rings = independent_rings()
+    if len(rings) == n_rings:
+        return rings
+
+    # The shortest rings through every bond do not always span all
+    # rings. Horton's candidates do: for every atom v and bond (x,y),
+    # the shortest paths from v to x and from v to y closed by the bond.
+    for v in range(n_atoms):
+        if not adj[v]:
+            continue
+        towards_v = {v: -1}
+        queue = deque([v])
+        while queue:
+            node = queue.popleft()
+            for nb,_ in adj[node]:
+                if nb not in towards_v:
+                    towards_v[nb] = node
+                    queue.append(nb)
+
+        def path_from_v(node:int) -> list[int]:
+            path = [node]
+            while towards_v[node] != -1:
+                node = towards_v[node]
+                path.append(node)
+            return path[::-1]
+
+        for e in core:
+            x,y = edges[e]
+            to_x,to_y = path_from_v(x),path_from_v(y)
+            if len(to_x) + len(to_y) >= 4 and len(set(to_x) | set(to_y)) == len(to_x) + len(to_y) - 1:
+                add_candidate(to_x + to_y[:0:-1])
+    return independent_rings()
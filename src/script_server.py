@@ -0,0 +1,41 @@
+# Drives a headless editor with JSON-RPC requests, one request or batch per line:
+#
+#   python src/script_server.py < commands.jsonl > responses.jsonl
+#   python src/script_server.py --socket /tmp/alchemy.sock
+#
+# A running editor serves the same requests with: python src/app.py --script-socket PATH
+import argparse
+import os
+import sys
+
+from canvas.model import CanvasModel
+from scripting import ScriptSession, serve_stream
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Applies JSON-RPC requests to a headless document.")
+    parser.add_argument("--socket", help="serve on this local socket instead of stdin/stdout")
+    args = parser.parse_args()
+
+    # Rendering only needs fonts, not a display:
+    os.environ.setdefault("QT_QPA_PLATFORM","offscreen")
+    from PyQt5 import QtWidgets
+    from canvas.export import VectorExporter
+    from canvas.view import ChemStyle
+
+    app = QtWidgets.QApplication(sys.argv[:1])
+    model = CanvasModel()
+    exporter = VectorExporter(ChemStyle())
+    session = ScriptSession(model,render=lambda path: exporter.export(model,path))
+    if args.socket:
+        from canvas.local_server import ScriptServer
+        server = ScriptServer(session,args.socket)
+        print(f"Serving on {args.socket}",file=sys.stderr)
+        app.exec()
+        server.close()
+    else:
+        serve_stream(session,sys.stdin,sys.stdout)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,214 @@
+
+import json
+import math
+from typing import Callable, Optional
+
+import numpy as np
+
+from canvas.affine import reflection, rotation, scaling
+from canvas.model import CanvasModel
+from core import Atom
+from journal import capture_document
+from smiles import depict_smiles
+
+
+# JSON-RPC 2.0 error codes:
+PARSE_ERROR = -32700
+INVALID_REQUEST = -32600
+METHOD_NOT_FOUND = -32601
+INVALID_PARAMS = -32602
+INTERNAL_ERROR = -32603
+
+
+class ScriptSession:
+    """
+    Executes JSON-RPC 2.0 requests against a CanvasModel, so that
+    other programs can build documents without a mouse. Atoms are
+    addressed by their uid.
+
+    A batch (a JSON array of requests) is applied within a single
+    model transaction, so the canvas is repainted once per batch.
+    Requests of a batch are executed in order, a failing request
+    does not undo the ones before it.
+
+    Rendering needs Qt, so it is done by the render callback, which
+    gets the path to write to. Without it, render requests fail.
+
+    >>> session = ScriptSession(CanvasModel())
+    >>> add = {"jsonrpc":"2.0","id":1,"method":"add_fragment","params":{"symbols":["C","O"],"coords":[[0,0],[30,0]],"bonds":[[0,1]]}}
+    >>> uids = session.handle([add])[0]["result"]
+    >>> session.handle({"jsonrpc":"2.0","id":2,"method":"select","params":[uids]})
+    {'jsonrpc': '2.0', 'id': 2, 'result': 3}
+    >>> session.handle_line('{"jsonrpc":"2.0","id":3,"method":"rotate","params":{"angle":"ninety"}}')
+    '{"jsonrpc":"2.0","id":3,"error":{"code":-32602,"message":"TypeError: angle has to be a number"}}'
+    >>> session.handle_line('{"jsonrpc":"2.0","id":4,"method":"translate","params":[NaN,0]}')
+    '{"jsonrpc":"2.0","id":4,"error":{"code":-32602,"message":"ValueError: dx has to be a finite number"}}'
+    """
+
+    def __init__(self, model:CanvasModel, render:Optional[Callable[[str],None]]=None,) -> None:
+        self.model = model
+        self.render_to = render
+        self.methods = {
+            "add_atom": self.add_atom,
+            "add_bond": self.add_bond,
+            "add_fragment": self.add_fragment,
+            "add_smiles": self.add_smiles,
+            "set_symbol": self.set_symbol,
+            "select": self.select,
+            "clear_selection": self.clear_selection,
+            "translate": self.translate,
+            "rotate": self.rotate,
+            "mirror": self.mirror,
+            "scale": self.scale,
+            "arrange": self.arrange,
+            "document": self.document,
+            "render": self.render,
+        }
+
+    def _atom(self, uid:int) -> Atom:
+        atoms = self.model.find_atoms(uid,"uid")
+        assert atoms, f"There is no atom with uid {uid}"
+        return atoms[0]
+
+    @staticmethod
+    def _finite(value, name:str) -> float:
+        # json accepts NaN and Infinity, which must not reach the model:
+        if isinstance(value,bool) or not isinstance(value,(int,float)):
+            raise TypeError(f"{name} has to be a number")
+        value = float(value)
+        if not math.isfinite(value):
+            raise ValueError(f"{name} has to be a finite number")
+        return value
+
+    def add_atom(self, symbol:str, x:float, y:float) -> int:
+        pos = np.array([self._finite(x,"x"),self._finite(y,"y")])
+        return self.model.add_atom(symbol,pos).atoms[0].uid
+
+    def add_bond(self, fst:int, snd:int, order:float=1) -> None:
+        self.model.add_bond(self._atom(fst),self._atom(snd),self._finite(order,"order"))
+
+    def add_fragment(self, symbols:list[str], coords:list, bonds:list=(), orders:Optional[list]=None, fuse:bool=False,) -> list[int]:
+        # Returns the uid of every fragment atom:
+        coords = np.asarray(coords,dtype=float)
+        if not np.isfinite(coords).all():
+            raise ValueError("coords have to be finite numbers")
+        atoms = self.model.add_fragment_atoms(symbols,coords,bonds,orders=orders,fuse_delta=10 if fuse else None,)
+        return [atm.uid for atm in atoms]
+
+    def add_smiles(self, smiles:list[str]) -> dict:
+        """
+        Depicts the structures and packs them below the document.
+        Returns the number of structures added and the indexes of the
+        SMILES that could not be read.
+        """
+        frags = depict_smiles(smiles)
+        self.model.add_fragments([frag for frag in frags if frag is not None])
+        failed = [i for i,frag in enumerate(frags) if frag is None]
+        return {"added": len(frags) - len(failed),"failed": failed}
+
+    def set_symbol(self, uid:int, symbol:str) -> None:
+        self.model.set_atom_symbol(self._atom(uid),symbol)
+
+    def select(self, uids:list[int], add:bool=False) -> int:
+        """
+        Selects the given atoms and all bonds between them. Returns
+        the number of selected items.
+        """
+        atoms = [self._atom(uid) for uid in uids]
+        selected = {id(atm) for atm in atoms}
+        mols = {id(mol): mol for mol in map(self.model.mol_of_atom,atoms) if mol is not None}
+        bonds = [bnd for mol in mols.values() for bnd in mol.bonds if id(bnd.fst) in selected and id(bnd.snd) in selected]
+        items = atoms + bonds
+        if add:
+            already = {id(itm) for itm in self.model.selection}
+            items = self.model.selection + [itm for itm in items if id(itm) not in already]
+        self.model.set_selection(items)
+        return len(items)
+
+    def clear_selection(self) -> None:
+        self.model.set_selection([])
+
+    def translate(self, dx:float, dy:float) -> None:
+        self.model.preview_transform(np.eye(2),(self._finite(dx,"dx"),self._finite(dy,"dy")))
+        self.model.commit_transform()
+
+    def rotate(self, angle:float) -> None:
+        self.model.transform_selection(rotation(self._finite(angle,"angle")))
+
+    def mirror(self, axis_angle:float) -> None:
+        self.model.transform_selection(reflection(self._finite(axis_angle,"axis_angle")))
+
+    def scale(self, factor:float) -> None:
+        factor = self._finite(factor,"factor")
+        if factor <= 0:
+            raise ValueError("factor has to be positive")
+        self.model.transform_selection(scaling(factor))
+
+    def arrange(self) -> None:
+        self.model.arrange()
+
+    def document(self) -> dict:
+        return capture_document(self.model)
+
+    def render(self, path:str) -> str:
+        assert self.render_to is not None, "Rendering is not available in this session"
+        self.render_to(path)
+        return path
+
+    def _call(self, request) -> Optional[dict]:
+        # Returns the response to a single request, None for notifications:
+        if not isinstance(request,dict) or request.get("jsonrpc") != "2.0" or not isinstance(request.get("method"),str):
+            return self._error(None,INVALID_REQUEST,"Invalid request")
+        rid = request.get("id")
+        method = self.methods.get(request["method"])
+        if method is None:
+            result = self._error(rid,METHOD_NOT_FOUND,f"Unknown method {request['method']}")
+        else:
+            params = request.get("params",[])
+            try:
+                value = method(**params) if isinstance(params,dict) else method(*params)
+                result = {"jsonrpc": "2.0","id": rid,"result": value}
+            except (AssertionError,TypeError,ValueError,KeyError,IndexError) as e:
+                result = self._error(rid,INVALID_PARAMS,f"{type(e).__name__}: {e}")
+            except Exception as e:
+                result = self._error(rid,INTERNAL_ERROR,f"{type(e).__name__}: {e}")
+        return result if "id" in request else None
+
+    @staticmethod
+    def _error(rid, code:int, message:str) -> dict:
+        return {"jsonrpc": "2.0","id": rid,"error": {"code": code,"message": message}}
+
+    def handle(self, message):
+        """
+        Handles a request or a batch of requests and returns the
+        response(s), or None if there is nothing to answer.
+        """
+        if isinstance(message,list):
+            if not message:
+                return self._error(None,INVALID_REQUEST,"Empty batch")
+            with self.model.transaction():
+                responses = [self._call(request) for request in message]
+            return [r for r in responses if r is not None] or None
+        return self._call(message)
+
+    def handle_line(self, line:str) -> Optional[str]:
+        try:
+            message = json.loads(line)
+        except json.JSONDecodeError as e:
+            response = self._error(None,PARSE_ERROR,str(e))
+        else:
+            response = self.handle(message)
+        if response is None:
+            return None
+        return json.dumps(response,separators=(",",":"))
+
+
+def serve_stream(session:ScriptSession, infile, outfile) -> None:
+    # One request or batch per line, one response per line:
+    for line in infile:
+        if not line.strip():
+            continue
+        response = session.handle_line(line)
+        if response is not None:
+            outfile.write(response + "\n")
+            outfile.flush()
@@ -0,0 +1,608 @@
+
+from concurrent.futures import ProcessPoolExecutor
+import math
+import multiprocessing
+import os
+import re
+from typing import Optional
+
+import numpy as np
+
+from canvas.arrange import group_bounding_boxes
+from canvas.model import CanvasModel
+from core import Fragment
+from rings import smallest_rings
+
+
+ORGANIC_SUBSET = {"B","C","N","O","P","S","F","Cl","Br","I"}
+AROMATIC = {"b","c","n","o","p","s","se","as","te"}
+BOND_ORDERS = {"-": 1,"=": 2,"#": 3,"/": 1,"\\": 1,}
+
+_TOKEN = re.compile(r"""
+    (?P<bracket>\[[^\]]*\])
+  | (?P<atom>Cl|Br|[BCNOPSFI]|[bcnops]|\*)
+  | (?P<bond>[-=#$:/\\])
+  | (?P<ring>%\d\d|\d)
+  | (?P<open>\()
+  | (?P<close>\))
+  | (?P<dot>\.)
+""",re.VERBOSE)
+_BRACKET = re.compile(r"\[(\d+)?(se|as|te|[A-Z][a-z]?|[bcnops]|\*)(@+(?:[A-Z]{2}\d+)?)?(H\d*)?([+-]+\d*)?(:\d+)?\]")
+
+
+def parse_smiles(smiles:str) -> tuple[list[str],list[tuple[int,int]],list[int]]:
+    """
+    Parses a SMILES string into atom symbols, bonds (index pairs) and
+    bond orders. Aromatic rings are kekulized. Charges, isotopes and
+    stereo descriptors are read but dropped (charges only serve the
+    kekulization), since the editor has no notion of them; hydrogens
+    follow from the valences again.
+
+    >>> parse_smiles("CC(=O)O")
+    (['C', 'C', 'O', 'O'], [(0, 1), (1, 2), (1, 3)], [1, 2, 1])
+    >>> symbols,bonds,orders = parse_smiles("c1ccncc1")
+    >>> symbols, sorted(orders)
+    (['C', 'C', 'C', 'N', 'C', 'C'], [1, 1, 1, 2, 2, 2])
+    >>> sorted(parse_smiles("C[n+]1ccccc1")[2])
+    [1, 1, 1, 1, 2, 2, 2]
+    """
+    symbols:list[str] = []
+    aromatic:list[bool] = []
+    explicit_hs:list[int] = []
+    charges:list[int] = []
+    bonds:list[tuple[int,int]] = []
+    orders:list[Optional[int]] = []
+    branches:list[int] = []
+    open_rings:dict[str,tuple[int,Optional[int]]] = {}
+    prev:Optional[int] = None
+    bond:Optional[int] = None
+
+    def add_bond(a:int, b:int, order:Optional[int]) -> None:
+        assert a != b and (a,b) not in bonds and (b,a) not in bonds, f"Invalid SMILES {smiles!r}: duplicate bond"
+        bonds.append((a,b))
+        # Unspecified bonds between aromatic atoms are aromatic (None):
+        if order is None and not (aromatic[a] and aromatic[b]):
+            order = 1
+        orders.append(order)
+
+    pos = 0
+    smiles = smiles.strip()
+    while pos < len(smiles):
+        m = _TOKEN.match(smiles,pos)
+        assert m, f"Invalid SMILES {smiles!r} at position {pos}"
+        pos = m.end()
+        kind,text = m.lastgroup,m.group()
+        if kind in ("atom","bracket"):
+            if kind == "bracket":
+                b = _BRACKET.fullmatch(text)
+                assert b, f"Invalid SMILES {smiles!r}: bad atom {text}"
+                symbol = b.group(2)
+                hs = b.group(4)
+                n_h = 0 if hs is None else int(hs[1:] or 1)
+                charge = b.group(5) or ""
+                sign = -1 if charge.startswith("-") else 1
+                charge = sign * (int(charge.lstrip("+-")) if charge.lstrip("+-") else len(charge))
+            else:
+                symbol,n_h,charge = text,-1,0
+            is_aromatic = symbol in AROMATIC
+            if is_aromatic:
+                symbol = symbol.capitalize()
+            elif kind == "bracket":
+                assert symbol == "*" or symbol[0].isupper(), f"Invalid SMILES {smiles!r}: bad atom {text}"
+            symbols.append(symbol)
+            aromatic.append(is_aromatic)
+            explicit_hs.append(n_h)
+            charges.append(charge)
+            if prev is not None:
+                add_bond(prev,len(symbols)-1,bond)
+            prev,bond = len(symbols)-1,None
+        elif kind == "bond":
+            assert text != "$", f"Invalid SMILES {smiles!r}: quadruple bonds are not supported"
+            bond = BOND_ORDERS.get(text)
+        elif kind == "ring":
+            assert prev is not None, f"Invalid SMILES {smiles!r}: ring closure without atom"
+            if text in open_rings:
+                other,other_bond = open_rings.pop(text)
+                add_bond(other,prev,bond if bond is not None else other_bond)
+            else:
+                open_rings[text] = (prev,bond)
+            bond = None
+        elif kind == "open":
+            assert prev is not None, f"Invalid SMILES {smiles!r}: branch without atom"
+            branches.append(prev)
+        elif kind == "close":
+            assert branches, f"Invalid SMILES {smiles!r}: unbalanced parentheses"
+            prev,bond = branches.pop(),None
+        else:
+            prev,bond = None,None
+    assert not branches, f"Invalid SMILES {smiles!r}: unbalanced parentheses"
+    assert not open_rings, f"Invalid SMILES {smiles!r}: unclosed ring {next(iter(open_rings))}"
+    return symbols,bonds,_kekulize(symbols,aromatic,explicit_hs,charges,bonds,orders)
+
+
+def _kekulize(symbols:list[str], aromatic:list[bool], explicit_hs:list[int], charges:list[int], bonds:list[tuple[int,int]], orders:list[Optional[int]],) -> list[int]:
+    # Aromatic bonds (None) become single or double bonds such that
+    # every aromatic atom that needs a double bond gets exactly one.
+    aromatic_bonds = [k for k,order in enumerate(orders) if order is None]
+    if not aromatic_bonds:
+        return orders
+    degree = [0] * len(symbols)
+    has_double = [False] * len(symbols)
+    for (a,b),order in zip(bonds,orders):
+        degree[a] += 1
+        degree[b] += 1
+        if order == 2:
+            has_double[a] = has_double[b] = True
+
+    def needs_double(i:int) -> bool:
+        if not aromatic[i] or has_double[i]:
+            return False
+        if symbols[i] in ("C","B"):
+            # Unlike e.g. the carbanion of [cH-]1cccc1:
+            return charges[i] == 0
+        # An atom needs a double bond if one connection is left after
+        # its neighbors and hydrogens, with a positive charge adding one
+        # (pyridine-like n, [n+](C) and [nH+], pyrylium [o+]), unlike
+        # pyrrole-like [nH] or n(C), and furan-like o:
+        if symbols[i] in ("N","P","As"):
+            return degree[i] + max(explicit_hs[i],0) == 2 + charges[i]
+        if symbols[i] in ("O","S","Se","Te"):
+            return degree[i] + max(explicit_hs[i],0) == 1 + charges[i]
+        return False
+
+    needy = [i for i in range(len(symbols)) if needs_double(i)]
+    neighbors:dict[int,list[tuple[int,int]]] = {i: [] for i in needy}
+    for k in aromatic_bonds:
+        a,b = bonds[k]
+        if a in neighbors and b in neighbors:
+            neighbors[a].append((b,k))
+            neighbors[b].append((a,k))
+
+    # A perfect matching by backtracking, always continuing with the
+    # most constrained atom. For aromatic systems, forced choices
+    # propagate and hardly any backtracking happens:
+    matched:dict[int,int] = {}
+
+    def solve(system:list[int], budget:list[int]) -> bool:
+        best,best_free = None,None
+        for i in system:
+            if i in matched:
+                continue
+            free = [(j,k) for j,k in neighbors[i] if j not in matched]
+            if best is None or len(free) < len(best_free):
+                best,best_free = i,free
+                if len(free) <= 1:
+                    break
+        if best is None:
+            return True
+        for j,k in best_free:
+            budget[0] -= 1
+            if budget[0] < 0:
+                return False
+            matched[best],matched[j] = k,k
+            if solve(system,budget):
+                return True
+            del matched[best],matched[j]
+        return False
+
+    # Aromatic systems that are not connected can be matched on their
+    # own. A system without a matching (e.g. an invalid SMILES) falls
+    # back to single bonds like the molfile reader does for aromatic
+    # bonds, without affecting the other systems:
+    double = set()
+    seen = set()
+    for start in needy:
+        if start in seen:
+            continue
+        system = [start]
+        seen.add(start)
+        for i in system:
+            for j,_ in neighbors[i]:
+                if j not in seen:
+                    seen.add(j)
+                    system.append(j)
+        if len(system) < 900 and solve(system,[10000]):
+            double.update(matched[i] for i in system)
+        else:
+            for i in system:
+                matched.pop(i,None)
+    return [order if order is not None else (2 if k in double else 1) for k,order in enumerate(orders)]
+
+
+def layout_tree(n_atoms:int, bonds:list[tuple[int,int]], orders:list[int],) -> tuple[np.ndarray,np.ndarray,np.ndarray]:
+    """
+    Plans the 2D depiction of a molecular graph: every atom is placed
+    one bond length from its parent atom, in a direction (degrees)
+    that keeps angles at multiples of 30°. Chains zig-zag at 120°,
+    rings become regular polygons and fused rings are attached on
+    the far side of the shared bond. Returns parent (-1 for the first
+    atom of every component), direction and depth of every atom.
+
+    >>> parent,angle,depth = layout_tree(4,[(0,1),(1,2),(2,3)],[1,1,1])
+    >>> parent.tolist(), angle.tolist(), depth.tolist()
+    ([-1, 0, 1, 2], [0.0, 30.0, 330.0, 30.0], [0, 1, 2, 3])
+    """
+    adj:list[list[tuple[int,int]]] = [[] for _ in range(n_atoms)]
+    for k,(a,b) in enumerate(bonds):
+        adj[a].append((b,k))
+        adj[b].append((a,k))
+    rings = smallest_rings(n_atoms,bonds)
+    rings_of_atom:list[list[int]] = [[] for _ in range(n_atoms)]
+    for r,ring in enumerate(rings):
+        for a in ring:
+            rings_of_atom[a].append(r)
+    ring_placed = [False] * len(rings)
+
+    parent = np.full(n_atoms,-1,dtype=int)
+    angle = np.zeros(n_atoms)
+    depth = np.zeros(n_atoms,dtype=int)
+    placed = [False] * n_atoms
+    zig = [1] * n_atoms
+    # Bonds drawn at every atom so far, as (direction,neighbor):
+    dirs:list[list[tuple[float,int]]] = [[] for _ in range(n_atoms)]
+    # Ring edges as (a,b) -> (direction a->b, side of the ring: +1 left):
+    edges:dict[tuple[int,int],tuple[float,int]] = {}
+    stack:list[int] = []
+
+    def put(c:int, p:int, direction:float, z:int=1) -> None:
+        direction %= 360
+        placed[c] = True
+        parent[c],angle[c],depth[c],zig[c] = p,direction,depth[p] + 1,z
+        dirs[p].append((direction,c))
+        dirs[c].append(((direction + 180) % 360,p))
+        stack.append(c)
+
+    def walk(ring:list[int], direction:float, side:int, step:float) -> None:
+        # Walks the ring from ring[1] on, ring[0]->ring[1] pointing
+        # in direction. Every step turns by step towards side:
+        for prev,c in zip(ring[1:],ring[2:] + ring[:1]):
+            direction += side * step
+            edges[(prev,c)] = (direction % 360,side)
+            if not placed[c]:
+                put(c,prev,direction)
+            elif all(nb != c for _,nb in dirs[prev]):
+                dirs[prev].append((direction % 360,c))
+                dirs[c].append(((direction + 180) % 360,prev))
+
+    def place_ring_system(a:int, r:int, theta:float) -> None:
+        # The first ring is entered at a, with its centre in direction theta:
+        ring = rings[r]
+        i = ring.index(a)
+        ring = ring[i:] + ring[:i]
+        step = 360 / len(ring)
+        first = theta - (180 - step) / 2
+        edges[(a,ring[1])] = (first % 360,1)
+        if not placed[ring[1]]:
+            put(ring[1],a,first)
+        walk(ring,first,1,step)
+        ring_placed[r] = True
+
+        # Rings sharing a bond with placed rings are fused on the
+        # other side of that bond:
+        progress = True
+        while progress:
+            progress = False
+            for r2 in {r2 for ring in rings for x in ring for r2 in rings_of_atom[x] if placed[x]}:
+                if ring_placed[r2]:
+                    continue
+                ring = rings[r2]
+                for p,q in zip(ring,ring[1:] + ring[:1]):
+                    if (q,p) in edges:
+                        p,q = q,p
+                    elif (p,q) not in edges:
+                        continue
+                    direction,side = edges[(p,q)]
+                    i = ring.index(p)
+                    ring = ring[i:] + ring[:i]
+                    if ring[1] != q:
+                        ring = ring[:1] + ring[:0:-1]
+                    walk(ring,direction,-side,360 / len(ring))
+                    ring_placed[r2] = progress = True
+                    break
+
+    def outward(a:int) -> float:
+        # The direction into the widest gap between the bonds drawn at
+        # a, preferring gaps that are not the inside of a ring (e.g. at
+        # an atom shared by three fused rings):
+        if not dirs[a]:
+            return 90.
+        ds = sorted(dirs[a])
+        insides = set()
+        for r in rings_of_atom[a]:
+            i = rings[r].index(a)
+            insides.add(frozenset((rings[r][i-1],rings[r][(i+1) % len(rings[r])])))
+        best,best_key = 0.,None
+        for i,(d,nb) in enumerate(ds):
+            d2,nb2 = ds[i+1] if i + 1 < len(ds) else (ds[0][0] + 360,ds[0][1])
+            key = (frozenset((nb,nb2)) not in insides,round(d2 - d,6))
+            if best_key is None or key > best_key:
+                best,best_key = (d + d2) / 2,key
+        return best
+
+    def visit(a:int) -> None:
+        for r in rings_of_atom[a]:
+            if not ring_placed[r]:
+                place_ring_system(a,r,outward(a) if dirs[a] else 90.)
+        free = [(c,k) for c,k in adj[a] if not placed[c]]
+        if not free:
+            return
+        m = len(free)
+        if len(dirs[a]) <= 1 and not rings_of_atom[a]:
+            # Chain atoms continue the direction they were reached in:
+            if dirs[a]:
+                theta,z = (dirs[a][0][0] + 180) % 360,zig[a]
+                in_order = orders[next(k for c,k in adj[a] if c == dirs[a][0][1])]
+            else:
+                theta,z,in_order = -30.,1,1
+            if m == 1:
+                c,k = free[0]
+                linear = 3 in (in_order,orders[k]) or in_order == orders[k] == 2
+                offsets = [0] if linear and dirs[a] else [z * 60]
+            elif m == 2:
+                offsets = [z * 60,-z * 60]
+            elif m == 3:
+                offsets = [-90,0,90]
+            else:
+                offsets = [-180 + 360 * (i+1) / (m+1) for i in range(m)]
+            for (c,k),offset in zip(free,offsets):
+                put(c,a,theta + offset,-int(np.sign(offset)) if offset else zig[a])
+        else:
+            out = outward(a)
+            # Chains leaving a ring turn away from the more crowded
+            # side, e.g. from a neighboring substituent:
+            crowd = sum(len(adj[nb]) * (1 if (d - out) % 360 < 180 else -1) for d,nb in dirs[a])
+            spread = 60 if m <= 3 else 180 / m
+            for i,(c,k) in enumerate(free):
+                put(c,a,out + (i - (m-1) / 2) * spread,-1 if crowd > 0 else 1)
+
+    for root in _roots(n_atoms,adj,rings_of_atom):
+        if placed[root]:
+            continue
+        placed[root] = True
+        stack.append(root)
+        while stack:
+            visit(stack.pop())
+    return parent,angle,depth
+
+
+def _roots(n_atoms:int, adj:list, rings_of_atom:list) -> list[int]:
+    # Components start at a ring atom if they have rings, at a chain
+    # end otherwise, so that chains are laid out from end to end:
+    seen = [False] * n_atoms
+    roots = []
+    for start in range(n_atoms):
+        if seen[start]:
+            continue
+        comp = [start]
+        seen[start] = True
+        for a in comp:
+            for b,_ in adj[a]:
+                if not seen[b]:
+                    seen[b] = True
+                    comp.append(b)
+        ring_atoms = [a for a in comp if rings_of_atom[a]]
+        ends = [a for a in comp if len(adj[a]) <= 1]
+        roots.append(ring_atoms[0] if ring_atoms else (ends[0] if ends else comp[0]))
+    return roots
+
+
+def tree_coordinates(parent:np.ndarray, angle:np.ndarray, depth:np.ndarray, bond_length:float,) -> np.ndarray:
+    """
+    Turns planned depictions into coordinates. Atoms of the same
+    depth are placed all at once, so a batch of many molecules
+    (concatenated, with parents offset accordingly) takes one
+    vectorized step per depth level.
+
+    >>> tree_coordinates(np.array([-1,0,1]),np.array([0.,0.,90.]),np.array([0,1,2]),2.).round(6).tolist()
+    [[0.0, 0.0], [2.0, 0.0], [2.0, 2.0]]
+    """
+    rad = np.radians(angle)
+    step = bond_length * np.stack([np.cos(rad),np.sin(rad)],axis=1)
+    pos = np.zeros((len(parent),2))
+    order = np.argsort(depth,kind="stable")
+    bounds = np.searchsorted(depth[order],np.arange(int(depth.max(initial=0)) + 2))
+    for d in range(1,len(bounds) - 1):
+        idx = order[bounds[d]:bounds[d+1]]
+        pos[idx] = pos[parent[idx]] + step[idx]
+    return pos
+
+
+def _layout_defects(pos:np.ndarray, bonds:list[tuple[int,int]], bond_length:float,) -> float:
+    # Sums up (in bond lengths) how far bonds are stretched or squeezed
+    # beyond a tolerance and how far unbonded atom pairs come closer
+    # than 0.8 bond lengths, so it is 0 for a clean depiction:
+    n = len(pos)
+    if n < 2:
+        return 0.
+    pairs = np.array(bonds,dtype=int).reshape((-1,2))
+    lengths = np.linalg.norm(pos[pairs[:,0]] - pos[pairs[:,1]],axis=1) / bond_length
+    dist = np.linalg.norm(pos[:,None] - pos[None],axis=2) / bond_length
+    dist[pairs[:,0],pairs[:,1]] = dist[pairs[:,1],pairs[:,0]] = np.inf
+    close = np.triu(np.maximum(0.8 - dist,0),1)
+    return float(np.maximum(np.abs(lengths - 1) - 0.2,0).sum() + close.sum())
+
+
+def relax_layout(pos:np.ndarray, bonds:list[tuple[int,int]], bond_length:float, iterations:int=100,) -> np.ndarray:
+    """
+    Moves the atoms of a depiction towards ideal distances by stress
+    majorization: bonded atoms bond_length apart, atoms of a common
+    ring as in a regular polygon and all other atoms as in a zig-zag
+    chain along the shortest path between them. Closer atom pairs
+    weigh more, so local geometry wins over distant pairs.
+    This is what bridged ring systems (e.g. norbornane or adamantane)
+    get, since they cannot be drawn with regular polygons. Besides
+    pos, the relaxation starts from barycentric layouts around the
+    largest rings, and the result with the fewest defects is kept.
+
+    >>> bonds = [(0,1),(1,2),(2,3),(3,4),(4,5),(5,0),(0,6),(6,3)]
+    >>> _layout_defects(relax_layout(np.zeros((7,2)),bonds,1.),bonds,1.)
+    0.0
+    """
+    n = len(pos)
+    adj:list[list[int]] = [[] for _ in range(n)]
+    for a,b in bonds:
+        adj[a].append(b)
+        adj[b].append(a)
+    # Graph distances by breadth first search from every atom:
+    hops = np.full((n,n),np.inf)
+    for start in range(n):
+        hops[start,start] = 0
+        front = [start]
+        while front:
+            following = []
+            for a in front:
+                for b in adj[a]:
+                    if hops[start,b] == np.inf:
+                        hops[start,b] = hops[start,a] + 1
+                        following.append(b)
+            front = following
+    # Atoms of different components do not pull at each other:
+    connected = np.isfinite(hops) & (hops > 0)
+    target = np.where(connected,np.where(hops > 1,hops * math.sqrt(3) / 2,hops),0) * bond_length
+    rings = smallest_rings(n,bonds)
+    for ring in rings:
+        k = len(ring)
+        steps = np.abs(np.arange(k)[:,None] - np.arange(k)[None])
+        chords = bond_length * np.sin(np.pi * steps / k) / np.sin(np.pi / k)
+        idx = np.array(ring)
+        target[np.ix_(idx,idx)] = np.minimum(target[np.ix_(idx,idx)],chords)
+    weight = np.where(connected,1 / np.where(connected,target,1)**2,0)
+    inverse = np.linalg.pinv(np.diag(weight.sum(axis=1)) - weight)
+
+    starts = [pos]
+    for ring in sorted(rings,key=len,reverse=True)[:3]:
+        # Tutte's barycentric layout: the ring is a regular polygon and
+        # every other atom of its component sits at the mean position
+        # of its neighbors, which untangles planar ring systems:
+        k = len(ring)
+        fixed = ~np.isfinite(hops[ring[0]])
+        fixed[ring] = True
+        start = pos.copy()
+        t = 2 * np.pi * np.arange(k) / k
+        start[ring] = bond_length / (2 * np.sin(np.pi / k)) * np.stack([np.cos(t),np.sin(t)],axis=1)
+        system = np.eye(n)
+        for i in np.flatnonzero(~fixed):
+            system[i,i] = len(adj[i])
+            system[i,adj[i]] -= 1
+        start[~fixed] = 0
+        starts.append(np.linalg.solve(system,start))
+
+    # All starts are relaxed at once, atoms on top of each other get a
+    # little noise since they have no direction to move apart in:
+    x = np.stack(starts) + np.random.default_rng(0).normal(scale=1e-2 * bond_length,size=(len(starts),n,2))
+    for _ in range(iterations):
+        dist = np.linalg.norm(x[:,:,None] - x[:,None],axis=3)
+        b = -np.where(dist > 0,weight * target / np.where(dist > 0,dist,1),0)
+        b[:,np.arange(n),np.arange(n)] = -b.sum(axis=2)
+        x_new = inverse @ b @ x
+        converged = np.abs(x_new - x).max() < 1e-4 * bond_length
+        x = x_new
+        if converged:
+            break
+    stress = np.sum(weight * (np.linalg.norm(x[:,:,None] - x[:,None],axis=3) - target)**2,axis=(1,2))
+    best = min(range(len(x)),key=lambda i: (_layout_defects(x[i],bonds,bond_length),stress[i]))
+    return x[best]
+
+
+def depict(graphs:list[tuple[list[str],list[tuple[int,int]],list[int]]], bond_length:float=CanvasModel.BOND_LENGTH,) -> list[Fragment]:
+    """
+    Computes 2D coordinates for a batch of molecular graphs (symbols,
+    bonds, orders). Disconnected parts (salts, mixtures) are put next
+    to each other from left to right.
+    """
+    parents,angles,depths,offsets = [],[],[],[0]
+    for symbols,bonds,orders in graphs:
+        parent,angle,depth = layout_tree(len(symbols),bonds,orders)
+        parents.append(np.where(parent >= 0,parent + offsets[-1],-1))
+        angles.append(angle)
+        depths.append(depth)
+        offsets.append(offsets[-1] + len(symbols))
+    if not offsets[-1]:
+        return [Fragment(symbols,np.zeros((0,2)),np.zeros((0,2),dtype=int),[]) for symbols,_,_ in graphs]
+    parent,angle,depth = np.concatenate(parents),np.concatenate(angles),np.concatenate(depths)
+    pos = tree_coordinates(parent,angle,depth,bond_length)
+    # The tree cannot close bridged ring systems, and crowded parts
+    # may overlap. Such depictions are relaxed instead, if that helps:
+    for i,(symbols,bonds,orders) in enumerate(graphs):
+        part = pos[offsets[i]:offsets[i+1]]
+        if len(part) > 250:
+            continue
+        defects = _layout_defects(part,bonds,bond_length)
+        if defects:
+            relaxed = relax_layout(part,bonds,bond_length)
+            if _layout_defects(relaxed,bonds,bond_length) < defects:
+                pos[offsets[i]:offsets[i+1]] = relaxed
+
+    # Every atom gets the component of its root:
+    comp = np.arange(len(parent))
+    order = np.argsort(depth,kind="stable")
+    non_roots = order[depth[order] > 0]
+    for d in range(1,int(depth.max()) + 1):
+        idx = non_roots[depth[non_roots] == d]
+        comp[idx] = comp[parent[idx]]
+    roots,comp = np.unique(comp,return_inverse=True)
+    lo,hi = group_bounding_boxes(pos,comp,len(roots))
+    # Components are lined up within their graph, bond_length apart:
+    graph_of_root = np.searchsorted(offsets,roots,side="right") - 1
+    width = hi[:,0] - lo[:,0] + bond_length
+    ends = np.cumsum(width)
+    first = np.searchsorted(graph_of_root,graph_of_root)
+    x = ends - width - (ends[first] - width[first])
+    shift = np.stack([x - lo[:,0],-(lo[:,1] + hi[:,1]) / 2],axis=1)
+    pos += shift[comp]
+
+    return [
+        Fragment(symbols,pos[offsets[i]:offsets[i+1]],np.array(bonds,dtype=int).reshape((-1,2)),list(orders))
+        for i,(symbols,bonds,orders) in enumerate(graphs)
+    ]
+
+
+def smiles_to_fragments(smiles:list[str], bond_length:float=CanvasModel.BOND_LENGTH,) -> list[Optional[Fragment]]:
+    """
+    Parses and depicts a batch of SMILES, None for the ones that
+    cannot be parsed.
+
+    >>> frag, bad = smiles_to_fragments(["C1CC1.[Na+]","C1CC"])
+    >>> frag.symbols, frag.bonds.tolist(), bad
+    (['C', 'C', 'C', 'Na'], [[0, 1], [1, 2], [0, 2]], None)
+    """
+    graphs,valid = [],[]
+    for s in smiles:
+        try:
+            graphs.append(parse_smiles(s))
+            valid.append(True)
+        except (AssertionError,ValueError):
+            valid.append(False)
+    frags = iter(depict(graphs,bond_length))
+    return [next(frags) if ok else None for ok in valid]
+
+
+def read_smiles_file(path) -> tuple[list[str],list[str]]:
+    # SMILES files hold one structure per line, optionally followed
+    # by whitespace and a name:
+    smiles,names = [],[]
+    with open(path) as f:
+        for line in f:
+            fields = line.split(None,1)
+            if not fields or fields[0].startswith("#"):
+                continue
+            smiles.append(fields[0])
+            names.append(fields[1].strip() if len(fields) > 1 else "")
+    return smiles,names
+
+
+def depict_smiles(smiles:list[str], workers:int=0, chunk_size:int=1000, bond_length:float=CanvasModel.BOND_LENGTH,) -> list[Optional[Fragment]]:
+    """
+    Like smiles_to_fragments, but large inputs are split into chunks
+    that are parsed and depicted in a process pool.
+    """
+    workers = workers or os.cpu_count() or 1
+    if workers == 1 or len(smiles) <= chunk_size:
+        return smiles_to_fragments(smiles,bond_length)
+    chunks = [smiles[i:i+chunk_size] for i in range(0,len(smiles),chunk_size)]
+    # The editor runs threads (tile rendering, clipboard), and forking
+    # a process with threads is not safe, so workers are spawned:
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=min(workers,len(chunks)),mp_context=context) as pool:
+        results = pool.map(smiles_to_fragments,chunks,[bond_length] * len(chunks))
+        return [frag for chunk in results for frag in chunk]
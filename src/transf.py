@@ -18,6 +18,17 @@ class Transf:
     def zoom_out(self, ):
         self._set_zoom(self._zoom-1)
 
+    def zoom_level(self) -> int:
+        return self._zoom
+
+    def translation(self) -> tuple[float,float]:
+        return self._trans_x, self._trans_y
+
+    def set_state(self, zoom:int, trans_x:float, trans_y:float):
+        self._set_zoom(zoom)
+        self._trans_x = trans_x
+        self._trans_y = trans_y
+
     def panning(self, dx, dy):
         self._trans_x += dx
         self._trans_y += dy
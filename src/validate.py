@@ -0,0 +1,167 @@
+# Checks structure collections against the editor's drawing rules:
+#
+#   python src/validate.py structures.sdf more.mol -o report.jsonl -j 8
+#
+# Every structure is checked for bond lengths (CanvasModel.BOND_LENGTH),
+# bond angles (multiples of 30°, like CanvasModel.acceptable_angle) and
+# valences (from the PSE). The report holds one JSON line per structure
+# followed by a summary line.
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import itertools
+import json
+import math
+import os
+from pathlib import Path
+import sys
+import time
+
+import numpy as np
+
+from canvas.model import CanvasModel
+from core import Angle, acceptable_angles
+from molfile import iter_molblocks, molblock_to_fragment
+from pse import valence_table
+
+
+def neighbor_pairs(n_atoms:int, bonds:np.ndarray) -> tuple[np.ndarray,np.ndarray,np.ndarray]:
+    """
+    Returns all (a,center,c) triples where a and c are two different
+    neighbors of center, each pair once.
+
+    >>> a,b,c = neighbor_pairs(4,np.array([[0,1],[1,2],[1,3]]))
+    >>> np.stack([a,b,c],axis=1).tolist()
+    [[0, 1, 2], [0, 1, 3], [2, 1, 3]]
+    """
+    # Every bond as two half edges (center,other), grouped by center:
+    center = np.concatenate([bonds[:,0],bonds[:,1]])
+    other = np.concatenate([bonds[:,1],bonds[:,0]])
+    order = np.lexsort((np.concatenate([np.arange(len(bonds))]*2),center))
+    center,other = center[order],other[order]
+    degree = np.bincount(center,minlength=n_atoms)
+    group_end = np.cumsum(degree)[center]
+    # Half edge p is paired with all later half edges of its group:
+    pos = np.arange(len(center))
+    counts = group_end - pos - 1
+    first = np.repeat(pos,counts)
+    second = first + 1 + np.arange(len(first)) - np.repeat(np.cumsum(counts) - counts,counts)
+    return other[first],center[first],other[second]
+
+
+def check_structure(frag, bond_length:float, tolerance:float,) -> list[dict]:
+    """
+    Applies all rules to one structure and returns the issues found.
+    """
+    issues = []
+    coords = frag.coords
+    bonds = np.asarray(frag.bonds,dtype=int).reshape((-1,2))
+    orders = np.asarray(frag.orders,dtype=float)
+    n = len(frag.symbols)
+
+    d = coords[bonds[:,1]] - coords[bonds[:,0]]
+    lengths = np.hypot(d[:,0],d[:,1])
+    for i in np.flatnonzero(np.abs(lengths - bond_length) > tolerance * bond_length).tolist():
+        issues.append({"rule": "bond_length","bond": i,"atoms": bonds[i].tolist(),"length": round(float(lengths[i]),3)})
+
+    a,b,c = neighbor_pairs(n,bonds)
+    angles = Angle.enclosed_angles(coords[a],coords[b],coords[c])
+    for i in np.flatnonzero(~acceptable_angles(angles)).tolist():
+        issues.append({"rule": "angle","atom": int(b[i]),"neighbors": [int(a[i]),int(c[i])],"angle": round(float(angles[i]),2)})
+
+    order_sum = np.bincount(bonds.reshape(-1),weights=np.repeat(orders,2),minlength=n)
+    table = valence_table()
+    for i,(symbol,total) in enumerate(zip(frag.symbols,order_sum.tolist())):
+        valences = table.get(symbol)
+        # Same rule as Mol.valence_info: unknown elements are fine, all
+        # others need a valence that covers the bond orders.
+        if valences is not None and not any(v >= math.ceil(total - 0.0001) for v in valences):
+            issues.append({"rule": "valence","atom": i,"symbol": symbol,"bond_order_sum": total})
+    return issues
+
+
+def check_chunk(chunk:list, scale:float, bond_length:float, tolerance:float,) -> list[dict]:
+    # Runs in a worker process. Parsing happens here as well, so the
+    # main process only reads the input and writes the report.
+    results = []
+    for source,record,title,molblock in chunk:
+        result = {"source": source,"record": record,"name": title}
+        try:
+            frag = molblock_to_fragment(molblock)
+        except (AssertionError,ValueError,IndexError) as e:
+            result.update({"ok": False,"issues": [{"rule": "parse","error": repr(e)}]})
+            results.append(result)
+            continue
+        frag.coords = frag.coords * scale
+        issues = check_structure(frag,bond_length,tolerance)
+        result.update({"atoms": len(frag),"bonds": len(frag.orders),"ok": not issues,"issues": issues})
+        results.append(result)
+    return results
+
+
+def iter_records(paths:list[Path]):
+    for path in paths:
+        path = Path(path)
+        files = sorted(path.glob("*.sdf")) + sorted(path.glob("*.mol")) if path.is_dir() else [path]
+        for f in files:
+            for record,(title,molblock) in enumerate(iter_molblocks(f)):
+                yield str(f),record,title,molblock
+
+
+def validate(paths:list[Path], out, workers:int=0, chunk_size:int=200, scale:float=1.0,
+        bond_length:float=CanvasModel.BOND_LENGTH, tolerance:float=0.05,) -> dict:
+    """
+    Streams all structures from paths through a process pool and writes
+    the report to the file object out, in input order. Only a bounded
+    number of chunks is in flight at any time, so memory use does not
+    grow with the size of the collection.
+    """
+    workers = workers or os.cpu_count() or 1
+    records = iter_records(paths)
+    summary = {"structures": 0,"ok": 0,"failed": 0,"issues": {}}
+    t0 = time.perf_counter()
+
+    def write(results):
+        for result in results:
+            out.write(json.dumps(result,separators=(",",":")) + "\n")
+            summary["structures"] += 1
+            summary["ok" if result["ok"] else "failed"] += 1
+            for issue in result["issues"]:
+                summary["issues"][issue["rule"]] = summary["issues"].get(issue["rule"],0) + 1
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        pending = []
+        while True:
+            chunk = list(itertools.islice(records,chunk_size))
+            if chunk:
+                pending.append(pool.submit(check_chunk,chunk,scale,bond_length,tolerance))
+            if pending and (not chunk or len(pending) >= 2 * workers):
+                write(pending.pop(0).result())
+            if not chunk and not pending:
+                break
+
+    summary["seconds"] = round(time.perf_counter() - t0,3)
+    out.write(json.dumps({"summary": summary},separators=(",",":")) + "\n")
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Checks structures against the editor's drawing rules.")
+    parser.add_argument("paths", nargs="+", help="SD files, molfiles or directories containing them")
+    parser.add_argument("-o", "--output", default="-", help="report file (JSON lines), - for stdout")
+    parser.add_argument("-j", "--workers", type=int, default=0, help="worker processes, all cores by default")
+    parser.add_argument("--chunk-size", type=int, default=200, help="structures per task")
+    parser.add_argument("--scale", type=float, default=1.0, help="factor applied to the coordinates before checking")
+    parser.add_argument("--tolerance", type=float, default=0.05, help="accepted relative deviation from BOND_LENGTH")
+    args = parser.parse_args()
+
+    out = sys.stdout if args.output == "-" else open(args.output,"w")
+    try:
+        summary = validate(args.paths,out,workers=args.workers,chunk_size=args.chunk_size,scale=args.scale,tolerance=args.tolerance)
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    print(json.dumps(summary),file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()